@@ -1,9 +1,10 @@
 import yaml
-from typing import Generator, Iterable, NamedTuple, Protocol
+from typing import Generator, Iterable, Mapping, NamedTuple, Protocol
 import urllib.request
 import json
-import boto3
-import botocore
+import glob
+import os
+import pickle
 
 
 def openFileOrUrl(path: str):
@@ -95,6 +96,8 @@ class OkhDesign(NamedTuple):
     bom: frozenset[SupplyAtom]
     tools: frozenset[SupplyAtom]
     bomOutputs: frozenset[SupplyAtom]
+    # (identifier, units per unit of product) for bom atoms that give a quantity
+    bomQuantities: tuple[tuple[str, float], ...] = ()
 
     @staticmethod
     def create(
@@ -103,9 +106,15 @@ class OkhDesign(NamedTuple):
         bom: Iterable[SupplyAtom],
         tools: Iterable[SupplyAtom],
         bomOutput: Iterable[SupplyAtom],
+        bomQuantities: Mapping[str, float] = {},
     ):
         return OkhDesign(
-            name, product, frozenset(bom), frozenset(tools), frozenset(bomOutput)
+            name,
+            product,
+            frozenset(bom),
+            frozenset(tools),
+            frozenset(bomOutput),
+            tuple(sorted(bomQuantities.items())),
         )
 
     @staticmethod
@@ -115,7 +124,18 @@ class OkhDesign(NamedTuple):
         bom = SupplyAtom.parseArray(yml.get("bom-atoms"))
         tools = SupplyAtom.parseArray(yml.get("tool-list-atoms"))
         bomOutput = []  # SupplyAtom.parseArray(yml.get("bom-output-atoms"))
-        return OkhDesign(name, product, bom, tools, bomOutput)
+        bomQuantities = {}
+        for atom in yml.get("bom-atoms") or []:
+            if atom.get("quantity") is not None:
+                bomQuantities[atom.get("identifier")] = atom.get("quantity")
+        return OkhDesign.create(name, product, bom, tools, bomOutput, bomQuantities)
+
+    # units of a bom atom used per unit of the product (1 unless given)
+    def quantityOf(self, atom: SupplyAtom):
+        for identifier, quantity in self.bomQuantities:
+            if identifier == atom.identifier:
+                return quantity
+        return 1
 
     @staticmethod
     def load(path: str):
@@ -167,7 +187,7 @@ class InventorySupplyTree(NamedTuple):
         buffer = " " * indent
         print(
             buffer
-            + "Maker Inventory: {}/{}".format(self.supplier.name, self.product.description)
+            + "Maker Inventory: {}/{}".format(self.maker.name, self.product.description)
         )
 
     def forJson(self):
@@ -255,31 +275,70 @@ class SupplyProblemSpace(NamedTuple):
             yield MissingSupplyTree(product)
 
 
-config = botocore.client.Config(signature_version=botocore.UNSIGNED)
-s3Client = boto3.client("s3", config=config)
+# boto3 is only needed to read from S3, so it is imported on first use
+_s3Client = None
+
+
+def s3Client():
+    global _s3Client
+    if _s3Client is None:
+        import boto3
+        import botocore
+
+        config = botocore.client.Config(signature_version=botocore.UNSIGNED)
+        _s3Client = boto3.client("s3", config=config)
+    return _s3Client
 
 
 def readBucketFolder(bucket: str, prefix: str, parseYaml):
     collection = []
-    paginator = s3Client.get_paginator("list_objects_v2")
+    paginator = s3Client().get_paginator("list_objects_v2")
     iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
     for page in iterator:
         for object in page["Contents"]:
-            obj = s3Client.get_object(Bucket=bucket, Key=object["Key"])
+            obj = s3Client().get_object(Bucket=bucket, Key=object["Key"])
             text = obj["Body"].read()
             yml = yaml.safe_load(text)
             collection.append(parseYaml(yml))
     return collection
 
 
-bucket = "github-helpfulengineering-library"
-okh_designs = readBucketFolder(bucket, "beta/okh", OkhDesign.parse)
-okw_parties = readBucketFolder(bucket, "beta/okw", OkwParty.parse)
+def readLocalFolder(path: str, parseYaml):
+    collection = []
+    for name in sorted(glob.glob(os.path.join(path, "*.y*ml"))):
+        with open(name, "rb") as file_stream:
+            collection.append(parseYaml(yaml.safe_load(file_stream)))
+    return collection
+
+
+# A library is a folder holding an okh folder of designs and an okw folder of
+# parties, either on S3 ("s3://bucket/prefix") or local; or a snapshot of a
+# loaded problem space written by saveSnapshot (a ".pickle" file).
+def loadProblemSpace(source: str) -> SupplyProblemSpace:
+    if source.endswith(".pickle"):
+        with open(source, "rb") as f:
+            return pickle.load(f)
+    if source.startswith("s3://"):
+        (bucket, _, prefix) = source[len("s3://") :].partition("/")
+        prefix = prefix.rstrip("/")
+        designs = readBucketFolder(bucket, prefix + "/okh", OkhDesign.parse)
+        parties = readBucketFolder(bucket, prefix + "/okw", OkwParty.parse)
+    else:
+        designs = readLocalFolder(os.path.join(source, "okh"), OkhDesign.parse)
+        parties = readLocalFolder(os.path.join(source, "okw"), OkwParty.parse)
+    return SupplyProblemSpace.create(parties, designs)
+
+
+def saveSnapshot(space: SupplyProblemSpace, path: str):
+    with open(path, "wb") as f:
+        pickle.dump(space, f, protocol=pickle.HIGHEST_PROTOCOL)
+
 
-problemSpace = SupplyProblemSpace.create(okw_parties, okh_designs)
+if __name__ == "__main__":
+    problemSpace = loadProblemSpace("s3://github-helpfulengineering-library/beta")
 
-results = []
-for supplyTree in problemSpace.query(okh_designs[0].product):
-    results.append(supplyTree.forJson())
+    results = []
+    for supplyTree in problemSpace.query(problemSpace.designs[0].product):
+        results.append(supplyTree.forJson())
 
-print(json.dumps(results))
+    print(json.dumps(results))
@@ -0,0 +1,70 @@
+# bench_memory - Helpful Engineering's Project Data memory benchmark
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measure the memory taken by many supply trees in each of their forms:
+# SupplyTrees, PackedSupplyTrees and StageGraphs.
+#
+#     python bench_memory.py [trees] [breadth] [levels]
+#
+# The trees are complete trees of a synthetic network in which every good
+# has `breadth` suppliers, each needing the two goods of the next level
+# down, for `levels` levels. Memory is measured with tracemalloc.
+
+from stage_graph import *
+import tracemalloc
+
+def syntheticNetwork(breadth,levels):
+    supplies = []
+    for level in range(levels):
+        for j in range(2):
+            good = "g%d_%d" % (level,j)
+            if level + 1 < levels:
+                inputs = ["g%d_0" % (level + 1),"g%d_1" % (level + 1)]
+            else:
+                inputs = []
+            for k in range(breadth):
+                supplies.append(Supply("%s_s%d" % (good,k),[good],inputs,None))
+    return SupplyNetwork("synthetic",supplies)
+
+# Return the result of make() and the bytes allocated while making it
+def measure(make):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = make()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (result,after - before)
+
+def run(n = 2000,breadth = 2,levels = 4):
+    sn = syntheticNetwork(breadth,levels)
+    trees = list(itertools.islice(SupplyProblem("g0_0",sn).completeSupplyTrees(),n))
+    nodes = sum(t.size() for t in trees)
+    table = SupplyTable()
+    (packed,packedBytes) = measure(lambda: [PackedSupplyTree(t,table) for t in trees])
+    # unpacking builds every node afresh, where enumerated trees share subtrees
+    (unpacked,treeBytes) = measure(lambda: [p.unpack() for p in packed])
+    (graphs,graphBytes) = measure(lambda: [StageGraph("g0_0",t) for t in unpacked])
+    print("%d trees, %d nodes" % (len(trees),nodes))
+    for (name,size) in [("SupplyTree",treeBytes),
+                        ("PackedSupplyTree",packedBytes),
+                        ("StageGraph",graphBytes)]:
+        print("%-18s %12d bytes %8.1f bytes/node" % (name,size,size / nodes))
+    return {"nodes": nodes,"SupplyTree": treeBytes,
+            "PackedSupplyTree": packedBytes,"StageGraph": graphBytes}
+
+if __name__ == '__main__':
+    import sys
+    run(*[int(a) for a in sys.argv[1:]])
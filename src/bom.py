@@ -0,0 +1,124 @@
+# bom - Helpful Engineering's Project Data bill-of-materials explosion
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Multi-level bill-of-materials explosion: how many units of every good it
+# takes to make given numbers of units of the goods of some SupplyTrees.
+#
+# Each unit of a node of a tree needs supply.quantityOf(key) units of the
+# subtree under key, so a node is needed in the product of the quantities
+# on the path from its root. Those products are worked out once, when a
+# BOMMatrix is made, and summed by good into a sparse matrix with a row for
+# every good and a column for every tree. The totals for a vector of order
+# quantities (one per tree) are then a single product of that matrix with
+# the vector, however deep the trees are. A second matrix holds only the
+# raw materials: the leaves, and the inputs a tree leaves unfilled (which
+# must be bought in, quantityOf of them per unit of the node).
+#
+# The trees of atoms.py can be exploded too, by the identifiers of their
+# products: each unit of a made tree needs design.quantityOf(atom) units of
+# each of its supplies. They are recognized by their fields, not their
+# classes, so this module does not import atoms.
+#
+# With NumPy and SciPy installed the matrices are SciPy sparse matrices, and
+# a whole matrix of order quantities (one row per scenario) can be rolled
+# up at once. Without them the same sums are done in Python, exactly (so
+# Fraction quantities stay Fractions).
+
+from supply import *
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+# (good, subtree, units per unit of node) for each input of a node of a
+# SupplyTree or of a supply tree of atoms.py; the subtree is None for an
+# input the tree leaves unfilled
+def bomInputs(node):
+    if node is None:
+        return []
+    if hasattr(node,"design"):
+        return [(s.getProduct().identifier,s,node.design.quantityOf(s.getProduct()))
+                for s in node.supplies]
+    if not isinstance(node,SupplyTree):
+        # the supplied, inventory and missing trees of atoms.py
+        return []
+    inputs = [(k,v,node.supply.quantityOf(k)) for (k,v) in node.inputDict.items()]
+    for k in node.supply.inputs:
+        if k not in node.inputDict:
+            inputs.append((k,None,node.supply.quantityOf(k)))
+    return inputs
+
+class BOMMatrix:
+    # trees is a list of (good, SupplyTree) pairs, or of (identifier of the
+    # product, supply tree of atoms.py) pairs
+    def __init__(self,trees):
+        self.goods = []
+        self.goodIndex = {}
+        # (good index, tree index) -> units, for all nodes and for leaves only
+        totals = {}
+        raw = {}
+        for (t,(good,st)) in enumerate(trees):
+            stack = [(good,st,1)]
+            while stack:
+                (g,node,units) = stack.pop()
+                if g not in self.goodIndex:
+                    self.goodIndex[g] = len(self.goods)
+                    self.goods.append(g)
+                cell = (self.goodIndex[g],t)
+                totals[cell] = totals.get(cell,0) + units
+                inputs = bomInputs(node)
+                if not inputs:
+                    raw[cell] = raw.get(cell,0) + units
+                for (k,v,q) in inputs:
+                    stack.append((k,v,units * q))
+        self.trees = len(trees)
+        self.totals = self.matrix(totals)
+        self.raw = self.matrix(raw)
+    def matrix(self,cells):
+        if numpy is None:
+            return cells
+        rows = [g for (g,t) in cells]
+        cols = [t for (g,t) in cells]
+        values = [float(v) for v in cells.values()]
+        return scipy.sparse.csr_matrix((values,(rows,cols)),shape=(len(self.goods),self.trees))
+    # good -> units needed to make quantities[t] units of tree t, for every t;
+    # only the raw materials (the goods at the leaves and unfilled inputs)
+    # if raw is True
+    def rollup(self,quantities,raw = False):
+        m = self.raw if raw else self.totals
+        if numpy is None:
+            result = {}
+            for ((g,t),units) in m.items():
+                if quantities[t]:
+                    good = self.goods[g]
+                    result[good] = result.get(good,0) + units * quantities[t]
+            return result
+        v = m @ numpy.asarray(quantities,dtype=float)
+        return {self.goods[g]: float(v[g]) for g in numpy.flatnonzero(v)}
+    # As rollup, for each row of a matrix of quantities (one row per scenario)
+    def rollupMany(self,quantities,raw = False):
+        if numpy is None:
+            return [self.rollup(q,raw) for q in quantities]
+        m = self.raw if raw else self.totals
+        v = m @ numpy.asarray(quantities,dtype=float).T
+        return [{self.goods[g]: float(v[g,s]) for g in numpy.flatnonzero(v[:,s])}
+                for s in range(v.shape[1])]
+
+# The units of every good needed for n units of good made by one tree
+def explode(good,supplyTree,n = 1,raw = False):
+    return BOMMatrix([(good,supplyTree)]).rollup([n],raw)
@@ -26,11 +26,17 @@
 # Supply objects to be added to some other SupplyNetwork.
 from supply import *
 
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
 import yamale
 
 class OKH:
     # At first this looks ridiculously like a supply, but
     # over time we will provide other methods
+    __slots__ = ("name","outputs","inputs","requiredTooling","eqn")
     def __init__(self,name = None,outputs = [],inputs = [],requiredTooling = [],eqn = "no eqn yet"):
         self.name = name
         self.outputs = frozenset(outputs)
@@ -39,7 +45,9 @@ class OKH:
         self.eqn = eqn
     def fromFile(self,filename):
         okh_yml = yamale.make_data(filename)
-        main = okh_yml[0][0]
+        return self.fromData(okh_yml[0][0])
+    # Fill this OKH in from the main document of an OKH manifest
+    def fromData(self,main):
         self.name = main["title"]
         if "bom" in main:
             self.inputs = main["bom"].split(',')
@@ -53,6 +61,7 @@ class OKH:
         return self
 
 class OKW:
+    __slots__ = ("name","tooling")
     def __init__(self,name,toolingGoods):
         self.name = name
         self.tooling = frozenset(toolingGoods)
@@ -67,23 +76,87 @@ class OKW:
 
 
 # And OKF is a collection of OKHs and OKWs which in particular
-# allows you to compute Supplies
+# allows you to compute Supplies.
+# Rather than checking every OKW against every OKH, we keep two inverted
+# indices: from each tool to the OKHs that require it, and from each tool
+# to the OKWs that have it. An OKW can make an OKH when it has every tool
+# the OKH requires. So the OKHs an OKW can make are the ones all of whose
+# tools are found among the OKW's tools, and the OKWs that can make an OKH
+# are the intersection of the OKWs having each of its tools. Either way the
+# work is proportional to the matching entries of the indices rather than
+# to the number of OKWs times the number of OKHs.
+def requiredToolingOf(okh):
+    # OKH.fromFile leaves None here when the file has no tool-list
+    return frozenset(okh.requiredTooling or [])
+
 class OKF:
     def __init__(self,name,okhs,okws):
         self.name = name
-        self.okhs = okhs
-        self.okws = okws
-    def supplies(self):
+        self.okhs = []
+        self.okws = []
+        # tool -> indices (into okhs) of the OKHs that require it
+        self.okhsByTool = {}
+        # indices of the OKHs that require no tools at all
+        self.untooledOKHs = []
+        # tool -> indices (into okws) of the OKWs that have it
+        self.okwsByTool = {}
+        for h in okhs:
+            self.indexOKH(h)
+        for w in okws:
+            self.indexOKW(w)
+    def indexOKH(self,okh):
+        idx = len(self.okhs)
+        self.okhs.append(okh)
+        tools = requiredToolingOf(okh)
+        for tool in tools:
+            self.okhsByTool.setdefault(tool,[]).append(idx)
+        if not tools:
+            self.untooledOKHs.append(idx)
+        return idx
+    def indexOKW(self,okw):
+        idx = len(self.okws)
+        self.okws.append(okw)
+        for tool in okw.tooling:
+            self.okwsByTool.setdefault(tool,set()).add(idx)
+        return idx
+    # Indices of the OKHs the OKW has the tooling for, in order
+    def okhsMadeBy(self,okw):
+        matched = {}
+        for tool in okw.tooling:
+            for h in self.okhsByTool.get(tool,[]):
+                matched[h] = matched.get(h,0) + 1
+        found = list(self.untooledOKHs)
+        for h,n in matched.items():
+            if n == len(requiredToolingOf(self.okhs[h])):
+                found.append(h)
+        return sorted(found)
+    # Indices of the OKWs that have the tooling for the OKH, in order
+    def okwsMaking(self,okh):
+        tools = requiredToolingOf(okh)
+        if not tools:
+            return list(range(len(self.okws)))
+        having = sorted((self.okwsByTool.get(tool,set()) for tool in tools),key=len)
+        return sorted(set.intersection(*having))
+    def supplyFor(self,okw,okh):
         # Roughly speaking we can produce a Supply named by
         # the okw,good pair whenever the okw has the "tooling"
         # for the okh.
-        ss = []
+        name = okw.name + "|" + okh.name
+        return Supply(name,okh.outputs,okh.inputs,okh.eqn)
+    def iterSupplies(self):
         for w in self.okws:
-            for h in self.okhs:
-                if w.hasToolingFor(h):
-                    name = w.name + "|" + h.name
-                    ss.append(Supply(name,h.outputs,h.inputs,h.eqn))
-        return ss
+            for h in self.okhsMadeBy(w):
+                yield self.supplyFor(w,self.okhs[h])
+    def supplies(self):
+        return list(self.iterSupplies())
+    # Add one OKW or OKH to this OKF, returning only the new Supplies
+    # it makes possible.
+    def addOKW(self,okw):
+        self.indexOKW(okw)
+        return [self.supplyFor(okw,self.okhs[h]) for h in self.okhsMadeBy(okw)]
+    def addOKH(self,okh):
+        self.indexOKH(okh)
+        return [self.supplyFor(self.okws[w],okh) for w in self.okwsMaking(okh)]
 
 
 # Here are a nubmer of .yml files.
@@ -99,3 +172,144 @@ def slurpOKH(filename):
 #    schema = yamale.make_schema('./schema.yaml')
     okh = yamale.make_data(filename)
     return okh
+
+
+# Bulk loading of a library of OKH manifests.
+# sources is a directory (all of its .yml and .yaml files), a glob pattern,
+# a file name, or a list of any of these. The manifests are parsed, and
+# validated against schema (the path of a yamale schema) if one is given,
+# by a pool of processes; each worker compiles the schema only once.
+# If an OKHManifestCache is given, a file whose content hash matches the
+# cache (for the same schema) is not parsed again.
+# loadOKHs returns the OKH objects, in file name order, and a dictionary
+# from the name of each file that could not be loaded to the reason why.
+
+# The fields of the main document that OKH.fromData uses.
+OKH_MANIFEST_FIELDS = ["title","bom","tool-list"]
+
+def okhManifestPaths(sources):
+    if isinstance(sources,str):
+        sources = [sources]
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = (glob.glob(os.path.join(source,"*.yml"))
+                     + glob.glob(os.path.join(source,"*.yaml")))
+            paths.extend(sorted(found))
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source,recursive=True)))
+        else:
+            paths.append(source)
+    return paths
+
+def contentHash(content):
+    return hashlib.sha256(content).hexdigest()
+
+# A persistent map from manifest file name to the content hash of the file
+# and the fields read from it, saved as JSON.
+class OKHManifestCache:
+    def __init__(self,path = None):
+        self.path = path
+        self.schemaHash = None
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.schemaHash = saved["schema"]
+            self.files = saved["files"]
+    # The cached entries are only good for the schema they were checked against
+    def useSchema(self,schemaHash):
+        if schemaHash != self.schemaHash:
+            self.schemaHash = schemaHash
+            self.files = {}
+    def lookup(self,filename,digest):
+        entry = self.files.get(filename)
+        if entry is not None and entry[0] == digest:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+    def store(self,filename,digest,fields):
+        self.files[filename] = [digest,fields]
+    def save(self):
+        if self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp,"w") as f:
+            json.dump({"schema": self.schemaHash,"files": self.files},f)
+        os.replace(tmp,self.path)
+
+# The compiled schema of each worker
+_workerSchema = None
+
+def _initManifestWorker(schemaPath):
+    global _workerSchema
+    _workerSchema = None if schemaPath is None else yamale.make_schema(schemaPath)
+
+# Parse (and validate) one manifest, returning (filename, fields, error).
+# The fields are made plain JSON (so that YAML dates become strings, as
+# they would be once cached) and checked by making an OKH of them, so that
+# a malformed manifest is reported as an error of its own.
+def _parseManifest(task):
+    (filename,text) = task
+    try:
+        data = yamale.make_data(content=text)
+        if _workerSchema is not None:
+            yamale.validate(_workerSchema,data)
+        main = data[0][0]
+        if not isinstance(main,dict) or "title" not in main:
+            return (filename,None,"manifest has no title")
+        fields = {k: main[k] for k in OKH_MANIFEST_FIELDS if k in main}
+        fields = json.loads(json.dumps(fields,default=str))
+        OKH().fromData(fields)
+        return (filename,fields,None)
+    except Exception as e:
+        return (filename,None,str(e))
+
+def loadOKHs(sources,schema = None,cache = None,processes = None):
+    paths = okhManifestPaths(sources)
+    errors = {}
+    fields = {}
+    if cache is not None:
+        schemaHash = None
+        if schema is not None:
+            with open(schema,"rb") as f:
+                schemaHash = contentHash(f.read())
+        cache.useSchema(schemaHash)
+    tasks = []
+    digests = {}
+    for filename in paths:
+        try:
+            with open(filename,"rb") as f:
+                content = f.read()
+        except OSError as e:
+            errors[filename] = str(e)
+            continue
+        digests[filename] = contentHash(content)
+        cached = None if cache is None else cache.lookup(filename,digests[filename])
+        if cached is not None:
+            fields[filename] = cached
+        else:
+            tasks.append((filename,content.decode("utf-8",errors="replace")))
+    if processes == 1 or len(tasks) < 2:
+        _initManifestWorker(schema)
+        parsed = list(map(_parseManifest,tasks))
+    else:
+        with multiprocessing.Pool(processes,
+                                  initializer=_initManifestWorker,
+                                  initargs=(schema,)) as pool:
+            chunksize = max(1,len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+            parsed = pool.map(_parseManifest,tasks,chunksize)
+    for (filename,found,error) in parsed:
+        if error is not None:
+            errors[filename] = error
+        else:
+            fields[filename] = found
+            if cache is not None:
+                cache.store(filename,digests[filename],found)
+    if cache is not None:
+        cache.save()
+    okhs = [OKH().fromData(fields[filename]) for filename in paths if filename in fields]
+    return (okhs,errors)
@@ -0,0 +1,202 @@
+# order_log - Helpful Engineering's Project Data order log (persistent orders)
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Orders and their StageGraphs live in memory. An OrderJournal keeps them
+# on disk as well, as an append-only log of the events that change them
+# (creating an order, asserting a status, scratching, repairing, advancing
+# a stage) plus a periodic snapshot of every order. After a restart, the
+# orders are rebuilt by loading the last snapshot and replaying the events
+# logged after it.
+#
+# The log is a file of JSON lines, one per event, each with a sequence
+# number. Events are buffered and written in batches. A snapshot is written
+# to a temporary file and moved into place, and only then is the log
+# emptied; since replay skips events already covered by the snapshot, a
+# crash at any point leaves a consistent journal. A partly written last line
+# (from a crash in the middle of a batch) is ignored.
+#
+# Supplies are recorded by name, so the journal needs the Supplies (for
+# example those of a SupplyNetwork) to rebuild the orders.
+
+from stage_graph import *
+import json
+import os
+
+def supplyTreeToJson(st):
+    return {"supply": st.supply.name,
+            "inputs": {k: supplyTreeToJson(v) for (k, v) in st.inputDict.items()}}
+
+def supplyTreeFromJson(d,supplies):
+    return SupplyTree(supplies[d["supply"]],
+                      {k: supplyTreeFromJson(v,supplies) for (k, v) in d["inputs"].items()})
+
+def stageGraphToJson(sg):
+    return {"good": sg.good,
+            "supply": sg.curSupply.name,
+            "status": sg.currentStatus.name,
+            "repaired": len(sg.repaired),
+            "inputs": {k: stageGraphToJson(v) for (k, v) in sg.inputDict.items()}}
+
+def stageGraphFromJson(d,supplies):
+    def treeOf(d):
+        return SupplyTree(supplies[d["supply"]],{k: treeOf(v) for (k, v) in d["inputs"].items()})
+    sg = StageGraph(d["good"],treeOf(d))
+    stack = [(d,sg)]
+    while stack:
+        (d,node) = stack.pop()
+        # As in StageGraph.replace, the history of a node refers to the node
+        node.repaired = (node,) * d["repaired"]
+        node.currentStatus = StageStatus[d["status"]]
+        for (k, v) in d["inputs"].items():
+            stack.append((v,node.inputDict[k]))
+    return sg
+
+# The path of a stage is the list of input keys leading to it from the root
+def stagePath(sg):
+    path = []
+    while sg.parent is not None:
+        path.append(sg.good)
+        sg = sg.parent
+    path.reverse()
+    return path
+
+def stageAtPath(root,path):
+    sg = root
+    for key in path:
+        sg = sg.inputDict[key]
+    return sg
+
+class OrderJournal:
+    def __init__(self,path,supplies,snapshotEvery = 10000,batchSize = 1000):
+        self.path = path
+        self.snapshotPath = path + ".snapshot"
+        self.supplies = {s.name: s for s in supplies}
+        self.snapshotEvery = snapshotEvery
+        self.batchSize = batchSize
+        self.orders = {}
+        self.seq = 0
+        self.sinceSnapshot = 0
+        self.buffer = []
+        self.recover()
+        self.log = open(self.path,"a")
+    # Rebuild the orders from the last snapshot and the log
+    def recover(self):
+        snapshotSeq = 0
+        if os.path.exists(self.snapshotPath):
+            with open(self.snapshotPath) as f:
+                snapshot = json.load(f)
+            snapshotSeq = snapshot["seq"]
+            for (orderId,good,tree,stages) in snapshot["orders"]:
+                order = Order(good,supplyTreeFromJson(tree,self.supplies))
+                order.stageGraph = stageGraphFromJson(stages,self.supplies)
+                self.orders[orderId] = order
+        self.seq = snapshotSeq
+        if os.path.exists(self.path):
+            # the end of the last complete line; a crash can leave a torn
+            # line after it, which is cut off so that new events are not
+            # appended to it
+            end = 0
+            with open(self.path,"rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+                    end += len(line)
+                    if event["seq"] > snapshotSeq:
+                        self.apply(event)
+                        self.seq = event["seq"]
+                        self.sinceSnapshot += 1
+            if end < os.path.getsize(self.path):
+                os.truncate(self.path,end)
+    def apply(self,event):
+        kind = event["type"]
+        if kind == "create":
+            order = Order(event["good"],supplyTreeFromJson(event["tree"],self.supplies))
+            self.orders[event["order"]] = order
+            return order
+        sg = self.orders[event["order"]].stageGraph
+        if kind == "status":
+            return sg.assertSupplyStatus(event["supply"],StageStatus[event["status"]])
+        elif kind == "stage":
+            stageAtPath(sg,event["path"]).currentStatus = StageStatus[event["status"]]
+        elif kind == "repair":
+            return sg.repair(event["supply"],supplyTreeFromJson(event["tree"],self.supplies))
+        else:
+            raise ValueError("unknown order event: " + kind)
+    # Apply an event and append it to the log
+    def record(self,event):
+        self.seq += 1
+        event["seq"] = self.seq
+        result = self.apply(event)
+        self.buffer.append(json.dumps(event) + "\n")
+        self.sinceSnapshot += 1
+        if self.sinceSnapshot >= self.snapshotEvery:
+            self.snapshot()
+        elif len(self.buffer) >= self.batchSize:
+            self.flush()
+        return result
+    def create(self,orderId,good,supplyTree):
+        return self.record({"type": "create","order": orderId,"good": good,
+                            "tree": supplyTreeToJson(supplyTree)})
+    def assertSupplyStatus(self,orderId,supplyName,status):
+        return self.record({"type": "status","order": orderId,
+                            "supply": supplyName,"status": status.name})
+    def scratch(self,orderId,supplyName):
+        return self.assertSupplyStatus(orderId,supplyName,StageStatus.FAILED)
+    def repair(self,orderId,supplyName,newSupplyTree):
+        return self.record({"type": "repair","order": orderId,"supply": supplyName,
+                            "tree": supplyTreeToJson(newSupplyTree)})
+    def setStageStatus(self,orderId,sg,status):
+        self.record({"type": "stage","order": orderId,
+                     "path": stagePath(sg),"status": status.name})
+    # As Order.advanceBatch, recording every stage that is advanced
+    def advanceBatch(self,orderId,n = None,priority = None):
+        stages = self.orders[orderId].nextStages(n,priority)
+        for sg in stages:
+            self.setStageStatus(orderId,sg,StageStatus.SUCCEEDED)
+        return stages
+    def advanceOne(self,orderId,priority = None):
+        stages = self.advanceBatch(orderId,1,priority)
+        if stages:
+            return stages[0]
+        else:
+            return None
+    def flush(self,sync = False):
+        if self.buffer:
+            self.log.write("".join(self.buffer))
+            self.buffer = []
+        self.log.flush()
+        if sync:
+            os.fsync(self.log.fileno())
+    # Write a snapshot of every order, after which the log can start over
+    def snapshot(self):
+        self.flush(sync=True)
+        orders = [(orderId,o.stageGraph.good,supplyTreeToJson(o.supplyTree),stageGraphToJson(o.stageGraph))
+                  for (orderId,o) in self.orders.items()]
+        tmp = self.snapshotPath + ".tmp"
+        with open(tmp,"w") as f:
+            json.dump({"seq": self.seq,"orders": orders},f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp,self.snapshotPath)
+        self.log.truncate(0)
+        self.sinceSnapshot = 0
+    def close(self):
+        self.flush(sync=True)
+        self.log.close()
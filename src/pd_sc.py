@@ -25,6 +25,9 @@ from sympy import *
 
 import pprint
 from supply import *
+from bom import *
+from supply_graph import *
+from query_cache import *
 
 # A vary basic set of supplies...
 
@@ -120,6 +123,9 @@ for st in list(SupplyProblem("mask",okf_sn)):
     print(st)
 
 from stage_graph import *
+from order_log import *
+from simulation import *
+from render import *
 
 sgc = StageGraph("chair",sx)
 sgc.assertSupplyStatus("seat_1",StageStatus.FAILED)
@@ -145,7 +151,16 @@ print(sgc)
 o1 = Order("chair",sx)
 
 import unittest
+import unittest.mock
 import copy
+import pickle
+import sys
+import os
+import tempfile
+import json
+import math
+import types
+import typing
 # our basic goal here is to create a bifurcated supply network:
 # C = A union B, where A intersect B = 0.
 # For every good, we want to show:
@@ -172,7 +187,7 @@ class TestStageGraph(unittest.TestCase):
             sp_c = SupplyProblem(g,c)
             cts_c = sp_c.completeSupplyTrees()
             sgs_c = list(map(lambda t: StageGraph(g,t),cts_c))
-            sgs_c = copy.deepcopy(sgs_c)
+            sgs_c = [s.snapshot() for s in sgs_c]
             scratch(sgs_c,a)
             cnt = 0;
             for s in sgs_c:
@@ -195,7 +210,7 @@ class TestStageGraph(unittest.TestCase):
         sgc.scratch("seat_1")
         nms = sgc.namesOfAllSuppliesThatNeedRepair()
         self.assertEqual(len(nms),2)
-        scratched = copy.deepcopy(a)
+        scratched = a.snapshot()
         scratched.scratch("leg_1")
         scratched.scratch("seat_1")
         subs = findAllSubstitutions(scratched,sgc)
@@ -208,7 +223,7 @@ class TestStageGraph(unittest.TestCase):
         c = unionSupplyNetworks(a,b)
         gs = goodTypes(c)
         for g in gs:
-            ca = copy.deepcopy(a)
+            ca = a.snapshot()
             sp_c = SupplyProblem(g,c)
             cts_c = sp_c.completeSupplyTrees()
             sp_a = SupplyProblem(g,a)
@@ -226,6 +241,137 @@ class TestStageGraph(unittest.TestCase):
             print(sgs_a)
             self.assertEqual(len(a_repaired_sgs),len(sgs_a))
 
+class TestStageGraphIndex(unittest.TestCase):
+    def test_onlyHighestFailuresNeedRepair(self):
+        st = SupplyTree(c1,{"leg": SupplyTree(l1,{}),
+                            "seat": SupplyTree(s2,{"fabric": SupplyTree(f1,{}),
+                                                   "plane": SupplyTree(p1,{})}),
+                            "back": SupplyTree(b1,{})})
+        sg = StageGraph("chair",st)
+        self.assertFalse(sg.needsRepair())
+        sg.scratch("fabric_1")
+        self.assertEqual(sg.namesOfAllSuppliesThatNeedRepair(),["fabric_1"])
+        sg.scratch("seat_2")
+        sg.scratch("leg_1")
+        self.assertEqual(sorted(sg.namesOfAllSuppliesThatNeedRepair()),["leg_1","seat_2"])
+        seat = sg.findStageGraphByName("seat_2")
+        self.assertIs(seat.parent,sg)
+        self.assertEqual(seat.namesOfAllSuppliesThatNeedRepair(),["seat_2"])
+        self.assertFalse(seat.assertSupplyStatus("leg_1",StageStatus.SUCCEEDED))
+    def test_indexFollowsRepairs(self):
+        sg = StageGraph("chair",sx)
+        sg.scratch("seat_1")
+        self.assertTrue(sg.repair("seat_1",st_seat_2))
+        self.assertFalse(sg.needsRepair())
+        self.assertIsNone(sg.findStageGraphByName("seat_1"))
+        self.assertEqual(sg.findGoodSuppliedByName("fabric_1"),"fabric")
+        self.assertTrue(sg.repair("seat_2",SupplyTree(s1,{})))
+        self.assertIsNone(sg.findStageGraphByName("fabric_1"))
+        self.assertEqual(sorted(sg.nodesByName),["back_1","chair_1","leg_1","seat_1"])
+    def test_failuresAreReportedInTreeOrder(self):
+        sg = StageGraph("chair",sx)
+        sg.scratch("back_1")
+        sg.scratch("seat_1")
+        sg.scratch("leg_1")
+        self.assertEqual(sg.namesOfAllSuppliesThatNeedRepair(),["leg_1","seat_1","back_1"])
+        self.assertEqual(sg.nameOfSupplyThatNeedsRepair(),"leg_1")
+        # a repaired node is indexed again, but keeps its place in the tree
+        sg.repair("leg_1",SupplyTree(l1,{}))
+        sg.scratch("leg_1")
+        self.assertEqual(sg.namesOfAllSuppliesThatNeedRepair(),["leg_1","seat_1","back_1"])
+        snap = sg.snapshot()
+        snap.repair("leg_1",SupplyTree(l1,{}))
+        snap.scratch("leg_1")
+        self.assertEqual(list(snap.highestFailedNodes())[0].curSupply.name,"leg_1")
+        self.assertEqual(snap.nameOfSupplyThatNeedsRepair(),"leg_1")
+
+class TestSnapshots(unittest.TestCase):
+    def test_networkSnapshotsAreCopiedOnWrite(self):
+        base = SupplyNetwork("A",list(a.supplies))
+        snap = base.snapshot()
+        self.assertIs(snap.supplies,base.supplies)
+        snap.scratch("leg_1")
+        self.assertEqual(len(snap.supplies),len(base.supplies) - 1)
+        base.scratch("seat_1")
+        self.assertIn("seat_1",[s.name for s in snap.supplies])
+    def test_stageGraphSnapshotsDoNotChangeTheOriginal(self):
+        sg = StageGraph("chair",sx)
+        snap = sg.snapshot()
+        snap.scratch("seat_1")
+        snap.scratch("leg_1")
+        self.assertFalse(sg.needsRepair())
+        self.assertEqual(sorted(snap.namesOfAllSuppliesThatNeedRepair()),["leg_1","seat_1"])
+        self.assertTrue(snap.repair("seat_1",st_seat_2))
+        self.assertEqual(snap.namesOfAllSuppliesThatNeedRepair(),["leg_1"])
+        snap.scratch("fabric_1")
+        self.assertEqual(sorted(snap.namesOfAllSuppliesThatNeedRepair()),["fabric_1","leg_1"])
+        self.assertIsNone(sg.findStageGraphByName("fabric_1"))
+        self.assertIn("fabric_1/FAILED",str(snap))
+        self.assertNotIn("FAILED",str(sg))
+        other = sg.snapshot()
+        sg.scratch("back_1")
+        self.assertFalse(other.needsRepair())
+        self.assertEqual(sorted(snap.namesOfAllSuppliesThatNeedRepair()),["fabric_1","leg_1"])
+        self.assertEqual(sg.namesOfAllSuppliesThatNeedRepair(),["back_1"])
+    def test_canRepairSnapshotsInABatch(self):
+        sgs = [StageGraph(g,t) for g in ["chair","seat"] for t in SupplyProblem(g,a).completeSupplyTrees()]
+        snaps = [sg.snapshot() for sg in sgs]
+        scratch(snaps,SupplyNetwork("S",[s1]))
+        self.assertTrue(any(s.needsRepair() for s in snaps))
+        for s in repair(snaps,a):
+            self.assertFalse(s.needsRepair())
+        self.assertFalse(any(sg.needsRepair() for sg in sgs))
+
+class TestOrderRegistry(unittest.TestCase):
+    def test_scratchTouchesOnlyAffectedOrders(self):
+        registry = OrderRegistry()
+        for i,st in enumerate(SupplyProblem("chair",a).completeSupplyTrees()):
+            registry.add(i,Order("chair",st))
+        using = registry.ordersUsing("seat_1")
+        self.assertTrue(0 < len(using) < len(registry.orders))
+        self.assertEqual(sorted(registry.scratch("seat_1")),sorted(using))
+        for i,o in registry.orders.items():
+            self.assertEqual(o.stageGraph.needsRepair(),i in using)
+        self.assertEqual(registry.scratch("no_such_supply"),[])
+    def test_indexFollowsRepairsAndRemoval(self):
+        registry = OrderRegistry()
+        registry.add("o1",Order("chair",sx))
+        registry.add("o2",Order("seat",st_seat_2))
+        self.assertEqual(registry.ordersUsing("fabric_1"),["o2"])
+        registry.orders["o1"].stageGraph.repair("seat_1",st_seat_2)
+        self.assertEqual(sorted(registry.ordersUsing("fabric_1")),["o1","o2"])
+        self.assertEqual(registry.ordersUsing("seat_1"),[])
+        copied = copy.deepcopy(registry.orders["o1"])
+        copied.stageGraph.repair("back_1",SupplyTree(b1,{}))
+        registry.remove("o2")
+        self.assertEqual(registry.ordersUsing("fabric_1"),["o1"])
+        self.assertEqual(sorted(registry.scratchNetwork(SupplyNetwork("F",[f1,l1]))),["o1"])
+
+class TestRepairPlanner(unittest.TestCase):
+    def test_repairsABatchFromCachedTrees(self):
+        sn = SupplyNetwork("A",list(a.supplies))
+        sgs = [StageGraph("chair",sx) for i in range(3)]
+        for sg in sgs:
+            sg.scratch("seat_1")
+        planner = RepairPlanner(sn)
+        subs = planner.substitutionsForBatch(sgs)
+        self.assertEqual([len(x) for x in subs],[2,2,2])
+        self.assertEqual(list(planner.trees),["seat"])
+        repaired = repair(sgs,sn,planner)
+        self.assertEqual(len(repaired),3)
+        for sg in repaired:
+            self.assertFalse(sg.needsRepair())
+            self.assertTrue(sg.findStageGraphByName("seat_1").repaired)
+    def test_cacheIsDroppedWhenTheNetworkChanges(self):
+        sn = SupplyNetwork("A",list(a.supplies))
+        planner = RepairPlanner(sn)
+        self.assertEqual(len(planner.completeSupplyTrees("seat")),2)
+        sn.scratch("seat_1")
+        self.assertEqual(len(planner.completeSupplyTrees("seat")),1)
+        sg = StageGraph("chair",sx)
+        sg.scratch("seat_1")
+        self.assertEqual([s.b for s in findAllSubstitutions(sn,sg,planner)],["seat_2"])
+
 class TestOrder(unittest.TestCase):
     def test_canAdvanceOrderToCompletion(self):
         sx = SupplyTree(c1,{"leg": SupplyTree(l1,{}),
@@ -236,6 +382,531 @@ class TestOrder(unittest.TestCase):
         while(sg is not None):
             sg = o1.advanceOne()
         self.assertTrue(o1.stageGraph.isComplete())
+    def test_advancesReadyStagesInBatches(self):
+        st = SupplyTree(c1,{"leg": SupplyTree(l1,{}),
+                            "seat": SupplyTree(s2,{"fabric": SupplyTree(f1,{}),
+                                                   "plane": SupplyTree(p1,{})}),
+                            "back": SupplyTree(b1,{})})
+        o = Order("chair",st)
+        names = lambda sgs: sorted(sg.curSupply.name for sg in sgs)
+        self.assertEqual(names(o.readyStages()),["back_1","fabric_1","leg_1","plane_1"])
+        self.assertEqual(o.advanceOne(priority=lambda sg: sg.curSupply.name).curSupply.name,"back_1")
+        o.stageGraph.scratch("plane_1")
+        self.assertEqual(names(o.advanceBatch()),["fabric_1","leg_1"])
+        self.assertEqual(o.readyStages(),[])
+        o.stageGraph.repair("plane_1",SupplyTree(p1,{}))
+        self.assertEqual(names(o.advanceBatch()),["plane_1"])
+        self.assertEqual(names(o.advanceBatch()),["seat_2"])
+        self.assertEqual(names(o.advanceBatch()),["chair_1"])
+        self.assertTrue(o.stageGraph.isComplete())
+        self.assertIsNone(o.advanceOne())
+
+class TestLeadTimes(unittest.TestCase):
+    def test_earliestCompletionFollowsTheOrder(self):
+        lc = Supply("chair_1",["chair"],["leg","seat","back"],chair_1,leadTime=2)
+        ll = Supply("leg_1",["leg"],[],leg_1,leadTime=5)
+        ls = Supply("seat_2",["seat"],["fabric","plane"],seat_2,leadTime=1,capacity=10)
+        lf = Supply("fabric_1",["fabric"],[],fabric_1,leadTime=3)
+        lp = Supply("plane_1",["plane"],[],plane_1,leadTime=6)
+        lb = Supply("back_1",["back"],[],back_1)
+        st = SupplyTree(lc,{"leg": SupplyTree(ll,{}),
+                            "seat": SupplyTree(ls,{"fabric": SupplyTree(lf,{}),
+                                                   "plane": SupplyTree(lp,{})}),
+                            "back": SupplyTree(lb,{})})
+        o = Order("chair",st)
+        names = lambda sgs: [sg.curSupply.name for sg in sgs]
+        self.assertEqual(o.earliestCompletion(),9)
+        self.assertEqual(names(o.criticalPath()),["chair_1","seat_2","plane_1"])
+        o.stageGraph.assertSupplyStatus("plane_1",StageStatus.SUCCEEDED)
+        self.assertEqual(o.earliestCompletion(),7)
+        self.assertEqual(names(o.criticalPath()),["chair_1","leg_1"])
+        o.stageGraph.scratch("fabric_1")
+        self.assertEqual(o.earliestCompletion(),math.inf)
+        o.stageGraph.repair("fabric_1",SupplyTree(Supply("fabric_2",["fabric"],[],fabric_2,leadTime=8),{}))
+        self.assertEqual(o.earliestCompletion(),11)
+        self.assertEqual(names(o.criticalPath()),["chair_1","seat_2","fabric_2"])
+        o.advanceBatch()
+        self.assertEqual(o.earliestCompletion(),3)
+        registry = OrderRegistry()
+        registry.add("o",o)
+        registry.add("p",Order("leg",SupplyTree(ll,{})))
+        self.assertEqual(registry.earliestCompletions(),{"o": 3,"p": 5})
+        self.assertEqual(StageGraph("chair",sx).earliestCompletion(),0)
+
+class TestOrderJournal(unittest.TestCase):
+    def exercise(self,journal):
+        journal.create(1,"chair",sx)
+        journal.create(2,"seat",st_seat_2)
+        journal.advanceOne(1)
+        journal.scratch(1,"seat_1")
+        journal.repair(1,"seat_1",st_seat_2)
+        journal.advanceBatch(1)
+        journal.assertSupplyStatus(2,"plane_1",StageStatus.SUCCEEDED)
+    def test_replaysTheLog(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d,"orders.log")
+            journal = OrderJournal(path,a.supplies,batchSize=2)
+            self.exercise(journal)
+            expected = {i: str(o.stageGraph) for (i,o) in journal.orders.items()}
+            journal.close()
+            # a batch cut short by a crash
+            with open(path,"a") as f:
+                f.write('{"type": "create", "ord')
+            recovered = OrderJournal(path,a.supplies)
+            self.assertEqual({i: str(o.stageGraph) for (i,o) in recovered.orders.items()},expected)
+            self.assertEqual(recovered.seq,journal.seq)
+            self.assertEqual(recovered.orders[1].readyStages(),
+                             [recovered.orders[1].stageGraph.findStageGraphByName("seat_2")])
+            recovered.close()
+    def test_eventsAfterATornLineSurviveTheNextCrash(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d,"orders.log")
+            journal = OrderJournal(path,a.supplies,batchSize=1)
+            journal.create(1,"chair",sx)
+            journal.close()
+            with open(path,"a") as f:
+                f.write('{"type": "create", "ord')
+            recovered = OrderJournal(path,a.supplies,batchSize=1)
+            recovered.create(2,"seat",st_seat_2)
+            recovered.scratch(1,"seat_1")
+            recovered.close()
+            again = OrderJournal(path,a.supplies)
+            self.assertEqual(sorted(again.orders),[1,2])
+            self.assertTrue(again.orders[1].stageGraph.needsRepair())
+            self.assertEqual(again.seq,3)
+            again.close()
+    def test_snapshotsTruncateTheLog(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d,"orders.log")
+            journal = OrderJournal(path,a.supplies,snapshotEvery=4)
+            self.exercise(journal)
+            self.assertTrue(os.path.exists(path + ".snapshot"))
+            expected = {i: str(o.stageGraph) for (i,o) in journal.orders.items()}
+            journal.close()
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()),journal.seq % 4)
+            recovered = OrderJournal(path,a.supplies,snapshotEvery=4)
+            self.assertEqual({i: str(o.stageGraph) for (i,o) in recovered.orders.items()},expected)
+            recovered.advanceBatch(1)
+            self.assertTrue(recovered.orders[1].stageGraph.findStageGraphByName("seat_2").currentStatus
+                            == StageStatus.SUCCEEDED)
+            recovered.close()
+
+class TestSimulation(unittest.TestCase):
+    def test_withoutFailuresEveryOrderCompletes(self):
+        sn = SupplyNetwork("A",list(a.supplies))
+        orders = [("chair",st) for st in SupplyProblem("chair",a).completeSupplyTrees()]
+        report = simulate(sn,orders,5,0.0,processes=1)
+        self.assertEqual(report.completionRate(),1)
+        self.assertEqual(report.totalRepairs,0)
+        self.assertEqual(report.completedByOrder,Counter({i: 5 for i in range(len(orders))}))
+    def test_trialsAreReproducibleAcrossProcesses(self):
+        sn = SupplyNetwork("A",list(a.supplies))
+        orders = [("chair",st) for st in SupplyProblem("chair",a).completeSupplyTrees()]
+        serial = simulate(sn,orders,40,0.2,seed=7,processes=1,chunkSize=8)
+        parallel = simulate(sn,orders,40,0.2,seed=7,processes=2,chunkSize=8)
+        self.assertEqual((serial.completed,serial.failed),(parallel.completed,parallel.failed))
+        self.assertEqual(serial.repairHistogram,parallel.repairHistogram)
+        self.assertEqual(serial.supplierFailures,parallel.supplierFailures)
+        self.assertTrue(0 < serial.completionRate() < 1)
+        self.assertTrue(serial.totalRepairs > 0)
+        # the simulation works on snapshots
+        self.assertEqual(len(sn.supplies),len(a.supplies))
+    def test_aFailingSupplierKeepsWhatItHasSupplied(self):
+        registry = OrderRegistry()
+        registry.add(1,Order("seat",st_seat_2))
+        registry.add(2,Order("seat",st_seat_2))
+        registry.orders[1].stageGraph.assertSupplyStatus("fabric_1",StageStatus.SUCCEEDED)
+        self.assertEqual(failOpenStages(registry,"fabric_1"),[2])
+        self.assertFalse(registry.orders[1].stageGraph.needsRepair())
+        self.assertEqual(registry.orders[2].stageGraph.namesOfAllSuppliesThatNeedRepair(),["fabric_1"])
+
+class TestParallelEnumeration(unittest.TestCase):
+    def test_parallelMatchesSequentialEnumeration(self):
+        for g in goodTypes(a):
+            sequential = list(map(str,SupplyProblem(g,a)))
+            ordered = list(map(str,SupplyProblem(g,a).parallelIter(processes=2,ordered=True)))
+            self.assertEqual(ordered,sequential)
+            unordered = list(map(str,SupplyProblem(g,a).parallelIter(processes=2)))
+            self.assertEqual(sorted(unordered),sorted(sequential))
+    def test_canEnumerateManyGoodsInOnePool(self):
+        gs = goodTypes(a)
+        counts = {}
+        for (g,st) in parallelSupplyTrees(gs,a):
+            counts[g] = counts.get(g,0) + 1
+        for g in gs:
+            self.assertEqual(counts.get(g,0),len(list(SupplyProblem(g,a))))
+
+class TestCountSupplyTrees(unittest.TestCase):
+    def test_countsMatchEnumeration(self):
+        for sn in [a,ab,abc,xy,unionSupplyNetworks(a,SupplyNetwork("B",[c2,s2,s3,ss1]))]:
+            counts = countSupplyTrees(sn)
+            for g in goodTypes(sn):
+                sp = SupplyProblem(g,sn)
+                self.assertEqual(counts[g].total,len(list(sp)))
+                self.assertEqual(counts[g].complete,len(list(sp.completeSupplyTrees())))
+    def test_cyclesAreCountedAsInfinite(self):
+        P1 = Supply("P_1",["P"],["Q"],symbols("P_1") + symbols("Q"))
+        Q1 = Supply("Q_1",["Q"],["P"],symbols("Q_1") + symbols("P"))
+        Q2 = Supply("Q_2",["Q"],[],symbols("Q_2"))
+        R1 = Supply("R_1",["R"],["P"],symbols("R_1") + symbols("P"))
+        unproductive = countSupplyTrees(SupplyNetwork("PQ",[P1,Q1]))
+        self.assertEqual(unproductive["P"].complete,0)
+        self.assertEqual(unproductive["P"].incomplete,math.inf)
+        productive = countSupplyTrees(SupplyNetwork("PQR",[P1,Q1,Q2,R1]))
+        for g in ["P","Q","R"]:
+            self.assertEqual(productive[g].complete,math.inf)
+            self.assertEqual(productive[g].total,math.inf)
+
+    def test_countsPastTheRangeOfFloats(self):
+        # 4 ** 520 trees for L520, alongside a good with infinitely many
+        supplies = [Supply("L0_0",["L0"],[],None)]
+        for k in range(1,521):
+            supplies += [Supply("L%d_%d" % (k,j),["L%d" % k],["L%d" % (k - 1)],None) for j in range(4)]
+        supplies += [Supply("C_1",["C"],["C"],None),Supply("C_2",["C"],[],None),
+                     Supply("top_1",["top"],["L520","C"],None),
+                     Supply("top_2",["top"],["L520"],None)]
+        counts = countSupplyTrees(SupplyNetwork("wide",supplies))
+        self.assertEqual(counts["L520"].complete,4 ** 520)
+        total = 1
+        for k in range(520):
+            total = 4 * (1 + total)
+        self.assertEqual(counts["L520"].total,total)
+        self.assertEqual(counts["top"].complete,math.inf)
+        self.assertEqual(counts["top"].total,math.inf)
+
+class TestSupplyTreeSampler(unittest.TestCase):
+    def test_drawsEveryCompleteTreeUniformly(self):
+        trees = list(map(str,SupplyProblem("chair",a).completeSupplyTrees()))
+        sampler = SupplyTreeSampler(a,seed=1)
+        n = 200 * len(trees)
+        seen = {}
+        for st in sampler.samples("chair",n):
+            self.assertTrue(st.isComplete())
+            self.assertTrue(checkConsistency(st))
+            seen[str(st)] = seen.get(str(st),0) + 1
+        self.assertEqual(sorted(seen),sorted(trees))
+        for t in trees:
+            self.assertTrue(100 < seen[t] < 300)
+    def test_isReproducibleAndWeighted(self):
+        first = list(map(str,SupplyTreeSampler(a,seed=7).samples("seat",20)))
+        again = list(map(str,SupplyTreeSampler(a,seed=7).samples("seat",20)))
+        self.assertEqual(first,again)
+        onlySeat1 = SupplyTreeSampler(a,seed=7,weights={"seat_2": 0,"seat_3": 0})
+        for st in onlySeat1.samples("seat",20):
+            self.assertEqual(st.supply.name,"seat_1")
+        self.assertRaises(ValueError,SupplyTreeSampler(a).sample,"frame")
+    def test_skipsSuppliesThatCannotBeSampled(self):
+        noLegs = SupplyTreeSampler(a,seed=1,weights={"leg_1": 0})
+        self.assertRaises(ValueError,noLegs.sample,"chair")
+        noFabric = SupplyTreeSampler(a,seed=1,weights={"fabric_1": 0})
+        for st in noFabric.samples("seat",20):
+            self.assertNotEqual(st.supply.name,"seat_2")
+        # x_1 needs z, which has no trees, and c, which has infinitely many
+        sn = SupplyNetwork("X",[Supply("x_1",["x"],["z","c"],None),Supply("x_2",["x"],[],None),
+                                Supply("c_1",["c"],["c"],None),Supply("c_2",["c"],[],None)])
+        self.assertEqual(completeTreeCounts(sn)["x"],1)
+        self.assertEqual(SupplyTreeSampler(sn,seed=1).sample("x").supply.name,"x_2")
+
+class TestKBestSupplyTrees(unittest.TestCase):
+    def test_ranksAllCompleteTreesByPrice(self):
+        for g in goodTypes(a):
+            sp = SupplyProblem(g,a)
+            expected = sorted(characteristicExpression(st).subs(price_map) for st in sp.completeSupplyTrees())
+            ranked = list(sp.kBestCompleteSupplyTreesByPrice(price_map))
+            self.assertEqual([p for (st,p) in ranked],expected)
+            for (st,p) in ranked:
+                self.assertTrue(st.isComplete())
+                self.assertEqual(characteristicExpression(st).subs(price_map),p)
+            self.assertEqual(len(set(str(st) for (st,p) in ranked)),len(ranked))
+    def test_canAskForOnlyTheCheapest(self):
+        best = list(SupplyProblem("chair",a).kBestCompleteSupplyTreesByPrice(price_map,2))
+        self.assertEqual(len(best),2)
+        self.assertEqual(best[0][1],SupplyProblem("chair",a).optimalCompleteSupplyTreeByPrice(price_map)[1])
+    def test_onlyNeedsPricesUnderTheGood(self):
+        glue_1 = symbols("glue_1")
+        sn = SupplyNetwork("A",a.supplies + [Supply("glue_1",["glue"],[],glue_1),
+                                             Supply("tape_1",["tape"],[],"no eqn yet")])
+        kBest = KBestSupplyTrees(sn,price_map)
+        self.assertEqual(len(list(kBest.trees("chair"))),4)
+        self.assertNotIn("glue",kBest.edges)
+        with self.assertRaises(ValueError):
+            list(kBest.trees("glue"))
+
+class TestSupplyTreeSummary(unittest.TestCase):
+    def test_summarizesMissingGoodsDepthAndSize(self):
+        st = SupplyTree(c1,{"leg": SupplyTree(l1,{}),
+                            "seat": SupplyTree(s3,{"stuffing": SupplyTree(ss1,{})})})
+        self.assertEqual(sorted(st.incompleteGoods()),["back","frame","upholstery"])
+        self.assertFalse(st.isComplete())
+        self.assertEqual(st.depth(),3)
+        self.assertEqual(st.size(),4)
+        self.assertTrue(checkConsistency(st))
+        self.assertTrue(sx.isComplete())
+    def test_checksConsistencyOfEveryKey(self):
+        st = SupplyTree(c1,{"leg": SupplyTree(l1,{}),
+                            "seat": SupplyTree(b1,{}),
+                            "back": SupplyTree(b1,{})})
+        self.assertFalse(checkConsistency(st))
+        self.assertFalse(checkConsistency(st_seat_1))
+        self.assertTrue(checkConsistency(st_seat_2))
+
+class TestRender(unittest.TestCase):
+    def test_writesJsonAndDot(self):
+        sg = StageGraph("chair",sx)
+        sg.repair("seat_1",st_seat_2)
+        sg.scratch("leg_1")
+        out = io.StringIO()
+        writeStageGraphJson(sg,out)
+        self.assertEqual(json.loads(out.getvalue()),stageGraphToJson(sg))
+        out = io.StringIO()
+        writeSupplyTreeJson(st_seat_2,out)
+        self.assertEqual(json.loads(out.getvalue()),
+                         {"supply": "seat_2","outputs": ["seat"],
+                          "inputs": {"fabric": {"supply": "fabric_1","outputs": ["fabric"],"inputs": {}},
+                                     "plane": {"supply": "plane_1","outputs": ["plane"],"inputs": {}}}})
+        out = io.StringIO()
+        writeStageGraphDot(sg,out)
+        dot = out.getvalue()
+        self.assertTrue(dot.startswith('digraph "stagegraph" {'))
+        self.assertIn('[label="leg_1/FAILED", color="red"]',dot)
+        self.assertIn('[label="seat"]',dot)
+        self.assertEqual(dot.count("->"),5)
+        out = io.StringIO()
+        writeSupplyTreeDot(SupplyTree(Supply("chaise_1",["chaise"],["pied"],None),
+                                      {"pied": SupplyTree(Supply("pied_é",["pied"],[],None),{})}),out)
+        self.assertIn('"pied_é"',out.getvalue())
+    def test_rendersDeepTrees(self):
+        st = SupplyTree(l1,{})
+        for i in range(5000):
+            st = SupplyTree(l1,{"leg": st})
+        self.assertEqual(str(st).count("\n="),1)
+        for write in [writeSupplyTreeText,writeSupplyTreeJson,writeSupplyTreeDot]:
+            out = io.StringIO()
+            write(st,out)
+            self.assertTrue(out.getvalue())
+        out = io.StringIO()
+        writeSupplyTreeJson(st,out)
+        self.assertEqual(out.getvalue().count("leg_1"),5001)
+
+# A library of atoms.py in folder d: a mask made of elastic (with the given
+# quantity, if any) and fabric by a tailor, who holds elastic, and a mill
+# supplying fabric
+def writeMaskLibrary(d,elasticQuantity = None):
+    os.makedirs(os.path.join(d,"okh"))
+    os.makedirs(os.path.join(d,"okw"))
+    quantity = "" if elasticQuantity is None else "quantity: %s, " % elasticQuantity
+    with open(os.path.join(d,"okh","mask.yml"),"w") as f:
+        f.write("title: mask\nproduct-atom: {identifier: Q1, description: mask}\n"
+                "bom-atoms: [{identifier: Q2, %sdescription: elastic},"
+                " {identifier: Q3, description: fabric}]\n"
+                "tool-list-atoms: [{identifier: Q4, description: needle}]\n" % quantity)
+    with open(os.path.join(d,"okw","tailor.yml"),"w") as f:
+        f.write("title: tailor\ntool-list-atoms: [{identifier: Q4, description: needle}]\n"
+                "inventory-atoms: [{identifier: Q2, description: elastic}]\n")
+    with open(os.path.join(d,"okw","mill.yml"),"w") as f:
+        f.write("title: mill\nsupply-atoms: [{identifier: Q3, description: fabric}]\n")
+
+class TestBOM(unittest.TestCase):
+    def check(self):
+        self.assertEqual(c1.quantityOf("leg"),4)
+        self.assertEqual(explode("chair",sx,10),{"chair": 10,"leg": 40,"seat": 10,"back": 10})
+        glued = Supply("seat_4",["seat"],["fabric","plane"],seat_2 + fabric + plane,
+                       quantities={"fabric": Fraction(3,2)})
+        st = SupplyTree(c2,{"leg": SupplyTree(l1,{}),
+                            "seat": SupplyTree(glued,{"fabric": SupplyTree(f1,{}),
+                                                      "plane": SupplyTree(p1,{})}),
+                            "back": SupplyTree(b1,{})})
+        matrix = BOMMatrix([("chair",sx),("chair",st),("seat",st_seat_2)])
+        self.assertEqual(matrix.rollup([1,2,0],raw=True),
+                         {"leg": 12,"seat": 1,"back": 3,"fabric": 3,"plane": 2})
+        self.assertEqual(matrix.rollupMany([[0,0,5],[1,0,0]]),
+                         [{"seat": 5,"fabric": 5,"plane": 5},
+                          {"chair": 1,"leg": 4,"seat": 1,"back": 1}])
+    def test_rollsUpQuantities(self):
+        self.check()
+    def test_rollsUpQuantitiesWithoutNumPy(self):
+        import bom
+        with unittest.mock.patch.object(bom,"numpy",None):
+            self.check()
+    def test_countsUnfilledInputsAsRaw(self):
+        self.assertEqual(explode("seat",SupplyTree(s2,{}),5,raw=True),{"fabric": 5,"plane": 5})
+        self.assertEqual(explode("chair",SupplyTree(c1,{"seat": st_seat_2}),2,raw=True),
+                         {"leg": 8,"back": 2,"fabric": 2,"plane": 2})
+    def test_rollsUpTreesOfAtoms(self):
+        import atoms
+        with tempfile.TemporaryDirectory() as d:
+            writeMaskLibrary(d,elasticQuantity=2)
+            space = atoms.loadProblemSpace(d)
+        mask = next(t for t in space.query(atoms.SupplyAtom("Q1","mask"))
+                    if hasattr(t,"design"))
+        self.assertEqual(explode("Q1",mask,3),{"Q1": 3,"Q2": 6,"Q3": 3})
+        self.assertEqual(explode("Q1",mask,3,raw=True),{"Q2": 6,"Q3": 3})
+
+class TestCompactRepresentations(unittest.TestCase):
+    def test_packedTreesRoundTrip(self):
+        table = SupplyTable()
+        trees = list(SupplyProblem("chair",a).completeSupplyTrees())
+        packed = [PackedSupplyTree(st,table) for st in trees]
+        for (st,p) in zip(trees,packed):
+            self.assertEqual(len(p),st.size())
+            self.assertEqual(p.depth(),st.depth())
+            self.assertEqual(str(p.unpack()),str(st))
+        self.assertEqual(packed[0].supplyNames()[0],"chair_1")
+        self.assertTrue(len(table.supplies) <= len(a.supplies))
+    def test_slottedStageGraphsCopyAndPickle(self):
+        sg = StageGraph("chair",sx)
+        self.assertFalse(hasattr(sg,"__dict__"))
+        self.assertIs(sg.good,sys.intern("".join(["ch","air"])))
+        snap = sg.snapshot()
+        sg.repair("seat_1",st_seat_2)
+        self.assertEqual(str(snap),str(StageGraph("chair",sx)))
+        copied = pickle.loads(pickle.dumps(sg))
+        self.assertEqual(str(copied),str(sg))
+        self.assertEqual(copied.snapshots,None)
+        self.assertEqual(copied.findStageGraphByName("seat_2").root,copied)
+
+@unittest.skipUnless(numpy,"needs numpy and scipy")
+class TestSupplyGraph(unittest.TestCase):
+    def test_analysesNetwork(self):
+        g = supplyGraphOfNetwork(a)
+        self.assertEqual(g.uses.shape,(len(g.goods),len(g.goods)))
+        self.assertEqual(sorted(g.namesOf(reachable(g,["seat"]))),
+                         ["fabric","frame","plane","seat","stuffing","upholstery"])
+        self.assertEqual(sorted(g.namesOf(dependents(g,["fabric"]))),["chair","fabric","seat"])
+        depths = dict(zip(g.goods,bomDepths(g)))
+        self.assertEqual((depths["chair"],depths["seat"],depths["leg"]),(3,2,1))
+        self.assertEqual(dict(zip(g.goods,fanIn(g)))["seat"],1)
+        self.assertEqual(dict(zip(g.goods,producerCounts(g)))["seat"],3)
+        self.assertEqual(chokePoints(g),
+                         [("fabric","fabric_1",2),("plane","plane_1",2),("stuffing","stuffing_1",2),
+                          ("back","back_1",1),("leg","leg_1",1)])
+        self.assertEqual([c[0] for c in chokePoints(g,["back"])],["back"])
+    def test_cyclesHaveInfiniteDepth(self):
+        loop = SupplyNetwork("loop",[X1,Y1,Supply("Y_2",["Y"],["Z"],None),
+                                     Supply("Z_1",["Z"],["Y"],None)])
+        g = supplyGraphOfNetwork(loop)
+        depths = dict(zip(g.goods,bomDepths(g)))
+        self.assertEqual(depths,{"X": math.inf,"Y": math.inf,"Z": math.inf})
+        self.assertEqual(bomDepths(supplyGraphOfNetwork(xy)).tolist(),[2,1])
+    def test_savesAndLoads(self):
+        g = supplyGraphOfNetwork(a)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d,"a.npz")
+            g.save(path)
+            loaded = SupplyGraph.load(path)
+        self.assertEqual(loaded.goods,g.goods)
+        self.assertEqual(loaded.producerNames,g.producerNames)
+        self.assertEqual((loaded.uses != g.uses).nnz,0)
+        self.assertEqual(chokePoints(loaded),chokePoints(g))
+    def test_countsPastTheRangeOfSmallIntegers(self):
+        # 128 parts all need a screw, more than an int8 can count
+        parts = ["part_%d" % i for i in range(128)]
+        inputsOf = dict({"top": parts},**{p: ["screw"] for p in parts})
+        producersOf = {g: [g + "_maker"] for g in ["top","screw"] + parts}
+        g = SupplyGraph.build(inputsOf,producersOf)
+        self.assertTrue(reachable(g,["top"])[g.goodIndex["screw"]])
+        self.assertEqual(dependents(g,["screw"]).sum(),130)
+        self.assertEqual(chokePoints(g,["top"])[0],("screw","screw_maker",129))
+    def test_analysesProblemSpace(self):
+        # stand-ins for the NamedTuples of atoms.py
+        class Atom(typing.NamedTuple):
+            identifier: str
+        class Party(typing.NamedTuple):
+            name: str
+            supplies: frozenset
+            tools: frozenset
+            inventory: frozenset
+            def compatible(self,tools):
+                return all(t in self.tools for t in tools)
+        class Design(typing.NamedTuple):
+            product: Atom
+            bom: frozenset
+            tools: frozenset
+        (mask,elastic,fabric,needle) = [Atom(i) for i in ["Q1","Q2","Q3","Q4"]]
+        space = types.SimpleNamespace(
+            parties=[Party("mill",frozenset([fabric]),frozenset(),frozenset()),
+                     Party("tailor",frozenset(),frozenset([needle]),frozenset([elastic]))],
+            designs=[Design(mask,frozenset([elastic,fabric]),frozenset([needle]))])
+        g = supplyGraphOfProblemSpace(space)
+        self.assertEqual(dict(zip(g.goods,bomDepths(g))),{"Q1": 2,"Q2": 1,"Q3": 1})
+        self.assertEqual(chokePoints(g,["Q1"]),
+                         [("Q2","tailor",1),("Q3","mill",1),("Q1","tailor",0)])
+
+class TestSupplyQueryCache(unittest.TestCase):
+    def test_cachesUntilTheNetworkChanges(self):
+        sn = SupplyNetwork("A",list(a.supplies))
+        cache = SupplyQueryCache()
+        trees = cache.completeSupplyTrees("seat",sn)
+        self.assertEqual(len(trees),2)
+        self.assertIs(cache.completeSupplyTrees("seat",sn),trees)
+        self.assertEqual(len(cache.completeSupplyTrees("seat",sn,limit=1)),1)
+        self.assertEqual((cache.hits,cache.misses,len(cache)),(1,2,2))
+        self.assertEqual(cache.bytes,sum(approximateSize(r) for (r,size) in cache.entries.values()))
+        sn.scratch("seat_1")
+        self.assertEqual(len(cache.completeSupplyTrees("seat",sn)),1)
+        self.assertEqual((cache.invalidations,len(cache)),(2,1))
+        # a snapshot is another source, with results of its own
+        cache.completeSupplyTrees("seat",sn.snapshot())
+        self.assertEqual(len(cache.sources),2)
+    def test_evictsLeastRecentlyUsedBySize(self):
+        cache = SupplyQueryCache(maxBytes=10,sizeOf=len)
+        space = types.SimpleNamespace(query=lambda product: range(product))
+        for product in [4,3,2]:
+            cache.query(space,product)
+        cache.query(space,4)
+        cache.query(space,5)
+        self.assertEqual([k[1] for k in cache.entries],[4,5])
+        self.assertEqual(cache.stats()["evictions"],2)
+        self.assertEqual(cache.stats()["bytes"],9)
+        # too big to keep
+        self.assertEqual(cache.query(space,11),tuple(range(11)))
+        self.assertEqual(len(cache),2)
+        cache.query(space,4,version=1)
+        self.assertEqual((len(cache),cache.invalidations,cache.hitRate()),(1,2,1 / 7))
+
+class TestQueryCli(unittest.TestCase):
+    def test_streamsTreesAsLinesOfJson(self):
+        from typer.testing import CliRunner
+        import query_cli
+        with tempfile.TemporaryDirectory() as d:
+            writeMaskLibrary(d)
+            snap = os.path.join(d,"library.pickle")
+            result = CliRunner().invoke(query_cli.cli,["snapshot",d,snap])
+            self.assertEqual(result.exit_code,0,result.output)
+            for library in [d,snap]:
+                result = CliRunner().invoke(query_cli.cli,["query",library,"Q1","Q9","--limit","1"])
+                self.assertEqual(result.exit_code,0,result.output)
+                lines = [json.loads(l) for l in result.stdout.splitlines()]
+                self.assertEqual([l["query"] for l in lines],["Q1","Q9"])
+                self.assertEqual(lines[0]["tree"]["party"],"tailor")
+                self.assertIn("query",result.stderr)
+            result = CliRunner().invoke(query_cli.cli,["query",snap,"Q3","--profile","--no-timings"])
+            self.assertEqual(len(result.stdout.splitlines()),1)
+            self.assertIn("cumulative",result.stderr)
+            self.assertIn("at peak",result.stderr)
+
+class TestOKF(unittest.TestCase):
+    def bruteForceSupplyNames(self,okws,okhs):
+        return [w.name + "|" + h.name for w in okws for h in okhs if w.hasToolingFor(h)]
+    def test_indexedSuppliesMatchCheckingEveryPair(self):
+        okhs = [okh1,
+                OKH("Chair",["chair"],["leg","seat","back"],["saw","drill"]),
+                OKH("Stool",["stool"],["leg","seat"],["saw"]),
+                OKH("Kit",["kit"],["box"],[])]
+        okws = [okw1,
+                OKW("Shop",["saw","drill","sewing_machine"]),
+                OKW("Shed",["saw"]),
+                OKW("Empty",[])]
+        okf = OKF("okf",okhs,okws)
+        self.assertEqual([s.name for s in okf.iterSupplies()],self.bruteForceSupplyNames(okws,okhs))
+    def test_canAddOKWsAndOKHsIncrementally(self):
+        okf = OKF("okf",[okh1],[okw1])
+        added = okf.addOKW(OKW("Shop",["saw","drill","sewing_machine"]))
+        self.assertEqual([s.name for s in added],["Shop|SurgeMask"])
+        added = okf.addOKH(OKH("Chair",["chair"],["leg","seat","back"],["saw","drill"]))
+        self.assertEqual([s.name for s in added],["Shop|Chair"])
+        self.assertEqual([s.name for s in okf.supplies()],self.bruteForceSupplyNames(okf.okws,okf.okhs))
 
 
 class TestOKHSlurp(unittest.TestCase):
@@ -246,24 +917,59 @@ class TestOKHSlurp(unittest.TestCase):
         print(vm);
         self.assertTrue(vm)
 
+class TestLoadOKHs(unittest.TestCase):
+    def test_canLoadADirectoryWithErrorsAndCache(self):
+        with tempfile.TemporaryDirectory() as d:
+            okhDir = os.path.join(d,"okh")
+            os.mkdir(okhDir)
+            for i in range(4):
+                with open(os.path.join(okhDir,"okh-%d.yml" % i),"w") as f:
+                    f.write("title: thing %d\nbom: a,b\ntool-list: saw\n" % i)
+            with open(os.path.join(okhDir,"okh-broken.yml"),"w") as f:
+                f.write("title: [unterminated\n")
+            with open(os.path.join(okhDir,"okh-untitled.yml"),"w") as f:
+                f.write("bom: a\n")
+            schema = os.path.join(d,"schema.yaml")
+            with open(schema,"w") as f:
+                f.write("title: str()\nbom: str(required=False)\ntool-list: str(required=False)\n")
+            cache = OKHManifestCache(os.path.join(d,"cache.json"))
+            (okhs,errors) = loadOKHs(okhDir,schema=schema,cache=cache,processes=2)
+            self.assertEqual([h.name for h in okhs],["thing %d" % i for i in range(4)])
+            self.assertEqual(okhs[0].inputs,["a","b"])
+            self.assertEqual(sorted(map(os.path.basename,errors)),["okh-broken.yml","okh-untitled.yml"])
+            cache = OKHManifestCache(os.path.join(d,"cache.json"))
+            (again,errors) = loadOKHs(os.path.join(okhDir,"okh-*.yml"),schema=schema,cache=cache)
+            self.assertEqual([h.name for h in again],[h.name for h in okhs])
+            self.assertEqual(cache.hits,4)
+    def test_reportsMalformedManifestsAndCachesDates(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d,"okh-list.yml"),"w") as f:
+                f.write("title: listed\nbom: [a, b]\n")
+            with open(os.path.join(d,"okh-dated.yml"),"w") as f:
+                f.write("title: 2020-01-01\nbom: a\n")
+            cache = OKHManifestCache(os.path.join(d,"cache.json"))
+            (okhs,errors) = loadOKHs(d,cache=cache,processes=1)
+            self.assertEqual([h.name for h in okhs],["2020-01-01"])
+            self.assertEqual(list(map(os.path.basename,errors)),["okh-list.yml"])
+            (again,errors) = loadOKHs(d,cache=OKHManifestCache(os.path.join(d,"cache.json")))
+            self.assertEqual([h.name for h in again],["2020-01-01"])
+
 
 def getKnownOKHs(okhAlphaDir = "../okf-library/alpha/okh/"):
     files = ["okh-Character-Generator.yml","okh-manifest-covisor.yml","okh-manifest-makermask-origami.yml","okh-manifest-surge-english.yml","okh-manifest-surge-spanish.yml","okh-orgami-face-shield.yml","okh-ventmon-T0.4.yml"]
-    okhs = []
-    for f in files:
-        okh = OKH();
-        okh.fromFile(okhAlphaDir + f)
+    (okhs,errors) = loadOKHs([okhAlphaDir + f for f in files])
+    for f in errors:
+        print(f + ": " + errors[f])
+    for okh in okhs:
         print(okh.name)
         print(okh.inputs)
         print(okh.outputs)
         print(okh.requiredTooling)
-        okhs.append(okh)
     return okhs
 
 
 
-import copy
-scratched = copy.deepcopy(a)
+scratched = a.snapshot()
 scratched.scratch("leg_1")
 for s in scratched.supplies:
     print(s)
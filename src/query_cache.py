@@ -0,0 +1,142 @@
+# query_cache - Helpful Engineering's Project Data supply query cache
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# A cache of the results of supply queries, for callers (like a dashboard)
+# that ask the same questions about popular products again and again.
+#
+# Results are kept by (source, good or product, query options), together
+# with the version of the source they were computed from: the version of a
+# SupplyNetwork, or one given by the caller for a SupplyProblemSpace of
+# atoms.py (which has none of its own). When a source is seen at a new
+# version all of its results are dropped.
+#
+# The cache is bounded by the approximate memory size of the results it
+# holds, not by their number, since one popular product can have many more
+# trees than a hundred others. When it is full, the least recently used
+# results are evicted. Results too big to fit are returned but not kept.
+#
+# Results are tuples, so callers cannot change what the cache holds.
+
+from supply import *
+import collections
+import sys
+import threading
+
+# Roughly the bytes taken by one node of a supply tree (see bench_memory)
+NODE_BYTES = 200
+
+# The number of nodes of a SupplyTree, or of a supply tree of atoms.py
+def treeNodes(tree):
+    n = 0
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        n += 1
+        if isinstance(t,SupplyTree):
+            stack.extend(t.inputDict.values())
+        elif hasattr(t,"design"):
+            # a MadeSupplyTree; other atoms trees are leaves
+            stack.extend(t.supplies)
+    return n
+
+# An upper bound on the bytes taken by a tuple of trees (subtrees shared
+# between trees are counted for each of them)
+def approximateSize(trees):
+    return sys.getsizeof(trees) + NODE_BYTES * sum(treeNodes(t) for t in trees)
+
+class SupplyQueryCache:
+    def __init__(self,maxBytes = 64 * 1024 * 1024,sizeOf = approximateSize):
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.bytes = 0
+        # (id of source, good, options) -> (result, size), least recent first
+        self.entries = collections.OrderedDict()
+        # id of source -> [source, version, number of entries]; holding the
+        # source keeps its id from being reused while it has entries
+        self.sources = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+    def __len__(self):
+        return len(self.entries)
+    def stats(self):
+        return {"hits": self.hits,"misses": self.misses,"evictions": self.evictions,
+                "invalidations": self.invalidations,"entries": len(self.entries),
+                "bytes": self.bytes,"maxBytes": self.maxBytes}
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    # Drop every result (e.g. when a source has changed in a way its
+    # version does not show)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sources.clear()
+            self.bytes = 0
+    def remove(self,key):
+        (result,size) = self.entries.pop(key)
+        self.bytes -= size
+        source = self.sources[key[0]]
+        source[2] -= 1
+        if source[2] == 0:
+            del self.sources[key[0]]
+    # Drop the results of a source if they are for another version
+    def checkVersion(self,source,version):
+        s = self.sources.get(id(source))
+        if s is not None and s[1] != version:
+            stale = [k for k in self.entries if k[0] == id(source)]
+            for k in stale:
+                self.remove(k)
+            self.invalidations += len(stale)
+    def lookup(self,source,version,good,options,compute):
+        key = (id(source),good,options)
+        with self.lock:
+            self.checkVersion(source,version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        result = tuple(compute())
+        size = self.sizeOf(result)
+        with self.lock:
+            # another thread may have changed the version or stored the key
+            self.checkVersion(source,version)
+            if size > self.maxBytes or key in self.entries:
+                return result
+            while self.bytes + size > self.maxBytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+            s = self.sources.setdefault(id(source),[source,version,0])
+            s[1] = version
+            s[2] += 1
+            self.entries[key] = (result,size)
+            self.bytes += size
+        return result
+    # The complete supply trees of good in a SupplyNetwork, as
+    # SupplyProblem(good,sn).completeSupplyTrees(); only the first limit
+    # of them if limit is given.
+    def completeSupplyTrees(self,good,sn,limit = None):
+        return self.lookup(sn,sn.version,good,("completeSupplyTrees",limit),
+                           lambda: itertools.islice(SupplyProblem(good,sn).completeSupplyTrees(),limit))
+    # The supply trees of product in a SupplyProblemSpace, as space.query;
+    # version identifies the content of the space, and should be changed
+    # whenever it is.
+    def query(self,space,product,version = 0,limit = None):
+        return self.lookup(space,version,product,("query",limit),
+                           lambda: itertools.islice(space.query(product),limit))
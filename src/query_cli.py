@@ -0,0 +1,140 @@
+import contextlib
+import cProfile
+import io
+import itertools
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+import typer
+
+from atoms import SupplyAtom, SupplyProblemSpace, loadProblemSpace, saveSnapshot
+
+# Supply queries from the shell:
+#
+#     python query_cli.py query LIBRARY PRODUCT... [--limit N] [--profile]
+#     python query_cli.py snapshot LIBRARY SNAPSHOT
+#
+# LIBRARY is a local folder or "s3://bucket/prefix" holding okh and okw
+# folders, or a snapshot written by the snapshot command (which loads much
+# faster). Each supply tree found is written to stdout as one line of JSON
+# as soon as it is found; timings and profiles go to stderr.
+
+cli = typer.Typer(pretty_exceptions_show_locals=False)
+
+
+# identifier -> atom, for every atom named in the library
+def indexAtoms(space: SupplyProblemSpace) -> dict[str, SupplyAtom]:
+    atoms = {}
+    for design in space.designs:
+        for atom in itertools.chain([design.product], design.bom, design.bomOutputs):
+            atoms.setdefault(atom.identifier, atom)
+    for party in space.parties:
+        for atom in party.supplies | party.inventory:
+            atoms.setdefault(atom.identifier, atom)
+    return atoms
+
+
+class Timings:
+    def __init__(self):
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - start))
+
+    def write(self, out):
+        for (name, seconds) in self.phases:
+            out.write("%-6s %10.3f s\n" % (name, seconds))
+        out.write("%-6s %10.3f s\n" % ("total", sum(s for (n, s) in self.phases)))
+
+
+# The trees found for each product, as dicts ready to write as JSON
+def queryProducts(
+    space: SupplyProblemSpace,
+    atoms: dict[str, SupplyAtom],
+    products: list[str],
+    limit: Optional[int],
+):
+    for identifier in products:
+        # an unknown product is still queried, and reported missing
+        product = atoms.get(identifier, SupplyAtom(identifier, ""))
+        for supplyTree in itertools.islice(space.query(product), limit):
+            yield {"query": identifier, "tree": supplyTree.forJson()}
+
+
+@cli.command()
+def query(
+    library: str,
+    products: list[str],
+    limit: Optional[int] = None,
+    profile: bool = False,
+    timings: bool = True,
+):
+    """stream the supply trees of products as lines of JSON.
+
+    Args:
+        library: local folder, s3://bucket/prefix or snapshot to load.
+        products: identifiers of the products to query.
+        limit: the most trees to write for each product.
+        profile: write a cProfile and tracemalloc summary to stderr.
+        timings: write the time taken to load, index and query to stderr.
+    """
+    phases = Timings()
+    profiler = cProfile.Profile() if profile else None
+    if profile:
+        tracemalloc.start()
+        profiler.enable()
+    with phases.phase("load"):
+        space = loadProblemSpace(library)
+    with phases.phase("index"):
+        atoms = indexAtoms(space)
+    count = 0
+    with phases.phase("query"):
+        for result in queryProducts(space, atoms, products, limit):
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+            count += 1
+    if profile:
+        profiler.disable()
+        (current, peak) = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+        tracemalloc.stop()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(20)
+        sys.stderr.write(out.getvalue())
+        sys.stderr.write("memory: %d bytes now, %d bytes at peak\n" % (current, peak))
+        for stat in top:
+            sys.stderr.write("%s\n" % stat)
+    if timings:
+        sys.stderr.write(
+            "%d designs, %d parties, %d atoms, %d trees\n"
+            % (len(space.designs), len(space.parties), len(atoms), count)
+        )
+        phases.write(sys.stderr)
+
+
+@cli.command()
+def snapshot(library: str, destination: str):
+    """load a library and save it as a snapshot that loads faster.
+
+    Args:
+        library: local folder or s3://bucket/prefix to load.
+        destination: the snapshot file to write (ending in .pickle).
+    """
+    if not destination.endswith(".pickle"):
+        raise typer.BadParameter("a snapshot must end in .pickle")
+    space = loadProblemSpace(library)
+    saveSnapshot(space, destination)
+    sys.stderr.write(
+        "saved %d designs and %d parties\n" % (len(space.designs), len(space.parties))
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,165 @@
+# render - Helpful Engineering's Project Data tree renderers
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Renderers that write SupplyTrees, StageGraphs and the supply trees of
+# atoms.py to a file-like object as text, JSON or DOT (for Graphviz).
+# Every one of them walks the tree with an explicit stack and writes each
+# node as it comes to it, so a tree of any size or depth is rendered in
+# time linear in the output, and the only memory used is the stack.
+#
+# The trees of atoms.py are recognized by their fields, not their classes,
+# so this module does not import atoms (which loads the library from S3).
+
+from stage_graph import *
+import json
+
+# The fields of each kind of node, written before its subtrees
+def supplyTreeFields(st):
+    return {"supply": st.supply.name,"outputs": sorted(st.supply.outputs)}
+
+def stageGraphFields(sg):
+    return {"good": sg.good,
+            "supply": sg.curSupply.name,
+            "status": sg.currentStatus.name,
+            "repaired": len(sg.repaired)}
+
+def inputsOf(t):
+    return t.inputDict.items()
+
+# A made tree of atoms.py has its subtrees as a "bom"; the others are leaves
+def isMadeAtomsTree(t):
+    return hasattr(t,"design")
+
+def atomsTreeFields(t):
+    return {"product": t.product.forJson(),"type": "made",
+            "party": t.maker.name,"design": t.design.name}
+
+def atomsTreeInputs(t):
+    return [(None,s) for s in t.supplies]
+
+# Write a tree as JSON: an object of fields(t) and, under childKey, an
+# object (or an array, if keyed is False) of the subtrees. If isLeaf(t),
+# leafJson(t) is written instead.
+def writeJsonTree(tree,out,fields,childKey,children,keyed = True,
+                  isLeaf = lambda t: False,leafJson = None):
+    (opening,closing) = ("{","}") if keyed else ("[","]")
+    def start(t):
+        if isLeaf(t):
+            out.write(json.dumps(leafJson(t)))
+            return None
+        out.write("{")
+        for (k, v) in fields(t).items():
+            out.write(json.dumps(k) + ": " + json.dumps(v) + ", ")
+        out.write(json.dumps(childKey) + ": " + opening)
+        return [iter(children(t)),True]
+    frame = start(tree)
+    stack = [frame] if frame is not None else []
+    while stack:
+        frame = stack[-1]
+        item = next(frame[0],None)
+        if item is None:
+            out.write(closing + "}")
+            stack.pop()
+            continue
+        if not frame[1]:
+            out.write(", ")
+        frame[1] = False
+        (key,child) = item
+        if keyed:
+            out.write(json.dumps(key) + ": ")
+        child = start(child)
+        if child is not None:
+            stack.append(child)
+
+# A DOT identifier or label: a JSON string is a DOT quoted string, as long
+# as non-ASCII characters are written as they are (DOT has no \u escapes)
+def dotQuote(value):
+    return json.dumps(value,ensure_ascii=False)
+
+# Write a tree as a DOT digraph, with a node labelled label(t) (and given
+# attributes(t), if any) for every subtree and an edge, labelled with its
+# key if there is one, to each of its children
+def writeDotTree(tree,out,label,children,name = "tree",attributes = lambda t: {}):
+    out.write("digraph " + dotQuote(name) + " {\n")
+    ids = itertools.count()
+    stack = [(tree,next(ids))]
+    while stack:
+        (t,i) = stack.pop()
+        attrs = {"label": label(t)}
+        attrs.update(attributes(t))
+        out.write("  n%d [%s];\n" % (i,", ".join(k + "=" + dotQuote(v) for (k, v) in attrs.items())))
+        pending = []
+        for (key,child) in children(t):
+            j = next(ids)
+            if key is None:
+                out.write("  n%d -> n%d;\n" % (i,j))
+            else:
+                out.write("  n%d -> n%d [label=%s];\n" % (i,j,dotQuote(key)))
+            pending.append((child,j))
+        stack.extend(reversed(pending))
+    out.write("}\n")
+
+def writeSupplyTreeText(st,out):
+    st.write(out)
+
+def writeSupplyTreeJson(st,out):
+    writeJsonTree(st,out,supplyTreeFields,"inputs",inputsOf)
+
+def writeSupplyTreeDot(st,out,name = "supplytree"):
+    writeDotTree(st,out,lambda t: t.supply.name,inputsOf,name)
+
+def writeStageGraphText(sg,out):
+    sg.write(out)
+
+def writeStageGraphJson(sg,out):
+    writeJsonTree(sg,out,stageGraphFields,"inputs",inputsOf)
+
+STATUS_COLORS = {StageStatus.OPEN: "black",
+                 StageStatus.SUCCEEDED: "darkgreen",
+                 StageStatus.FAILED: "red"}
+
+def writeStageGraphDot(sg,out,name = "stagegraph"):
+    writeDotTree(sg,out,StageGraph.stageLabel,inputsOf,name,
+                 lambda t: {"color": STATUS_COLORS[t.currentStatus]})
+
+# As the print method of the tree, indenting each level by four spaces
+def writeAtomsTreeText(tree,out):
+    stack = [(tree,0)]
+    while stack:
+        (t,indent) = stack.pop()
+        buffer = " " * indent
+        if isMadeAtomsTree(t):
+            out.write(buffer + "Maker: {}/{}\n".format(t.maker.name,t.design.name))
+            stack.extend((s,indent + 4) for s in reversed(list(t.supplies)))
+        elif hasattr(t,"supplier"):
+            out.write(buffer + "Supplier: {}/{}\n".format(t.supplier.name,t.product.description))
+        elif hasattr(t,"maker"):
+            out.write(buffer + "Maker Inventory: {}/{}\n".format(t.maker.name,t.product.description))
+        else:
+            out.write(buffer + "Missing:  {}\n".format(t.product.description))
+
+# The same JSON as the forJson method of the tree
+def writeAtomsTreeJson(tree,out):
+    writeJsonTree(tree,out,atomsTreeFields,"bom",atomsTreeInputs,keyed=False,
+                  isLeaf=lambda t: not isMadeAtomsTree(t),leafJson=lambda t: t.forJson())
+
+def writeAtomsTreeDot(tree,out,name = "supplytree"):
+    def label(t):
+        d = t.forJson() if not isMadeAtomsTree(t) else atomsTreeFields(t)
+        return " ".join([d["type"],d["product"]["id"]] + ([d["party"]] if "party" in d else []))
+    def children(t):
+        return atomsTreeInputs(t) if isMadeAtomsTree(t) else []
+    writeDotTree(tree,out,label,children,name)
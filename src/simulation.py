@@ -0,0 +1,183 @@
+# simulation - Helpful Engineering's Project Data order-failure simulation
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# A Monte Carlo estimate of how likely a set of orders is to be completed,
+# and how much repair that takes, when suppliers fail at random.
+#
+# In one trial all of the orders are advanced together, in rounds. In each
+# round every ready stage of every open order is attempted, and fails with
+# probability failureRate. A supplier that fails is gone for the rest of the
+# trial: it is scratched from (a snapshot of) the SupplyNetwork and from every
+# order that uses it. Orders that need repair are then repaired from what is
+# left of the network; an order that cannot be repaired has failed. Stages
+# that were not hit succeed. The trial ends when every order has completed
+# or failed.
+#
+# Trial i of a simulation with seed s uses its own random generator, seeded
+# from s and i, so a simulation is reproducible however its trials are
+# divided among processes, as long as the workers hash strings the same way
+# as the parent (the "fork" start method, or a fixed PYTHONHASHSEED): the
+# order of the inputs of a supply, and so of the stages drawn for, follows
+# the order of its frozenset of inputs.
+
+from stage_graph import *
+from collections import Counter
+import multiprocessing
+import random
+
+class TrialResult:
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.rounds = 0
+        # (completed, repairs needed) for each order, in the order given
+        self.repairs = []
+        self.supplierFailures = Counter()
+
+class SimulationReport:
+    def __init__(self,trials,orders):
+        self.trials = trials
+        self.orders = orders
+        self.completed = 0
+        self.failed = 0
+        self.totalRounds = 0
+        self.totalRepairs = 0
+        # number of repairs -> number of orders (over all trials) needing that many
+        self.repairHistogram = Counter()
+        # order index -> number of trials in which it completed
+        self.completedByOrder = Counter()
+        self.supplierFailures = Counter()
+    def add(self,result):
+        self.completed += result.completed
+        self.failed += result.failed
+        self.totalRounds += result.rounds
+        for (i,(done,n)) in enumerate(result.repairs):
+            self.totalRepairs += n
+            self.repairHistogram[n] += 1
+            if done:
+                self.completedByOrder[i] += 1
+        self.supplierFailures.update(result.supplierFailures)
+    # Add in the counts of a report on other trials of the same orders
+    def merge(self,other):
+        self.completed += other.completed
+        self.failed += other.failed
+        self.totalRounds += other.totalRounds
+        self.totalRepairs += other.totalRepairs
+        self.repairHistogram.update(other.repairHistogram)
+        self.completedByOrder.update(other.completedByOrder)
+        self.supplierFailures.update(other.supplierFailures)
+    def completionRate(self):
+        return self.completed / (self.completed + self.failed)
+    def meanRepairs(self):
+        return self.totalRepairs / (self.completed + self.failed)
+    def meanRounds(self):
+        return self.totalRounds / self.trials
+    def __str__(self):
+        return ("%d trials of %d orders: %.1f%% completed, %.2f repairs per order, %.1f rounds per trial"
+                % (self.trials,self.orders,100 * self.completionRate(),self.meanRepairs(),self.meanRounds()))
+
+# A supplier that fails only fails the stages it has not finished yet; what
+# it has already supplied to other orders is kept. Returns the affected
+# order IDs.
+def failOpenStages(registry,supplyName):
+    affected = []
+    for orderId in registry.ordersUsing(supplyName):
+        for node in registry.orders[orderId].stageGraph.nodesNamed(supplyName):
+            if node.currentStatus == StageStatus.OPEN:
+                node.currentStatus = StageStatus.FAILED
+                if orderId not in affected:
+                    affected.append(orderId)
+    return affected
+
+# orders is a list of (good, SupplyTree) pairs
+def runTrial(sn,orders,failureRate,rng):
+    result = TrialResult()
+    network = sn.snapshot()
+    planner = RepairPlanner(network)
+    registry = OrderRegistry()
+    repairs = {}
+    for (i,(good,st)) in enumerate(orders):
+        registry.add(i,Order(good,st))
+        repairs[i] = 0
+    active = dict(registry.orders)
+    done = {}
+    while active:
+        result.rounds += 1
+        stages = [sg for o in active.values() for sg in o.nextStages()]
+        hit = [sg for sg in stages if rng.random() < failureRate]
+        failing = {}
+        for sg in hit:
+            failing[sg.curSupply.name] = None
+        for name in failing:
+            result.supplierFailures[name] += 1
+            network.scratch(name)
+            failOpenStages(registry,name)
+        for sg in stages:
+            if sg.currentStatus == StageStatus.OPEN:
+                sg.currentStatus = StageStatus.SUCCEEDED
+        broken = [i for (i,o) in active.items() if o.stageGraph.needsRepair()]
+        for i in broken:
+            repairs[i] += len(active[i].stageGraph.namesOfAllSuppliesThatNeedRepair())
+        repair([active[i].stageGraph for i in broken],network,planner)
+        for (i,o) in list(active.items()):
+            if o.stageGraph.isComplete():
+                done[i] = True
+            elif o.stageGraph.needsRepair() or not o.readyStages():
+                done[i] = False
+            else:
+                continue
+            del active[i]
+            registry.remove(i)
+    for i in range(len(orders)):
+        if done[i]:
+            result.completed += 1
+        else:
+            result.failed += 1
+        result.repairs.append((done[i],repairs[i]))
+    return result
+
+def trialRandom(seed,trial):
+    return random.Random("%d:%d" % (seed,trial))
+
+_workerTrial = None
+
+def _initSimulationWorker(sn,orders,failureRate,seed):
+    global _workerTrial
+    _workerTrial = (sn,orders,failureRate,seed)
+
+def _runTrials(trials):
+    (sn,orders,failureRate,seed) = _workerTrial
+    report = SimulationReport(len(trials),len(orders))
+    for trial in trials:
+        report.add(runTrial(sn,orders,failureRate,trialRandom(seed,trial)))
+    return report
+
+# Run the given number of trials, split into chunks of trials across a
+# pool of processes (or in this process, if processes is 1).
+def simulate(sn,orders,trials,failureRate,seed = 0,processes = None,chunkSize = 64):
+    report = SimulationReport(trials,len(orders))
+    chunks = [range(i,min(i + chunkSize,trials)) for i in range(0,trials,chunkSize)]
+    if processes == 1:
+        _initSimulationWorker(sn,orders,failureRate,seed)
+        for chunk in chunks:
+            report.merge(_runTrials(chunk))
+        return report
+    with multiprocessing.Pool(processes,
+                              initializer=_initSimulationWorker,
+                              initargs=(sn,orders,failureRate,seed)) as pool:
+        for part in pool.imap_unordered(_runTrials,chunks):
+            report.merge(part)
+    return report
@@ -30,125 +30,479 @@
 
 from supply import *
 from enum import Enum
+import functools
+import heapq
+import itertools
+import weakref
 class StageStatus(Enum):
     OPEN = 0
     SUCCEEDED  = 1
     FAILED = 2
 
 
+# The position of a node in a depth-first walk of its graph: the index of
+# each child taken on the way down from the top.
+def treePosition(node,parentOf = None,childrenOf = None):
+    if parentOf is None:
+        parentOf = lambda n: n.parent
+        childrenOf = lambda n: n.inputDict.values()
+    path = []
+    parent = parentOf(node)
+    while parent is not None:
+        for (i,child) in enumerate(childrenOf(parent)):
+            if child is node:
+                path.append(i)
+                break
+        node = parent
+        parent = parentOf(node)
+    path.reverse()
+    return path
+
+# A StageGraph node knows its parent, and the root of every StageGraph keeps
+# an index of the whole graph: the nodes carrying each supply name, the
+# nodes that are currently FAILED, and the "ready" nodes, which are OPEN and
+# all of whose inputs have SUCCEEDED (each node counts its inputs that have
+# not). Status changes go through the currentStatus property so that the
+# index stays current, and repair keeps it current as nodes are replaced.
+# Lookups by name, status assertions and repair queries then cost O(depth)
+# per node involved instead of a walk over the whole graph. The index keeps
+# nodes in the order they were added, so lookups sort what they find by
+# treePosition and report nodes in the order a depth-first walk of the graph
+# would.
+# Each node also caches its earliest completion time (see earliestCompletion),
+# and the index marks it and its ancestors stale whenever a node below it
+# changes, so only the stale part of the graph is recomputed.
 class StageGraph:
-    def __init__(self,good,supplyTree):
+    __slots__ = ("curSupply","good","parent","root",
+                 "nodesByName","failedNodes","readyNodes","watchers","snapshots",
+                 "repaired","inputDict","_status","unfinishedInputs",
+                 "_eta","_critical","_etaStale")
+    def __init__(self,good,supplyTree,parent = None):
         # Now we want to do a deep copy of the supplyTree,
         # but add in a decoration. We could make this recursive, so we are doing
         # it all at each level. I suppose that is best.
         # However, a StageGraph has a history, in a way that a SupplyTree doesn't.
         self.curSupply = supplyTree.supply
-        self.good = good
+        self.good = internGood(good)
+        self.parent = parent
+        self.root = self if parent is None else parent.root
+        if parent is None:
+            # supply name -> {node: None}, used as an ordered set
+            self.nodesByName = {}
+            # the FAILED nodes, also as an ordered set
+            self.failedNodes = {}
+            # the ready nodes, also as an ordered set
+            self.readyNodes = {}
+            # callables told (supply name, +1 or -1) as nodes come and go
+            self.watchers = []
+            # the live StageGraphSnapshots of this graph (a WeakSet, or None)
+            self.snapshots = None
         # The history will be list of previous supplyTrees attempted for this
-        # node. If this node is changed, the old StageGraph goes into this list
-        self.repaired = []
+        # node. If this node is changed, the old StageGraph goes into this list.
+        # It is a tuple, so that the many nodes never repaired share one.
+        self.repaired = ()
         self.inputDict = {}
+        self._status = StageStatus.OPEN
+        self.unfinishedInputs = 0
+        self._eta = None
+        self._critical = None
+        self._etaStale = True
+        self.root.register(self)
         for key in supplyTree.inputDict:
-            self.inputDict[key] = StageGraph(key,supplyTree.inputDict[key])
-        self.currentStatus = StageStatus.OPEN
+            self.inputDict[key] = StageGraph(key,supplyTree.inputDict[key],self)
+    @property
+    def currentStatus(self):
+        return self._status
+    @currentStatus.setter
+    def currentStatus(self,status):
+        self.root.beforeChange()
+        old = self._status
+        self._status = status
+        self.root.statusChanged(self,old)
+    # Watchers and snapshots belong to whoever made them, not to the graph,
+    # so they are left behind when a StageGraph is copied or pickled.
+    def __getstate__(self):
+        state = {k: getattr(self,k) for k in StageGraph.__slots__ if hasattr(self,k)}
+        if "watchers" in state:
+            state["watchers"] = []
+            state["snapshots"] = None
+        return state
+    def __setstate__(self,state):
+        for (k,v) in state.items():
+            setattr(self,k,v)
+    # Return a copy-on-write snapshot of the whole graph (see StageGraphSnapshot)
+    def snapshot(self):
+        root = self.root
+        snap = StageGraphSnapshot(root)
+        if root.snapshots is None:
+            root.snapshots = weakref.WeakSet()
+        root.snapshots.add(snap)
+        return snap
+    # Called on the root before the graph is changed: the snapshots taken
+    # of it must not see the change, so each takes a private copy first.
+    def beforeChange(self):
+        if self.snapshots:
+            snaps = list(self.snapshots)
+            self.snapshots = None
+            for snap in snaps:
+                snap.detach()
+    # The names of the supplies used anywhere in this graph
+    def supplyNames(self):
+        return list(self.root.nodesByName)
+    # These maintain the index, and are only called on the root
+    def register(self,node):
+        self.invalidate(node)
+        self.nodesByName.setdefault(node.curSupply.name,{})[node] = None
+        for w in self.watchers:
+            w(node.curSupply.name,1)
+        if node._status == StageStatus.FAILED:
+            self.failedNodes[node] = None
+        self.updateReadiness(node)
+        if node.parent is not None and node._status != StageStatus.SUCCEEDED:
+            node.parent.unfinishedInputs += 1
+            self.updateReadiness(node.parent)
+    def unindex(self,node):
+        named = self.nodesByName[node.curSupply.name]
+        del named[node]
+        if not named:
+            del self.nodesByName[node.curSupply.name]
+        self.failedNodes.pop(node,None)
+        self.readyNodes.pop(node,None)
+        for w in self.watchers:
+            w(node.curSupply.name,-1)
+    def deregister(self,node):
+        self.invalidate(node.parent)
+        self.unindex(node)
+        if node.parent is not None and node._status != StageStatus.SUCCEEDED:
+            node.parent.unfinishedInputs -= 1
+            self.updateReadiness(node.parent)
+    def deregisterSubtree(self,node):
+        self.deregister(node)
+        stack = list(node.inputDict.values())
+        while stack:
+            n = stack.pop()
+            self.unindex(n)
+            stack.extend(n.inputDict.values())
+    def updateReadiness(self,node):
+        if node._status == StageStatus.OPEN and node.unfinishedInputs == 0:
+            self.readyNodes[node] = None
+        else:
+            self.readyNodes.pop(node,None)
+    def invalidate(self,node):
+        while node is not None:
+            node._etaStale = True
+            node = node.parent
+    def statusChanged(self,node,old):
+        self.invalidate(node)
+        if node._status == StageStatus.FAILED:
+            self.failedNodes[node] = None
+        else:
+            self.failedNodes.pop(node,None)
+        self.updateReadiness(node)
+        if node.parent is not None:
+            if old != StageStatus.SUCCEEDED and node._status == StageStatus.SUCCEEDED:
+                node.parent.unfinishedInputs -= 1
+                self.updateReadiness(node.parent)
+            elif old == StageStatus.SUCCEEDED and node._status != StageStatus.SUCCEEDED:
+                node.parent.unfinishedInputs += 1
+                self.updateReadiness(node.parent)
+    # The earliest time, from now, at which this stage can be finished: 0 if
+    # it has SUCCEEDED, infinite if it (or anything it needs) has FAILED, and
+    # otherwise the lead time of its supply after the last of its inputs.
+    def earliestCompletion(self):
+        if self._etaStale:
+            critical = None
+            if self._status == StageStatus.SUCCEEDED:
+                eta = 0
+            elif self._status == StageStatus.FAILED:
+                eta = math.inf
+            else:
+                start = 0
+                for child in self.inputDict.values():
+                    t = child.earliestCompletion()
+                    if critical is None or t > start:
+                        (start,critical) = (t,child)
+                eta = start + self.curSupply.leadTime
+            self._eta = eta
+            self._critical = critical
+            self._etaStale = False
+        return self._eta
+    # The chain of stages, from this one down, that determines its
+    # earliest completion
+    def criticalPath(self):
+        self.earliestCompletion()
+        path = []
+        node = self
+        while node is not None:
+            path.append(node)
+            node = node._critical
+        return path
+    # True if node is this node or below it
+    def contains(self,node):
+        if self.parent is None:
+            return node.root is self
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+    # The nodes (at or below this one) that carry the named supply
+    def nodesNamed(self,supplyName):
+        for node in sorted(self.root.nodesByName.get(supplyName,()),key=treePosition):
+            if self.contains(node):
+                yield node
+    # The FAILED nodes (at or below this one) with no FAILED node above
+    # them (up to this one).
+    def highestFailedNodes(self):
+        for node in sorted(self.root.failedNodes,key=treePosition):
+            n = node
+            highest = True
+            while n is not self:
+                n = n.parent
+                if n is None:
+                    # not below this node at all
+                    highest = False
+                    break
+                if n._status == StageStatus.FAILED:
+                    highest = False
+                    break
+            if highest:
+                yield node
     def isComplete(self):
         return self.currentStatus == StageStatus.SUCCEEDED
     def nameOfSupplyThatNeedsRepair(self):
         # This only returns one; we may need a version that returns
         # several, but we need not consider a FAILED node below
         # another node that is FAILED (at least because of a supply!)
-        if (self.currentStatus == StageStatus.FAILED):
-            return self.curSupply.name
-        else:
-            for key in self.inputDict:
-                thisOneNeedsRepair = self.inputDict[key].nameOfSupplyThatNeedsRepair()
-                if thisOneNeedsRepair is not None:
-                    return thisOneNeedsRepair
-            return None
+        for node in self.highestFailedNodes():
+            return node.curSupply.name
+        return None
     def namesOfAllSuppliesThatNeedRepair(self):
-        names = []
-        if (self.currentStatus == StageStatus.FAILED):
-            names.append(self.curSupply.name)
-        else:
-            for key in self.inputDict:
-                allNames = self.inputDict[key].namesOfAllSuppliesThatNeedRepair()
-                names += allNames
-        return names
+        return [node.curSupply.name for node in self.highestFailedNodes()]
     def needsRepair(self):
         return self.nameOfSupplyThatNeedsRepair() is not None
     def assertSupplyStatus(self,supplyName,status):
-        if (supplyName == self.curSupply.name):
-            self.currentStatus = status
-            return True
-        else:
-            found = False
-            for key in self.inputDict:
-                foundThisOne = self.inputDict[key].assertSupplyStatus(supplyName,status)
-                found = found or foundThisOne
-            return found
+        found = False
+        for node in self.nodesNamed(supplyName):
+            node.currentStatus = status
+            found = True
+        return found
     def scratch(self,supplyName):
         # A convenience function for "scratching a supplier"
         self.assertSupplyStatus(supplyName,StageStatus.FAILED)
     # Return a (sub) StageGraph based on name
     def findStageGraphByName(self,supplyName):
         # WARNING: It is not entirely clear this is unique.
-        if supplyName == self.curSupply.name:
-            return self
-        else:
-            for key in self.inputDict:
-                foundThisOne = self.inputDict[key].findStageGraphByName(supplyName)
-                if foundThisOne:
-                    return foundThisOne
+        for node in self.nodesNamed(supplyName):
+            return node
         return None
     def findGoodSuppliedByName(self,supplyName):
         sg = self.findStageGraphByName(supplyName)
         return sg.good
+    # Replace the supply of this node (and everything below it) by the
+    # newSupplyTree, and set the status to OPEN.
+    def replace(self,newSupplyTree):
+        root = self.root
+        root.beforeChange()
+        self.repaired = self.repaired + (self,)
+        for child in self.inputDict.values():
+            root.deregisterSubtree(child)
+        root.deregister(self)
+        self.curSupply = newSupplyTree.supply
+        root.register(self)
+        self.inputDict = {}
+        for key in newSupplyTree.inputDict:
+            self.inputDict[key] = StageGraph(key,newSupplyTree.inputDict[key],self)
+        self.currentStatus = StageStatus.OPEN
     # Replace the named with a new supply, and set the status to open
-    # This returns
+    # This returns true if the named supply was found
     def repair(self,supplyName,newSupplyTree):
-        # First find if if the supplyName exists
-        if (supplyName == self.curSupply.name):
-            self.repaired.append(self)
-            self.curSupply = newSupplyTree.supply
-            for key in newSupplyTree.inputDict:
-                self.inputDict[key] = StageGraph(key,newSupplyTree.inputDict[key])
-            self.currentStatus = StageStatus.OPEN
-            return True
-        else:
-            found = False
-            for key in self.inputDict:
-                foundThisOne = self.inputDict[key].repair(supplyName,newSupplyTree)
-                found = found or foundThisOne
-            return found
-    def applySub(self,sub,sn):
+        found = False
+        for node in self.nodesNamed(supplyName):
+            # a node below one we have already replaced is gone
+            if node in self.root.nodesByName.get(supplyName,()):
+                node.replace(newSupplyTree)
+                found = True
+        return found
+    # Repair the supply sub.a with a complete tree from sn headed by the
+    # supply sub.b. Returns true if such a tree was found and applied.
+    def applySub(self,sub,sn,planner = None):
+        if planner is None:
+            planner = RepairPlanner(sn)
         good = self.findGoodSuppliedByName(sub.a)
-        sts = list(SupplyProblem(good,sn).CompleteSupplyTrees())
-        if (len(sts) > 1):
-            print("warning! an arbitrary decisions is being made by applySub")
-        if (len(sts) >= 0): # nothing to do
-            st = sts[0]
-            self.repair(sub.a,st)
-    def applySubs(self,subs,sn):
+        st = planner.treeFor(good,sub.b)
+        if st is None:
+            return False
+        return self.repair(sub.a,st)
+    # Apply the first substitution that works for each failed supply; once
+    # a supply has been repaired the other substitutions for it no longer apply.
+    def applySubs(self,subs,sn,planner = None):
+        if planner is None:
+            planner = RepairPlanner(sn)
+        applied = set()
         for s in subs:
-            applySub(s,sn)
-    def __str__(self):
-        # if the inputDict is empty, we can render without a line!
-        numerator = self.curSupply.name + "/" + str(self.currentStatus.name)
+            if s.a not in applied and self.applySub(s,sn,planner):
+                applied.add(s.a)
+    def stageLabel(self):
+        label = self.curSupply.name + "/" + str(self.currentStatus.name)
         if (self.repaired):
-            numerator = numerator + " REPAIRED"
-        if (self.inputDict):
-            subtrees = "".join(map(str,self.inputDict.values()))
-            labels = []
-            for (k, v) in iter(self.inputDict.items()):
-                labels.append(k + ':' + str(v.curSupply.name))
-            denominator = ",".join(labels)
-            charlen = max(len(denominator),len(numerator))
-            numdiff = max(charlen - len(numerator),0)//2
-            demdiff = max(charlen - len(denominator),0)//2
-            return ' ' * numdiff + numerator + '\n' + '-' * charlen + '\n' + ' ' * demdiff + denominator + '\n' + subtrees
+            label = label + " REPAIRED"
+        return label
+    def write(self,out):
+        writeFractionTree(self,out,StageGraph.stageLabel,lambda sg: sg.curSupply.name)
+    def __str__(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+# A StageGraphSnapshot is a copy-on-write copy of a StageGraph, for what-if
+# analysis. Taking one costs O(1): the snapshot shares the nodes (and their
+# Supplies) of the graph and records its own changes on the side, as status
+# overrides for shared nodes and as private StageGraphs that replace the
+# repaired nodes. Only what a scenario changes is ever copied. If the
+# original graph is changed while snapshots of it are alive, each snapshot
+# first takes a private copy of the graph as it was (see beforeChange).
+# A snapshot supports the operations used to scratch and repair orders.
+class StageGraphSnapshot:
+    # snapshots are held in a WeakSet, so they need a __weakref__ slot
+    __slots__ = ("base","status","replacements","replaced","__weakref__")
+    def __init__(self,base):
+        self.base = base
+        # shared node -> status in this snapshot
+        self.status = {}
+        # shared node -> the private StageGraph that replaces it
+        self.replacements = {}
+        # private StageGraph -> the shared node it replaces
+        self.replaced = {}
+    def detach(self):
+        copy = self.materialize()
+        self.base = copy
+        self.status = {}
+        self.replacements = {}
+        self.replaced = {}
+    # The node at the top of the snapshot
+    def top(self):
+        return self.replacements.get(self.base,self.base)
+    @property
+    def good(self):
+        return self.top().good
+    @property
+    def curSupply(self):
+        return self.top().curSupply
+    def isPrivate(self,node):
+        return node.root is not self.base
+    def statusOf(self,node):
+        return self.status.get(node,node._status)
+    def setStatus(self,node,status):
+        if self.isPrivate(node):
+            node.currentStatus = status
+        elif status == node._status:
+            self.status.pop(node,None)
         else:
-            charlen = len(numerator)
-            return numerator + '\n' + '=' * charlen + '\n'
+            self.status[node] = status
+    # True if a shared node has been replaced (or is below one that has)
+    def hidden(self,node):
+        if not self.replacements:
+            return False
+        while node is not None:
+            if node in self.replacements:
+                return True
+            node = node.parent
+        return False
+    def isBelow(self,node,ancestor):
+        node = node.parent
+        while node is not None:
+            if node is ancestor:
+                return True
+            node = node.parent
+        return False
+    # The visible node that is the parent of a visible node
+    def parentOf(self,node):
+        if node in self.replaced:
+            node = self.replaced[node]
+        return node.parent
+    def childrenOf(self,node):
+        for (key,child) in node.inputDict.items():
+            yield (key,self.replacements.get(child,child))
+    def position(self,node):
+        return treePosition(node,self.parentOf,lambda n: (c for (k,c) in self.childrenOf(n)))
+    def supplyNames(self):
+        names = dict.fromkeys(self.base.nodesByName)
+        for r in self.replaced:
+            names.update(dict.fromkeys(r.nodesByName))
+        return list(names)
+    def nodesNamed(self,supplyName):
+        found = [n for n in self.base.nodesByName.get(supplyName,()) if not self.hidden(n)]
+        for r in self.replaced:
+            found.extend(r.nodesNamed(supplyName))
+        return sorted(found,key=self.position)
+    def highestFailedNodes(self):
+        failed = [n for n in self.base.failedNodes if n not in self.status]
+        failed += [n for (n,st) in self.status.items() if st == StageStatus.FAILED]
+        failed = [n for n in failed if not self.hidden(n)]
+        for r in self.replaced:
+            failed.extend(r.failedNodes)
+        for node in sorted(failed,key=self.position):
+            n = self.parentOf(node)
+            while n is not None and self.statusOf(n) != StageStatus.FAILED:
+                n = self.parentOf(n)
+            if n is None:
+                yield node
+    def isComplete(self):
+        return self.statusOf(self.top()) == StageStatus.SUCCEEDED
+    def assertSupplyStatus(self,supplyName,status):
+        found = False
+        for node in self.nodesNamed(supplyName):
+            self.setStatus(node,status)
+            found = True
+        return found
+    def findStageGraphByName(self,supplyName):
+        for node in self.nodesNamed(supplyName):
+            return node
+        return None
+    def repair(self,supplyName,newSupplyTree):
+        found = False
+        for node in self.nodesNamed(supplyName):
+            if self.isPrivate(node):
+                if node in node.root.nodesByName.get(supplyName,()):
+                    node.replace(newSupplyTree)
+                    found = True
+            elif not self.hidden(node):
+                # earlier replacements below this node are gone with it
+                for m in [m for m in self.replacements if self.isBelow(m,node)]:
+                    del self.replaced[self.replacements.pop(m)]
+                r = StageGraph(node.good,newSupplyTree)
+                r.repaired = (node,)
+                self.replacements[node] = r
+                self.replaced[r] = node
+                found = True
+        return found
+    # The snapshot as a StageGraph of its own
+    def materialize(self):
+        def treeOf(node):
+            return SupplyTree(node.curSupply,{key: treeOf(child) for (key,child) in self.childrenOf(node)})
+        top = self.top()
+        copy = StageGraph(top.good,treeOf(top))
+        stack = [(top,copy)]
+        while stack:
+            (node,c) = stack.pop()
+            c.repaired = node.repaired
+            c.currentStatus = self.statusOf(node)
+            for ((key,child),cc) in zip(self.childrenOf(node),c.inputDict.values()):
+                stack.append((child,cc))
+        return copy
+    # These behave exactly as they do on a StageGraph
+    scratch = StageGraph.scratch
+    needsRepair = StageGraph.needsRepair
+    nameOfSupplyThatNeedsRepair = StageGraph.nameOfSupplyThatNeedsRepair
+    namesOfAllSuppliesThatNeedRepair = StageGraph.namesOfAllSuppliesThatNeedRepair
+    findGoodSuppliedByName = StageGraph.findGoodSuppliedByName
+    applySub = StageGraph.applySub
+    applySubs = StageGraph.applySubs
+    def write(self,out):
+        self.materialize().write(out)
+    def __str__(self):
+        return str(self.materialize())
 
 # This is just a formalization of a structure that replaces
 # one symbol with another for clarity. The symbol package
@@ -164,23 +518,55 @@ class SubstSupply:
 
 
 
+# A RepairPlanner answers substitution queries against one SupplyNetwork.
+# Many stage graphs fail on the same good, so the complete replacement
+# trees for each good are computed once and cached. The cache belongs to
+# a version of the network, and is dropped when the network changes.
+class RepairPlanner:
+    def __init__(self,sn):
+        self.supplyNetwork = sn
+        self.version = sn.version
+        self.trees = {}
+    def completeSupplyTrees(self,good):
+        if self.version != self.supplyNetwork.version:
+            self.trees = {}
+            self.version = self.supplyNetwork.version
+        if good not in self.trees:
+            self.trees[good] = list(SupplyProblem(good,self.supplyNetwork).completeSupplyTrees())
+        return self.trees[good]
+    # The first complete tree for the good headed by the named supply
+    def treeFor(self,good,supplyName):
+        for st in self.completeSupplyTrees(good):
+            if st.supply.name == supplyName:
+                return st
+        return None
+    # The (name, good) pairs of the highest-level failures of a stage graph
+    def failures(self,sg):
+        return [(nm,sg.findGoodSuppliedByName(nm)) for nm in sg.namesOfAllSuppliesThatNeedRepair()]
+    def substitutions(self,sg):
+        return self.substitutionsForBatch([sg])[0]
+    # Return the list of substitutions for each of the stage graphs; the
+    # replacement trees for each distinct failed good are found only once.
+    def substitutionsForBatch(self,sgs):
+        failures = [self.failures(sg) for sg in sgs]
+        replacements = {}
+        for fs in failures:
+            for (nm,good) in fs:
+                if good not in replacements:
+                    replacements[good] = [st.supply.name for st in self.completeSupplyTrees(good)]
+        return [[SubstSupply(nm,b) for (nm,good) in fs for b in replacements[good]]
+                for fs in failures]
+
 # Return a list of substitutions
-def findAllSubstitutions(sn,sg):
+def findAllSubstitutions(sn,sg,planner = None):
     # Return all complete substitutions possible from the sn network in the sg
     # This may be an expensive operation.
     # A basic approach is to find all highest-level failures,
     # and then just compute all supplyTrees for that good that we can,
     # and construct substitutions for that.
-    subs = []
-    highestLevelNeeedsRepair = sg.namesOfAllSuppliesThatNeedRepair()
-    for nm in highestLevelNeeedsRepair:
-        # Now we need to find the good associated with this name
-        # in the stage_graph
-        good = sg.findGoodSuppliedByName(nm)
-        sp = SupplyProblem(good,sn)
-        for st in list(sp.completeSupplyTrees()):
-            subs.append(SubstSupply(nm,st.supply.name))
-    return subs
+    if planner is None:
+        planner = RepairPlanner(sn)
+    return planner.substitutions(sg)
 
 
 
@@ -192,46 +578,114 @@ class Order:
     def __init__(self,good,supplyTree):
         self.supplyTree = supplyTree
         self.stageGraph = StageGraph(good,self.supplyTree)
-    def findOneOPEN(self,sg):
-        # Advance the first element that is not OPEN
-        # (assume none of the nodes are FAILED, i.e., it is repaird)
-        # If there is no such element, return null. This should be a
-        # DEEPEST such element
-        oneThatIsOpen = None
-        for key in sg.inputDict:
-            oneThatIsOpen = self.findOneOPEN(sg.inputDict[key])
-            if oneThatIsOpen is not None:
-                return oneThatIsOpen
-        if sg.currentStatus == StageStatus.OPEN:
-            return sg
+    # The stages that can be carried out now: OPEN stages all of whose inputs
+    # have SUCCEEDED. The root keeps these up to date as stages succeed, fail
+    # or are repaired, so this does not search the graph.
+    def readyStages(self):
+        return list(self.stageGraph.readyNodes)
+    # Mark up to n (all if n is None) of the currently ready stages as
+    # SUCCEEDED and return them. Stages are taken in the order they became
+    # ready, or in increasing order of priority(stage) if it is given.
+    # Stages that become ready because of this batch wait for the next one.
+    def nextStages(self,n = None,priority = None):
+        ready = self.stageGraph.readyNodes
+        if priority is not None:
+            return sorted(ready,key=priority) if n is None else heapq.nsmallest(n,ready,key=priority)
         else:
-            return None
-    def advanceOne(self):
-        # return a StageGraph if we succeed, None if we do not
-        sg = self.findOneOPEN(self.stageGraph)
-        if (sg is not None):
+            return list(itertools.islice(ready,n))
+    def advanceBatch(self,n = None,priority = None):
+        stages = self.nextStages(n,priority)
+        for sg in stages:
             sg.currentStatus = StageStatus.SUCCEEDED
-            return sg
+        return stages
+    def earliestCompletion(self):
+        return self.stageGraph.earliestCompletion()
+    def criticalPath(self):
+        return self.stageGraph.criticalPath()
+    def advanceOne(self,priority = None):
+        # return a StageGraph if we succeed, None if we do not
+        stages = self.advanceBatch(1,priority)
+        if stages:
+            return stages[0]
         else:
             return None
 
+# An OrderRegistry holds live orders by ID, with a reverse index from each
+# supply name to the orders whose stage graphs use it (and how many nodes
+# each of them has for it). The index is kept current through repairs by
+# watching the index of each order's StageGraph, so scratching a supplier
+# only touches the orders and nodes that actually use it.
+class OrderRegistry:
+    def __init__(self):
+        self.orders = {}
+        # supply name -> {order ID: number of nodes}
+        self.ordersBySupply = {}
+        self.watchers = {}
+    def add(self,orderId,order):
+        if orderId in self.orders:
+            self.remove(orderId)
+        self.orders[orderId] = order
+        root = order.stageGraph
+        for name,nodes in root.nodesByName.items():
+            self.ordersBySupply.setdefault(name,{})[orderId] = len(nodes)
+        watcher = functools.partial(self.countChanged,orderId)
+        self.watchers[orderId] = watcher
+        root.watchers.append(watcher)
+    def remove(self,orderId):
+        order = self.orders.pop(orderId)
+        root = order.stageGraph
+        root.watchers.remove(self.watchers.pop(orderId))
+        for name in root.nodesByName:
+            self.countChanged(orderId,name,-len(root.nodesByName[name]))
+        return order
+    def countChanged(self,orderId,supplyName,delta):
+        using = self.ordersBySupply.setdefault(supplyName,{})
+        n = using.get(orderId,0) + delta
+        if n > 0:
+            using[orderId] = n
+        else:
+            using.pop(orderId,None)
+            if not using:
+                del self.ordersBySupply[supplyName]
+    # The IDs of the orders that use the named supply
+    def ordersUsing(self,supplyName):
+        return list(self.ordersBySupply.get(supplyName,()))
+    # order ID -> earliest completion of the order
+    def earliestCompletions(self):
+        return {orderId: o.earliestCompletion() for (orderId,o) in self.orders.items()}
+    # Mark every stage that uses the named supply as FAILED, and
+    # return the IDs of the orders affected.
+    def scratch(self,supplyName):
+        affected = self.ordersUsing(supplyName)
+        for orderId in affected:
+            self.orders[orderId].stageGraph.scratch(supplyName)
+        return affected
+    # Scratch every supply of the network, returning the affected order IDs
+    def scratchNetwork(self,sn):
+        affected = {}
+        for s in sn.supplies:
+            for orderId in self.scratch(s.name):
+                affected[orderId] = None
+        return list(affected)
+
 # Functions operating on lists of sgs
 def scratch(sgs,sn):
+    names = set(s.name for s in sn.supplies)
     for sg in sgs:
-        for s in sn.supplies:
-            sg.scratch(s.name)
+        for name in sg.supplyNames():
+            if name in names:
+                sg.scratch(name)
 
 
 
 # This is a deep one: We look for anything we can repair and apply it,
 # producing new stage graphs.
-def repair(sgs,sn):
+def repair(sgs,sn,planner = None):
+    if planner is None:
+        planner = RepairPlanner(sn)
     repaired = []
-    for s in sgs:
-        subs = findAllSubstitutions(sn,s)
-        if subs is None:
-            repaired.append(s)
-        else:
-            s.applySubs(subs,sn)
-            repaired.append(s)
+    for (s,subs) in zip(sgs,planner.substitutionsForBatch(sgs)):
+        if subs:
+            s.applySubs(subs,sn,planner)
+        repaired.append(s)
     return repaired
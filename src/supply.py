@@ -19,26 +19,86 @@
 # Note an invariant (currently unchecked) is that the eqn should have the same number
 # of sybols as the inputs (or that + 1) and the names should match.
 # It would be better if we asserted that cleanly
+from collections import Counter
+from fractions import Fraction
 from functools import reduce
 from sympy import *
+import array
+import bisect
+import heapq
+import io
+import itertools
+import math
+import multiprocessing
+import random
+import sys
 
 
+# Goods are named by strings, and the same few names recur in every supply
+# and tree, so they are interned: equal names are then one shared object.
+def internGood(good):
+    if type(good) is str:
+        return sys.intern(good)
+    return good
+
+# The leadTime of a Supply is how long it takes, once its inputs are to hand,
+# to produce its outputs (in whatever unit of time the network uses), and its
+# capacity, if known, is how many of them it can have in progress at once.
+# quantities, if given, maps inputs to the units of each used per unit of output.
 class Supply:
-    def __init__(self,name,outputs,inputs,eqn):
+    __slots__ = ("name","inputs","outputs","eqn","leadTime","capacity","quantities")
+    def __init__(self,name,outputs,inputs,eqn,leadTime = 0,capacity = None,quantities = None):
         self.name = name
-        self.inputs = frozenset(inputs)
-        self.outputs = frozenset(outputs)
+        self.inputs = frozenset(internGood(g) for g in inputs)
+        self.outputs = frozenset(internGood(g) for g in outputs)
         self.eqn = eqn
+        self.leadTime = leadTime
+        self.capacity = capacity
+        self.quantities = dict(quantities) if quantities is not None else {}
+    # The units of the input good used for each unit of output: as given in
+    # quantities, or else the coefficient of the good in the characteristic
+    # equation (the 4 of chair_1 + 4*leg + seat + back), or else 1.
+    def quantityOf(self,good):
+        if good not in self.quantities:
+            q = 1
+            if isinstance(self.eqn,Expr):
+                c = self.eqn.coeff(symbols(good))
+                if c.is_number and c > 0:
+                    q = _price(c)
+            self.quantities[good] = q
+        return self.quantities[good]
 
+# The version of a SupplyNetwork goes up whenever it is changed through
+# its methods, so that results computed from it can be cached.
+# A snapshot of a network shares its list of supplies (Supplies themselves
+# are never changed) until either of them is changed, so taking one is O(1).
 class SupplyNetwork:
     def __init__(self,name,supplies):
         self.name = name
         self.supplies = supplies
+        self.version = 0
+        self.shared = False
+    def snapshot(self):
+        copy = SupplyNetwork(self.name,self.supplies)
+        copy.version = self.version
+        copy.shared = True
+        self.shared = True
+        return copy
+    def beforeChange(self):
+        if self.shared:
+            self.supplies = list(self.supplies)
+            self.shared = False
     # Remove a supply from this network
     def scratch(self,supplyName):
-        for c in self.supplies:
+        self.beforeChange()
+        for c in list(self.supplies):
             if c.name == supplyName:
                 self.supplies.remove(c)
+                self.version += 1
+    def addSupply(self,supply):
+        self.beforeChange()
+        self.supplies.append(supply)
+        self.version += 1
 
 def unionSupplyNetworks(a,b):
     return SupplyNetwork(a.name + "|" + b.name,a.supplies + b.supplies)
@@ -60,49 +120,154 @@ def allSupplies(tp,sn):
         if tp in s.outputs:
             yield s
 
+# A summary of a SupplyTree: the multiset of goods it leaves missing,
+# whether every subtree supplies the input it is keyed by, its depth
+# (a single node has depth 1) and its number of nodes.
+class SupplyTreeSummary:
+    __slots__ = ("missingGoods","consistent","depth","size")
+    def __init__(self,missingGoods,consistent,depth,size):
+        self.missingGoods = missingGoods
+        self.consistent = consistent
+        self.depth = depth
+        self.size = size
+
 # The inputDict maps keys to additional SupplyTrees.
+# SupplyTrees are not changed once they are built, so the summary of a tree
+# is computed the first time it is needed and kept. It is made from the
+# summaries of the subtrees, which are shared by every tree containing them.
 class SupplyTree:
+    __slots__ = ("supply","inputDict","_summary")
     def __init__(self,supply,inputDict):
         self.supply = supply
         self.inputDict = inputDict
+        self._summary = None
+    def summary(self):
+        if self._summary is None:
+            missingGoods = Counter()
+            consistent = True
+            depth = 0
+            size = 1
+            for v in self.supply.inputs:
+                if v not in self.inputDict:
+                    missingGoods[v] += 1
+            for (k, v) in self.inputDict.items():
+                sub = v.summary()
+                if k in self.supply.inputs:
+                    missingGoods.update(sub.missingGoods)
+                consistent = (consistent and sub.consistent
+                              and k in self.supply.inputs and k in v.supply.outputs)
+                depth = max(depth,sub.depth)
+                size += sub.size
+            self._summary = SupplyTreeSummary(missingGoods,consistent,depth + 1,size)
+        return self._summary
     def incompleteGoods(self):
-        missingGoods = []
-        for v in self.supply.inputs:
-            if v in self.inputDict:
-                missingGoods = missingGoods + self.inputDict[v].incompleteGoods()
-            else:
-                missingGoods.append(v)
-        return missingGoods
+        return list(self.summary().missingGoods.elements())
     def isComplete(self):
-        missingGoods = self.incompleteGoods()
-        return not missingGoods
+        return not self.summary().missingGoods
+    def depth(self):
+        return self.summary().depth
+    def size(self):
+        return self.summary().size
     # my initial printing will just take the subtrees and
     # place this node above them.
+    def write(self,out):
+        writeFractionTree(self,out,lambda t: ",".join(t.supply.outputs) + ":" + t.supply.name,
+                          lambda t: t.supply.name)
     def __str__(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+# The supplies and goods of many packed trees, each stored once and
+# referred to by its index
+class SupplyTable:
+    __slots__ = ("supplies","supplyIndex","goods","goodIndex")
+    def __init__(self):
+        self.supplies = []
+        self.supplyIndex = {}
+        self.goods = []
+        self.goodIndex = {}
+    def supplyId(self,supply):
+        i = self.supplyIndex.get(supply)
+        if i is None:
+            i = self.supplyIndex[supply] = len(self.supplies)
+            self.supplies.append(supply)
+        return i
+    def goodId(self,good):
+        i = self.goodIndex.get(good)
+        if i is None:
+            i = self.goodIndex[good] = len(self.goods)
+            self.goods.append(internGood(good))
+        return i
+
+# A whole SupplyTree as parallel arrays (a "struct of arrays"), in preorder:
+# for each node, the index in the table of its supply and of the good it is
+# keyed by (None for the root), and the position of its parent (-1 for the
+# root). That is about ten bytes a node, where a SupplyTree takes an object
+# and a dict for every node.
+class PackedSupplyTree:
+    __slots__ = ("table","supplies","goods","parents")
+    def __init__(self,supplyTree,table):
+        self.table = table
+        self.supplies = array.array("I")
+        self.goods = array.array("I")
+        self.parents = array.array("i")
+        stack = [(None,supplyTree,-1)]
+        while stack:
+            (good,st,parent) = stack.pop()
+            i = len(self.supplies)
+            self.supplies.append(table.supplyId(st.supply))
+            self.goods.append(table.goodId(good))
+            self.parents.append(parent)
+            for (k,v) in reversed(list(st.inputDict.items())):
+                stack.append((k,v,i))
+    def __len__(self):
+        return len(self.supplies)
+    def unpack(self):
+        table = self.table
+        nodes = []
+        for (s,g,p) in zip(self.supplies,self.goods,self.parents):
+            node = SupplyTree(table.supplies[s],{})
+            if p >= 0:
+                nodes[p].inputDict[table.goods[g]] = node
+            nodes.append(node)
+        return nodes[0]
+    def depth(self):
+        depths = array.array("I")
+        for p in self.parents:
+            depths.append(depths[p] + 1 if p >= 0 else 1)
+        return max(depths)
+    def supplyNames(self):
+        return [self.table.supplies[s].name for s in self.supplies]
+
+# Write a tree (anything with an inputDict of subtrees) to out as a stack of
+# "fractions", a node over the labels of its inputs, followed by its subtrees
+# in order. The tree is walked with a stack and written as it goes, so the
+# time taken is linear in the size of the output.
+def writeFractionTree(tree,out,numerator,supplyName):
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        num = numerator(t)
         # if the inputDict is empty, we can render without a line!
-        numerator = ",".join(self.supply.outputs) + ":" + self.supply.name
-        if (self.inputDict):
-            subtrees = "".join(map(str,self.inputDict.values()))
+        if (t.inputDict):
             labels = []
-            for (k, v) in iter(self.inputDict.items()):
-                labels.append(k + ':' + str(v.supply.name))
+            for (k, v) in iter(t.inputDict.items()):
+                labels.append(k + ':' + str(supplyName(v)))
             denominator = ",".join(labels)
-            charlen = max(len(denominator),len(numerator))
-            numdiff = max(charlen - len(numerator),0)//2
+            charlen = max(len(denominator),len(num))
+            numdiff = max(charlen - len(num),0)//2
             demdiff = max(charlen - len(denominator),0)//2
-            return ' ' * numdiff + numerator + '\n' + '-' * charlen + '\n' + ' ' * demdiff + denominator + '\n' + subtrees
+            out.write(' ' * numdiff + num + '\n' + '-' * charlen + '\n' + ' ' * demdiff + denominator + '\n')
+            stack.extend(reversed(list(t.inputDict.values())))
         else:
-            charlen = len(numerator)
-            return numerator + '\n' + '=' * charlen + '\n'
+            out.write(num + '\n' + '=' * len(num) + '\n')
 
+# A SupplyTree is consistent if every subtree is keyed by an input of its
+# parent's supply that the subtree's supply outputs, all the way down.
 # TODO: We could add Equational consistency to this
 def checkConsistency(supplyTree):
-    for key in supplyTree.inputDict:
-        if key not in supplyTree.inputDict[key].supply.outputs:
-            return False
-        else:
-            return checkConsistency(supplyTree.inputDict[key])
-    return True
+    return supplyTree.summary().consistent
 
 # Return the characteristic equation of this supplyTree by using
 # substitutions on the equations of supply
@@ -226,6 +391,11 @@ class SupplyProblem:
             return currentTree
         else:
             raise StopIteration
+    # The same solution space as iterating this problem, enumerated
+    # by a process pool (see parallelSupplyTrees).
+    def parallelIter(self,processes=None,ordered=False):
+        for (good,tree) in parallelSupplyTrees([self.good],self.supplyNetwork,processes,ordered):
+            yield tree
     def completeSupplyTrees(self):
         allTrees = list(iter(self))
         return filter(lambda a: a.isComplete(),allTrees)
@@ -242,3 +412,446 @@ class SupplyProblem:
         return (tree,m)
     def optimalCompleteSupplyTreeByPrice(self,priceMap):
         return self.optimalCompleteSupplyTrees((lambda s: characteristicExpression(s).subs(priceMap)))
+    # Yield (tree, price) pairs for the k cheapest complete trees (all of them
+    # if k is None), cheapest first; see KBestSupplyTrees.
+    def kBestCompleteSupplyTreesByPrice(self,priceMap,k = None):
+        return itertools.islice(KBestSupplyTrees(self.supplyNetwork,priceMap).trees(self.good),k)
+
+
+# Counting supply trees without enumerating them. For every supply S of g,
+# SupplyProblem(g,sn) yields one tree for every way of leaving each input of S
+# empty or filling it with one of the trees of that input. So, writing T(g)
+# for the number of trees of g and C(g) for the number of complete ones,
+#   T(g) = sum over S of the product over inputs i of S of (1 + T(i))
+#   C(g) = sum over S of the product over inputs i of S of C(i)
+# which we evaluate bottom-up with Python's unbounded integers.
+# A network with cycles has goods with infinitely many trees: any good that
+# depends on a cycle has infinitely many trees, and any good that depends on
+# a cycle of supplies that can all be completed has infinitely many complete
+# trees. Those counts are reported as math.inf.
+class SupplyTreeCount:
+    def __init__(self,complete,total):
+        self.complete = complete
+        self.total = total
+        if total == math.inf:
+            self.incomplete = math.inf
+        else:
+            self.incomplete = total - complete
+    def __repr__(self):
+        return "SupplyTreeCount(complete=%s, incomplete=%s)" % (self.complete,self.incomplete)
+
+# Map every good to the supplies that produce it, in network order
+# (a supply listed twice in the network is counted twice, as in allSupplies).
+def _producers(sn):
+    producers = {}
+    for s in sn.supplies:
+        for o in s.outputs:
+            producers.setdefault(o,[]).append(s)
+    return producers
+
+def _allGoods(sn):
+    goods = set()
+    for s in sn.supplies:
+        goods.update(s.inputs)
+        goods.update(s.outputs)
+    return goods
+
+# Order the goods so that each one follows all of its dependencies.
+# Goods that depend (directly or not) on a cycle are left out.
+def _dependencyOrder(goods,dependencies):
+    waiting = {}
+    dependents = {}
+    ready = []
+    for g in goods:
+        deps = dependencies[g]
+        waiting[g] = len(deps)
+        for d in deps:
+            dependents.setdefault(d,[]).append(g)
+        if not deps:
+            ready.append(g)
+    order = []
+    while ready:
+        g = ready.pop()
+        order.append(g)
+        for h in dependents.get(g,()):
+            waiting[h] -= 1
+            if waiting[h] == 0:
+                ready.append(h)
+    return order
+
+# The supplies all of whose inputs have at least one complete tree,
+# found by propagating upwards from the supplies that have no inputs.
+def _completableSupplies(sn):
+    unresolved = {}
+    users = {}
+    ready = []
+    for s in sn.supplies:
+        if s in unresolved:
+            continue
+        unresolved[s] = len(s.inputs)
+        for i in s.inputs:
+            users.setdefault(i,[]).append(s)
+        if not s.inputs:
+            ready.append(s)
+    completable = set()
+    completeGoods = set()
+    while ready:
+        s = ready.pop()
+        completable.add(s)
+        for o in s.outputs:
+            if o not in completeGoods:
+                completeGoods.add(o)
+                for u in users.get(o,()):
+                    unresolved[u] -= 1
+                    if unresolved[u] == 0:
+                        ready.append(u)
+    return completable
+
+# The number of trees made of parts with the given numbers of trees, and the
+# number made of alternatives with the given numbers. Counts are exact ints,
+# and can grow too large for a float, so infinite counts (math.inf) are
+# checked for rather than multiplied or added.
+def _countProduct(counts):
+    counts = list(counts)
+    if 0 in counts:
+        return 0
+    if math.inf in counts:
+        return math.inf
+    return math.prod(counts)
+
+def _countSum(counts):
+    counts = list(counts)
+    if math.inf in counts:
+        return math.inf
+    return sum(counts)
+
+# Return a map from every good to the number of complete trees for it.
+def completeTreeCounts(sn,producers = None):
+    if producers is None:
+        producers = _producers(sn)
+    completable = _completableSupplies(sn)
+    goods = set()
+    for s in completable:
+        goods.update(s.outputs)
+    dependencies = {}
+    for g in goods:
+        dependencies[g] = set()
+        for s in producers[g]:
+            if s in completable:
+                dependencies[g].update(s.inputs)
+    counts = dict.fromkeys(_allGoods(sn),0)
+    for g in goods:
+        counts[g] = math.inf
+    for g in _dependencyOrder(goods,dependencies):
+        counts[g] = _countSum(_countProduct(counts[i] for i in s.inputs)
+                              for s in producers[g] if s in completable)
+    return counts
+
+# Return a map from every good to the number of trees (complete or not) for it.
+def totalTreeCounts(sn,producers = None):
+    if producers is None:
+        producers = _producers(sn)
+    goods = _allGoods(sn)
+    dependencies = {}
+    for g in goods:
+        dependencies[g] = set()
+        for s in producers.get(g,()):
+            dependencies[g].update(s.inputs)
+    counts = dict.fromkeys(goods,math.inf)
+    for g in _dependencyOrder(goods,dependencies):
+        # each input is either left out or filled by one of its trees
+        counts[g] = _countSum(_countProduct(math.inf if counts[i] == math.inf else 1 + counts[i]
+                                            for i in s.inputs)
+                              for s in producers.get(g,()))
+    return counts
+
+# Return a map from every good in the network to its SupplyTreeCount, so that
+# counts[g].complete == len(list(SupplyProblem(g,sn).completeSupplyTrees())).
+def countSupplyTrees(sn):
+    producers = _producers(sn)
+    complete = completeTreeCounts(sn,producers)
+    total = totalTreeCounts(sn,producers)
+    return {g: SupplyTreeCount(complete[g],total[g]) for g in total}
+
+# Drawing complete supply trees at random, without enumerating them.
+# To draw uniformly, a supply S of the good is chosen with probability
+# proportional to the number of complete trees S heads (the product of the
+# counts of its inputs), and each input is then filled by a uniform draw of
+# its own, which makes every complete tree of the good equally likely.
+# Alternatively, weights maps supply names to non-negative weights, and at
+# every good a supply is chosen among those that can be completed in
+# proportion to its weight (a supply that is not named has weight 1).
+# Goods with infinitely many complete trees (see countSupplyTrees) cannot
+# be sampled.
+class SupplyTreeSampler:
+    def __init__(self,supplyNetwork,seed = None,weights = None):
+        self.supplyNetwork = supplyNetwork
+        self.weights = weights
+        self.random = random.Random(seed)
+        producers = _producers(supplyNetwork)
+        completable = _completableSupplies(supplyNetwork)
+        self.counts = completeTreeCounts(supplyNetwork,producers)
+        # For each good that can be sampled, its candidate supplies and their
+        # cumulative weights, so that a choice is one bisection. Goods are
+        # done inputs first, and a supply is only a candidate if every one of
+        # its inputs can be sampled (weights can rule out all of the
+        # supplies of an input).
+        goods = set(g for (g,n) in self.counts.items() if n != 0 and n != math.inf)
+        dependencies = {}
+        for g in goods:
+            dependencies[g] = set()
+            for s in producers[g]:
+                if s in completable:
+                    dependencies[g].update(s.inputs)
+        self.choices = {}
+        for g in _dependencyOrder(goods,dependencies):
+            supplies = []
+            cumulative = []
+            total = 0
+            for s in producers[g]:
+                if s not in completable or any(i not in self.choices for i in s.inputs):
+                    continue
+                w = (_countProduct(self.counts[i] for i in s.inputs) if weights is None
+                     else weights.get(s.name,1))
+                if w <= 0:
+                    continue
+                total += w
+                supplies.append(s)
+                cumulative.append(total)
+            if supplies:
+                self.choices[g] = (supplies,cumulative,total)
+    def chooseSupply(self,good):
+        supplies,cumulative,total = self.choices[good]
+        if self.weights is None:
+            r = self.random.randrange(total)
+        else:
+            r = self.random.random() * total
+        return supplies[min(bisect.bisect_right(cumulative,r),len(supplies) - 1)]
+    def draw(self,good):
+        supply = self.chooseSupply(good)
+        d = {}
+        for i in supply.inputs:
+            d[i] = self.draw(i)
+        return SupplyTree(supply,d)
+    def sample(self,good):
+        if self.counts.get(good,0) == math.inf:
+            raise ValueError("good %s has infinitely many complete supply trees" % good)
+        if good not in self.choices:
+            raise ValueError("good %s has no complete supply tree to sample" % good)
+        return self.draw(good)
+    # Yield n trees for the good; the tables are shared by all of the draws.
+    def samples(self,good,n):
+        for _ in range(n):
+            yield self.sample(good)
+
+# Ranking complete supply trees by price, cheapest first, without
+# enumerating them. This works for additive cost models, that is when the
+# eqn of every supply is linear in its inputs with non-negative coefficients
+# once the priceMap is substituted, e.g. chair_1 + 4*leg + seat + back.
+# The cost of a tree is then a base price plus a weighted sum of the costs of
+# its subtrees, and the k-th cheapest tree of a good can only be built from
+# the cheapest few trees of its inputs. We use the lazy algorithm of Huang and
+# Chiang ("Better k-best parsing", 2005): every good keeps the trees found so
+# far in cost order and a heap of candidates, and the successors of a tree
+# (the same supply with one input moved to its next cheapest tree) are only
+# generated once that tree has been handed out. Producing the first k trees of
+# a good therefore costs roughly k times the size of a tree, however many
+# trees the good has.
+def _price(x):
+    x = sympify(x)
+    if x.is_Integer:
+        return int(x)
+    if x.is_Rational:
+        return Fraction(int(x.p),int(x.q))
+    return float(x)
+
+# The additive cost model of a supply: a base price and one coefficient for
+# each of the given inputs.
+def additiveCostModel(supply,inputs,priceMap):
+    if not isinstance(supply.eqn,Expr):
+        raise ValueError("supply %s has no equation" % supply.name)
+    syms = [symbols(i) for i in inputs]
+    base = supply.eqn.subs([(x,0) for x in syms]).subs(priceMap)
+    if not base.is_number:
+        raise ValueError("supply %s does not have a price: %s" % (supply.name,base))
+    coefficients = []
+    for x in syms:
+        c = diff(supply.eqn,x)
+        if c.free_symbols & set(syms):
+            raise ValueError("supply %s is not additive in its inputs" % supply.name)
+        c = c.subs(priceMap)
+        if not c.is_number or c < 0:
+            raise ValueError("supply %s has a negative or unpriced coefficient" % supply.name)
+        coefficients.append(_price(c))
+    return (_price(base),coefficients)
+
+class KBestSupplyTrees:
+    def __init__(self,supplyNetwork,priceMap):
+        self.supplyNetwork = supplyNetwork
+        self.priceMap = priceMap
+        self.producers = _producers(supplyNetwork)
+        self.completable = _completableSupplies(supplyNetwork)
+        self.counts = completeTreeCounts(supplyNetwork,self.producers)
+        # good -> list of (supply, inputs, base, coefficients), or None if the
+        # good has no complete trees (or infinitely many); made the first time
+        # the good is visited, so only the goods under the queried one need
+        # a cost model
+        self.edges = {}
+        # good -> list of (cost, SupplyTree) in nondecreasing cost order
+        self.found = {}
+        # good -> heap of (cost, tie breaker, edge index, input ranks)
+        self.candidates = {}
+        self.seen = {}
+        # good -> number of found trees whose successors are in the heap
+        self.expanded = {}
+        self.counter = itertools.count()
+    def edgesOf(self,good):
+        if good not in self.edges:
+            n = self.counts.get(good,0)
+            if n == 0 or n == math.inf:
+                self.edges[good] = None
+            else:
+                self.edges[good] = []
+                for s in self.producers[good]:
+                    if s in self.completable:
+                        inputs = list(s.inputs)
+                        (base,coefficients) = additiveCostModel(s,inputs,self.priceMap)
+                        self.edges[good].append((s,inputs,base,coefficients))
+        return self.edges[good]
+    def cost(self,good,edgeIdx,ranks):
+        (s,inputs,base,coefficients) = self.edges[good][edgeIdx]
+        c = base
+        for i,r,k in zip(inputs,ranks,coefficients):
+            c += k * self.found[i][r][0]
+        return c
+    def push(self,good,edgeIdx,ranks):
+        if (edgeIdx,ranks) in self.seen[good]:
+            return
+        (s,inputs,base,coefficients) = self.edges[good][edgeIdx]
+        for i,r in zip(inputs,ranks):
+            if self.kth(i,r) is None:
+                return
+        self.seen[good].add((edgeIdx,ranks))
+        heapq.heappush(self.candidates[good],
+                       (self.cost(good,edgeIdx,ranks),next(self.counter),edgeIdx,ranks))
+    # Return the (cost, SupplyTree) pair of rank k (from 0) for the good,
+    # or None if the good has no more than k complete trees.
+    def kth(self,good,k):
+        if self.edgesOf(good) is None:
+            return None
+        if good not in self.found:
+            self.found[good] = []
+            self.candidates[good] = []
+            self.seen[good] = set()
+            self.expanded[good] = 0
+            for edgeIdx,(s,inputs,base,coefficients) in enumerate(self.edges[good]):
+                self.push(good,edgeIdx,(0,) * len(inputs))
+        found = self.found[good]
+        while len(found) <= k:
+            if self.expanded[good] < len(found):
+                (_,_,edgeIdx,ranks) = found[-1][2]
+                for x in range(len(ranks)):
+                    self.push(good,edgeIdx,ranks[:x] + (ranks[x] + 1,) + ranks[x + 1:])
+                self.expanded[good] = len(found)
+            if not self.candidates[good]:
+                break
+            candidate = heapq.heappop(self.candidates[good])
+            (cost,_,edgeIdx,ranks) = candidate
+            (s,inputs,base,coefficients) = self.edges[good][edgeIdx]
+            d = {}
+            for i,r in zip(inputs,ranks):
+                d[i] = self.found[i][r][1]
+            found.append((cost,SupplyTree(s,d),candidate))
+        if k < len(found):
+            return found[k][:2]
+        return None
+    # Yield (SupplyTree, cost) pairs for the good in nondecreasing cost order.
+    def trees(self,good):
+        if self.counts.get(good,0) == math.inf:
+            raise ValueError("good %s has infinitely many complete supply trees" % good)
+        k = 0
+        while True:
+            r = self.kth(good,k)
+            if r is None:
+                return
+            yield (r[1],r[0])
+            k += 1
+
+# Parallel enumeration of the solution space of one or more goods.
+# The work is partitioned first by top-level supply and then by the choice
+# made for the leading input of that supply, i.e. the input SupplyProblem
+# varies most slowly (the "most significant digit" of the odometer it runs
+# over the inputs). Each partition is enumerated in a worker process, and
+# the partitions are streamed back as they complete. If ordered is True the
+# partitions are merged in the order SupplyProblem itself would produce them,
+# so the result matches a sequential enumeration as long as the workers hash
+# strings the same way as the parent (the "fork" start method, or a fixed
+# PYTHONHASHSEED); otherwise results arrive in completion order.
+#
+# Note that the network is shipped once to every worker, and each partition
+# is materialized in the worker, so cyclic networks (whose solution space is
+# infinite) should not be enumerated this way.
+
+# Each worker holds its own copy of the network.
+_workerNetwork = None
+_workerSupplies = {}
+
+def _initEnumerationWorker(supplyNetwork):
+    global _workerNetwork, _workerSupplies
+    _workerNetwork = supplyNetwork
+    _workerSupplies = {}
+
+# Yield a tuple holding a choice (None or a SupplyTree) for every one of the
+# inputs, with the first input varying fastest, as advanceExactlyOnce does.
+def _inputChoices(inputs,sn):
+    if not inputs:
+        yield ()
+        return
+    for choice in itertools.chain([None],SupplyProblem(inputs[-1],sn)):
+        for rest in _inputChoices(inputs[:-1],sn):
+            yield rest + (choice,)
+
+# A partition is (good, index of the supply among allSupplies(good), the
+# leading input (or None if the supply has no inputs), the choice for it).
+def _partitions(goods,sn):
+    for good in goods:
+        for supIdx,supply in enumerate(allSupplies(good,sn)):
+            inputs = list(supply.inputs)
+            if not inputs:
+                yield (good,supIdx,None,None)
+            else:
+                lead = inputs[-1]
+                for choice in itertools.chain([None],SupplyProblem(lead,sn)):
+                    yield (good,supIdx,lead,choice)
+
+def _enumeratePartition(partition):
+    good,supIdx,lead,choice = partition
+    sn = _workerNetwork
+    if good not in _workerSupplies:
+        _workerSupplies[good] = list(allSupplies(good,sn))
+    supply = _workerSupplies[good][supIdx]
+    rest = [i for i in supply.inputs if i != lead]
+    trees = []
+    for choices in _inputChoices(rest,sn):
+        chosen = dict(zip(rest,choices))
+        chosen[lead] = choice
+        d = {}
+        for i in supply.inputs:
+            if chosen[i] is not None:
+                d[i] = chosen[i]
+        trees.append(SupplyTree(supply,d))
+    return (good,trees)
+
+# Yield (good, SupplyTree) pairs for all of the goods, using a pool of
+# processes (by default one per core).
+def parallelSupplyTrees(goods,sn,processes=None,ordered=False):
+    with multiprocessing.Pool(processes,
+                              initializer=_initEnumerationWorker,
+                              initargs=(sn,)) as pool:
+        if ordered:
+            results = pool.imap(_enumeratePartition,_partitions(goods,sn))
+        else:
+            results = pool.imap_unordered(_enumeratePartition,_partitions(goods,sn))
+        for (good,trees) in results:
+            for tree in trees:
+                yield (good,tree)
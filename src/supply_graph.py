@@ -0,0 +1,229 @@
+# supply_graph - Helpful Engineering's Project Data sparse supply graphs
+# Copyright (C) 2021  Robert L. Read <read.robert@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# A SupplyNetwork (or a SupplyProblemSpace of atoms.py) as two sparse
+# matrices in compressed sparse row (CSR) form over interned good IDs:
+#
+#   uses[i,j] = 1 if some producer of good i needs good j
+#   producers[i,p] = 1 if producer p can provide good i
+#
+# For a SupplyNetwork the producers are its Supplies. For a problem space
+# they are the parties: those supplying or holding an atom, and the makers
+# with the tools for one of its designs.
+#
+# Whole-library questions are then answered with sparse matrix operations
+# instead of loops over Python objects: what a good can need (reachability),
+# how deep its BOM goes, which goods have a single producer (choke points)
+# and how many goods use each good directly (fan-in).
+#
+# This module needs NumPy and SciPy (the analytics extra of the package).
+
+from supply import *
+
+try:
+    import numpy
+    import scipy.sparse
+    import scipy.sparse.csgraph
+except ImportError:
+    numpy = None
+
+def requireNumPy():
+    if numpy is None:
+        raise ImportError("supply_graph needs numpy and scipy")
+
+class SupplyGraph:
+    def __init__(self,goods,producerNames,uses,producers):
+        requireNumPy()
+        self.goods = goods
+        self.goodIndex = {g: i for (i,g) in enumerate(goods)}
+        self.producerNames = producerNames
+        self.uses = uses
+        self.producers = producers
+    # Build from, for each good, the goods its producers need and the names
+    # of its producers
+    @staticmethod
+    def build(inputsOf,producersOf):
+        requireNumPy()
+        goods = []
+        goodIndex = {}
+        def goodId(g):
+            if g not in goodIndex:
+                goodIndex[g] = len(goods)
+                goods.append(internGood(g))
+            return goodIndex[g]
+        for g in list(inputsOf) + list(producersOf):
+            goodId(g)
+        for inputs in list(inputsOf.values()):
+            for i in inputs:
+                goodId(i)
+        producerNames = []
+        producerIndex = {}
+        def csr(rows,width):
+            indptr = numpy.zeros(len(goods) + 1,dtype=numpy.int64)
+            indices = []
+            for (i,row) in enumerate(rows):
+                cs = sorted(set(row))
+                indices.extend(cs)
+                indptr[i + 1] = indptr[i] + len(cs)
+            return scipy.sparse.csr_matrix((numpy.ones(len(indices),dtype=numpy.int32),
+                                            numpy.asarray(indices,dtype=numpy.int64),indptr),
+                                           shape=(len(goods),width))
+        useRows = [[goodIndex[i] for i in inputsOf.get(g,())] for g in goods]
+        producerRows = []
+        for g in goods:
+            row = []
+            for name in producersOf.get(g,()):
+                if name not in producerIndex:
+                    producerIndex[name] = len(producerNames)
+                    producerNames.append(name)
+                row.append(producerIndex[name])
+            producerRows.append(row)
+        return SupplyGraph(goods,producerNames,csr(useRows,len(goods)),
+                           csr(producerRows,len(producerNames)))
+    def goodIds(self,goods):
+        return numpy.asarray([self.goodIndex[g] for g in goods],dtype=numpy.int64)
+    def mask(self,goods):
+        m = numpy.zeros(len(self.goods),dtype=bool)
+        m[self.goodIds(goods)] = True
+        return m
+    def namesOf(self,mask):
+        return [self.goods[i] for i in numpy.flatnonzero(mask)]
+    # The CSR arrays, e.g. for numpy.savez
+    def arrays(self):
+        return {"goods": numpy.asarray(self.goods,dtype=object),
+                "producerNames": numpy.asarray(self.producerNames,dtype=object),
+                "usesIndptr": self.uses.indptr,"usesIndices": self.uses.indices,
+                "producersIndptr": self.producers.indptr,"producersIndices": self.producers.indices}
+    def save(self,path):
+        numpy.savez_compressed(path,**self.arrays())
+    @staticmethod
+    def load(path):
+        requireNumPy()
+        with numpy.load(path,allow_pickle=True) as f:
+            goods = list(f["goods"])
+            names = list(f["producerNames"])
+            def csr(indptr,indices,width):
+                return scipy.sparse.csr_matrix((numpy.ones(len(indices),dtype=numpy.int32),indices,indptr),
+                                               shape=(len(goods),width))
+            return SupplyGraph(goods,names,
+                               csr(f["usesIndptr"],f["usesIndices"],len(goods)),
+                               csr(f["producersIndptr"],f["producersIndices"],len(names)))
+
+def supplyGraphOfNetwork(sn):
+    inputsOf = {}
+    producersOf = {}
+    for s in sn.supplies:
+        for g in s.outputs:
+            inputsOf.setdefault(g,set()).update(s.inputs)
+            producersOf.setdefault(g,[]).append(s.name)
+    return SupplyGraph.build(inputsOf,producersOf)
+
+# A SupplyProblemSpace of atoms.py, with goods named by atom identifiers
+def supplyGraphOfProblemSpace(space):
+    inputsOf = {}
+    producersOf = {}
+    for party in space.parties:
+        for atom in party.supplies | party.inventory:
+            producersOf.setdefault(atom.identifier,[]).append(party.name)
+    for design in space.designs:
+        product = design.product.identifier
+        inputsOf.setdefault(product,set()).update(a.identifier for a in design.bom)
+        for maker in space.parties:
+            if maker.compatible(design.tools):
+                producersOf.setdefault(product,[]).append(maker.name)
+    return SupplyGraph.build(inputsOf,producersOf)
+
+# The goods that can be needed, at any depth, to make the given goods
+# (including them), as a boolean mask. Each step of the search is one sparse
+# product with the frontier.
+def reachable(graph,goods):
+    seen = graph.mask(goods)
+    frontier = seen.copy()
+    usedBy = graph.uses.T.tocsr()
+    while frontier.any():
+        nxt = (usedBy @ frontier.astype(numpy.int32)) > 0
+        frontier = nxt & ~seen
+        seen |= frontier
+    return seen
+
+# The goods whose BOMs can include the given goods (including them)
+def dependents(graph,goods):
+    seen = graph.mask(goods)
+    frontier = seen.copy()
+    while frontier.any():
+        nxt = (graph.uses @ frontier.astype(numpy.int32)) > 0
+        frontier = nxt & ~seen
+        seen |= frontier
+    return seen
+
+# The goods on a cycle of uses, or that can need one
+def cyclic(graph):
+    (n,labels) = scipy.sparse.csgraph.connected_components(graph.uses,directed=True,connection="strong")
+    sizes = numpy.bincount(labels,minlength=n)
+    onCycle = (sizes[labels] > 1) | (graph.uses.diagonal() > 0)
+    return dependents(graph,graph.namesOf(onCycle)) if onCycle.any() else onCycle
+
+# The number of levels of the deepest BOM of each good, counting the good
+# itself (so 1 for a good that needs nothing); infinite for cyclic goods.
+# Each round is one sparse operation, and there are as many rounds as the
+# deepest BOM has levels.
+def bomDepths(graph):
+    inf = cyclic(graph)
+    depths = numpy.where(inf,numpy.inf,1.0)
+    uses = graph.uses.tocoo()
+    while True:
+        # the deepest input of each good
+        deepest = numpy.zeros(len(graph.goods))
+        numpy.maximum.at(deepest,uses.row,depths[uses.col])
+        nxt = numpy.where(inf,numpy.inf,deepest + 1)
+        if numpy.array_equal(nxt,depths):
+            return depths
+        depths = nxt
+
+# The number of producers of each good
+def producerCounts(graph):
+    return numpy.diff(graph.producers.indptr)
+
+# The number of goods that use each good directly
+def fanIn(graph):
+    return numpy.bincount(graph.uses.indices,minlength=len(graph.goods))
+
+# Candidates for chokePoints whose dependents are counted per csgraph call;
+# each call takes a dense row of distances per candidate, per good
+CHOKE_POINT_BLOCK = 1024
+
+# The goods with a single producer, with that producer and the number of
+# goods that depend on them, most depended on first. If roots are given,
+# only goods that some root can need are considered.
+def chokePoints(graph,roots = None):
+    single = producerCounts(graph) == 1
+    if roots is not None:
+        single &= reachable(graph,roots)
+    candidates = numpy.flatnonzero(single)
+    # how many goods can need each candidate: the goods it reaches along
+    # usedBy, found by a breadth-first search from every candidate at once
+    usedBy = graph.uses.T.tocsr()
+    counts = numpy.zeros(len(candidates),dtype=int)
+    for start in range(0,len(candidates),CHOKE_POINT_BLOCK):
+        block = candidates[start:start + CHOKE_POINT_BLOCK]
+        distances = scipy.sparse.csgraph.shortest_path(usedBy,unweighted=True,indices=block)
+        counts[start:start + len(block)] = numpy.isfinite(distances).sum(axis=1) - 1
+    result = []
+    for (i,count) in zip(candidates,counts):
+        producer = graph.producerNames[graph.producers.indices[graph.producers.indptr[i]]]
+        result.append((graph.goods[i],producer,int(count)))
+    result.sort(key=lambda r: (-r[2],r[0]))
+    return result
@@ -0,0 +1,242 @@
+import glob
+import hashlib
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from .cache import WikidataCache, normalize_term
+from .client import WikidataClient
+from .label_index import LabelIndex
+from .parser import SOURCE_HASH_KEY, Okh, search_terms
+from .utils import generate_file_name, read_yaml_file
+
+YAML_SUFFIXES = (".yml", ".yaml")
+
+
+class BatchResult(NamedTuple):
+    """what happened to one source file."""
+
+    source: Path
+    status: str  # "parsed", "skipped" or "failed"
+    seconds: float
+    error: str = ""
+
+
+def source_hash(path: Path) -> str:
+    """hash the content of a source file.
+
+    Args:
+        path: the source file.
+    Returns:
+        the sha256 hex digest of its bytes.
+    """
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def find_sources(patterns: Iterable[str]) -> list[Path]:
+    """expand directories and glob patterns into source files.
+
+    Directories are searched recursively for yaml files; files made by
+    okparser (``_refined``) are left out.
+
+    Args:
+        patterns: files, directories or glob patterns.
+    Returns:
+        the source files, each once, in order.
+    """
+    found = {}
+    for pattern in patterns:
+        for match in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            path = Path(match)
+            if path.is_dir():
+                candidates = sorted(
+                    p for p in path.rglob("*") if p.suffix in YAML_SUFFIXES
+                )
+            else:
+                candidates = [path]
+            for candidate in candidates:
+                if candidate.is_file() and "_refined" not in candidate.stem:
+                    found[candidate] = None
+    return list(found)
+
+
+def is_up_to_date(destination: Path, digest: str) -> bool:
+    """check whether a refined file was made from a source with this hash.
+
+    Args:
+        destination: the refined file.
+        digest: hash of the source file.
+    Returns:
+        True if the refined file exists and records the same hash.
+    """
+    if not destination.is_file():
+        return False
+    content = read_yaml_file(destination)
+    return isinstance(content, dict) and content.get(SOURCE_HASH_KEY) == digest
+
+
+class ResolvedTerms:
+    """search results found beforehand, standing in for a WikidataClient."""
+
+    def __init__(self, hits: dict[str, Optional[dict]]):
+        """hold the results of searches already made.
+
+        Args:
+            hits: the search result (or None) for each normalized term.
+        """
+        self.hits = hits
+
+    def pending(self, terms: Iterable[str]) -> list[str]:
+        """nothing is left to search for.
+
+        Args:
+            terms: texts to search for.
+        Returns:
+            an empty list.
+        """
+        return []
+
+    def search_many(
+        self, terms: Iterable[str], progress: Optional[Callable[[str], None]] = None
+    ) -> dict[str, Optional[dict]]:
+        """look up the results found for terms.
+
+        Args:
+            terms: texts that were searched for.
+            progress: not called, since nothing is searched for.
+        Returns:
+            the first search result (or None) for each of the terms.
+        """
+        return {t: self.hits[normalize_term(t)] for t in terms}
+
+
+def refine_file(
+    source: Path,
+    destination: Path,
+    hits: dict[str, Optional[dict]],
+    digest: str,
+) -> BatchResult:
+    """parse one source file into its refined form.
+
+    Args:
+        source: the source file.
+        destination: dir to store parsed file.
+        hits: the search result (or None) for each normalized term of the file.
+        digest: hash of the source file, recorded in the refined file.
+    Returns:
+        what happened to the file.
+    """
+    start = time.perf_counter()
+    try:
+        okh = Okh.open(source, client=ResolvedTerms(hits))
+        okh.save(destination / generate_file_name(source.name), digest)
+    except Exception as error:
+        return BatchResult(source, "failed", time.perf_counter() - start, repr(error))
+    return BatchResult(source, "parsed", time.perf_counter() - start)
+
+
+def search_all(
+    terms: Iterable[str],
+    cache_path: Optional[Path],
+    label_index_path: Optional[Path],
+) -> dict[str, Optional[dict]]:
+    """search for the terms of every file at once, with a single client.
+
+    Args:
+        terms: texts to search for.
+        cache_path: sqlite file of the wikidata cache, or None for no cache.
+        label_index_path: offline label index to search instead of wikidata, if any.
+    Returns:
+        the first search result (or None) for each normalized term.
+    """
+    terms = list(dict.fromkeys(normalize_term(t) for t in terms))
+    if label_index_path is not None:
+        with LabelIndex(label_index_path) as index:
+            return index.search_many(terms)
+    cache = WikidataCache(cache_path) if cache_path is not None else None
+    try:
+        with WikidataClient(cache=cache) as client:
+            return client.search_many(terms)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def refine_files(
+    sources: list[Path],
+    destination: Path,
+    cache_path: Optional[Path],
+    workers: Optional[int] = None,
+    force: bool = False,
+    label_index_path: Optional[Path] = None,
+) -> Iterable[BatchResult]:
+    """parse many source files in a pool of worker processes.
+
+    The terms of all of the files are searched for first, here, by one
+    client, so that wikidata sees a single rate-limited client however many
+    workers there are. The workers then only parse and write the files.
+
+    Sources whose refined files would have the same name (such as
+    ``a/mask.yml`` and ``b/okh_mask.yml``) all fail, rather than overwrite
+    each other's refined file.
+
+    Args:
+        sources: the source files.
+        destination: dir to store parsed files.
+        cache_path: sqlite file of the wikidata cache, or None for no cache.
+        workers: number of worker processes (the number of cpus if None).
+        force: parse even files whose refined file is up to date.
+        label_index_path: offline label index to search instead of wikidata, if any.
+    Yields:
+        what happened to each file, as each finishes.
+    """
+    # refined file name -> the sources that would write it
+    writers = defaultdict(list)
+    for source in sources:
+        writers[generate_file_name(source.name)].append(source)
+    # source -> (digest, its search terms)
+    todo = {}
+    for source in sources:
+        start = time.perf_counter()
+        rivals = [str(s) for s in writers[generate_file_name(source.name)]]
+        if len(rivals) > 1:
+            error = f"sources {', '.join(rivals)} have the same refined file name"
+            yield BatchResult(source, "failed", 0.0, error)
+            continue
+        try:
+            digest = source_hash(source)
+            target = destination / generate_file_name(source.name)
+            if not force and is_up_to_date(target, digest):
+                yield BatchResult(source, "skipped", time.perf_counter() - start)
+                continue
+            todo[source] = (digest, search_terms(read_yaml_file(source)))
+        except Exception as error:
+            yield BatchResult(
+                source, "failed", time.perf_counter() - start, repr(error)
+            )
+    if not todo:
+        return
+    start = time.perf_counter()
+    try:
+        hits = search_all(
+            (t for (_, terms) in todo.values() for t in terms),
+            cache_path,
+            label_index_path,
+        )
+    except Exception as error:
+        for source in todo:
+            yield BatchResult(
+                source, "failed", time.perf_counter() - start, repr(error)
+            )
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for source, (digest, terms) in todo.items():
+            file_hits = {normalize_term(t): hits[normalize_term(t)] for t in terms}
+            futures.append(
+                pool.submit(refine_file, source, destination, file_hits, digest)
+            )
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,133 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+# where the parse command keeps its cache unless told otherwise
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "okparser" / "wikidata.sqlite3"
+# how long, in seconds, a found term and a term with no match are trusted
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+
+
+class CachedLookup(NamedTuple):
+    """a cached wikidata search for a term.
+
+    ``hit`` is the first search result, or None if wikidata had no match.
+    """
+
+    hit: Optional[dict]
+
+
+def normalize_term(term: str) -> str:
+    """normalize a search term so that trivially different spellings share an entry.
+
+    Args:
+        term: bom item or tool as written in a manifest.
+    Returns:
+        the term in lower case with runs of whitespace collapsed.
+    """
+    return " ".join(term.lower().split())
+
+
+class WikidataCache:
+    """a persistent cache of wikidata searches, kept in an sqlite database.
+
+    Matches are kept for ``ttl`` seconds and misses (negative entries) for
+    ``negative_ttl`` seconds, after which the term is looked up again.
+    """
+
+    def __init__(
+        self,
+        path: Path = DEFAULT_CACHE_PATH,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        """open (creating if needed) the cache database.
+
+        Args:
+            path: sqlite database file, or ":memory:".
+            ttl: seconds a match stays fresh.
+            negative_ttl: seconds a miss stays fresh.
+            clock: source of the current time, in seconds.
+        """
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # several okparser processes may share the cache
+        self.connection = sqlite3.connect(str(path), timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS lookups "
+            "(term TEXT PRIMARY KEY, hit TEXT, fetched_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, term: str) -> Optional[CachedLookup]:
+        """look up a term.
+
+        Args:
+            term: the search term.
+        Returns:
+            the cached lookup, or None if the term is not cached or has expired.
+        """
+        row = self.connection.execute(
+            "SELECT hit, fetched_at FROM lookups WHERE term = ?",
+            (normalize_term(term),),
+        ).fetchone()
+        if row is not None:
+            hit, fetched_at = row
+            ttl = self.ttl if hit is not None else self.negative_ttl
+            if self.clock() - fetched_at < ttl:
+                self.hits += 1
+                return CachedLookup(json.loads(hit) if hit is not None else None)
+        self.misses += 1
+        return None
+
+    def put(self, term: str, hit: Optional[dict]) -> None:
+        """store the result of a search.
+
+        Args:
+            term: the search term.
+            hit: the first search result, or None if there was no match.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO lookups (term, hit, fetched_at) VALUES (?, ?, ?)",
+            (
+                normalize_term(term),
+                json.dumps(hit) if hit is not None else None,
+                self.clock(),
+            ),
+        )
+        self.connection.commit()
+
+    def purge_expired(self) -> int:
+        """delete expired entries.
+
+        Returns:
+            the number of entries deleted.
+        """
+        now = self.clock()
+        cursor = self.connection.execute(
+            "DELETE FROM lookups WHERE "
+            "(hit IS NOT NULL AND fetched_at <= ?) "
+            "OR (hit IS NULL AND fetched_at <= ?)",
+            (now - self.ttl, now - self.negative_ttl),
+        )
+        self.connection.commit()
+        return cursor.rowcount
+
+    def close(self) -> None:
+        """close the database."""
+        self.connection.close()
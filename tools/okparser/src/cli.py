@@ -1,7 +1,13 @@
+import time
+from collections import Counter
 from pathlib import Path
+from typing import Optional
 
 import typer
 
+from .batch import find_sources, refine_files
+from .cache import DEFAULT_CACHE_PATH, WikidataCache
+from .label_index import LabelIndex, build_label_index
 from .parser import Okh
 from .utils import console, generate_file_name
 
@@ -15,21 +21,103 @@ def version():
 
 
 @cli.command()
-def parse(source: str, destination: str = "."):
+def parse(
+    source: str,
+    destination: str = ".",
+    cache: bool = True,
+    cache_path: Path = DEFAULT_CACHE_PATH,
+    label_index: Optional[Path] = None,
+):
     """run the app in the current directory.
 
     Args:
         source: file to be parsed.
         destination: dir to store parsed file.
+        cache: whether to keep wikidata searches in a local cache.
+        cache_path: sqlite file holding the cache.
+        label_index: offline label index to search instead of wikidata.
     """
     if destination and Path(destination).is_file():
         console.print("[red][bold] destination directory cannot be a file")
         typer.Exit()
 
-    okh_object = Okh.open(Path(source))
+    wikidata_cache = WikidataCache(cache_path) if cache else None
+    index = LabelIndex(label_index) if label_index is not None else None
+    try:
+        okh_object = Okh.open(Path(source), wikidata_cache, index)
+    finally:
+        if wikidata_cache is not None:
+            wikidata_cache.close()
+        if index is not None:
+            index.close()
     okh_object.save(Path(destination) / generate_file_name(Path(source).name))
 
 
+@cli.command()
+def batch(
+    sources: list[str],
+    destination: str = ".",
+    workers: Optional[int] = None,
+    force: bool = False,
+    cache: bool = True,
+    cache_path: Path = DEFAULT_CACHE_PATH,
+    label_index: Optional[Path] = None,
+):
+    """parse many files in parallel, skipping those already parsed.
+
+    A file is skipped if its refined file records the hash of its current
+    content.
+
+    Args:
+        sources: files, directories or glob patterns to be parsed.
+        destination: dir to store parsed files.
+        workers: number of worker processes (the number of cpus by default).
+        force: parse files even if they are up to date.
+        cache: whether to keep wikidata searches in a local cache.
+        cache_path: sqlite file holding the cache.
+        label_index: offline label index to search instead of wikidata.
+    """
+    files = find_sources(sources)
+    Path(destination).mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    counts = Counter()
+    for result in refine_files(
+        files,
+        Path(destination),
+        cache_path if cache else None,
+        workers,
+        force,
+        label_index,
+    ):
+        counts[result.status] += 1
+        if result.status == "failed":
+            console.print(f"[red]{result.source}: {result.error}")
+    elapsed = time.perf_counter() - start
+    rate = len(files) / elapsed if elapsed > 0 else 0.0
+    console.print(
+        f"[green][bold]{len(files)} files in {elapsed:.2f}s ({rate:.1f} files/s): "
+        f"{counts['parsed']} parsed, {counts['skipped']} skipped, "
+        f"{counts['failed']} failed"
+    )
+    if counts["failed"]:
+        raise typer.Exit(code=1)
+
+
+@cli.command()
+def index(extract: Path, destination: Path):
+    """build an offline label index from a wikidata label extract.
+
+    Args:
+        extract: tab separated file of identifier, label (or alias) and description.
+        destination: index file to write.
+    """
+    start = time.perf_counter()
+    count = build_label_index(extract, destination)
+    console.print(
+        f"[green][bold]indexed {count} labels in {time.perf_counter() - start:.2f}s"
+    )
+
+
 main = cli
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import WikidataCache, normalize_term
+
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+USER_AGENT = (
+    "okparser/0.1.0 (https://github.com/helpfulengineering/project-data-platform)"
+)
+# responses worth trying again after a pause
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def search_params(term: str) -> dict[str, str]:
+    """query parameters of a wikidata entity search.
+
+    Args:
+        term: text to search for.
+    Returns:
+        the parameters for the wbsearchentities api.
+    """
+    return {
+        "action": "wbsearchentities",
+        "format": "json",
+        "language": "en",
+        "type": "item",
+        "continue": "0",
+        "search": term,
+    }
+
+
+class RateLimiter:
+    """spaces out requests so that no more than ``rate`` of them start per second."""
+
+    def __init__(
+        self,
+        rate: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """create a limiter.
+
+        Args:
+            rate: requests per second.
+            clock: source of the current time, in seconds.
+            sleep: how to wait.
+        """
+        self.interval = 1.0 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """block until the next request may start."""
+        with self.lock:
+            now = self.clock()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            self.sleep(start - now)
+
+
+class WikidataClient:
+    """a client for wikidata searches that runs them concurrently.
+
+    Requests share a pooled ``requests.Session``, at most ``max_workers`` run
+    at once and at most ``rate`` start per second. Connection errors, timeouts
+    and the statuses in RETRY_STATUSES are retried up to ``retries`` times,
+    with exponential backoff (or as long as a Retry-After header asks).
+    """
+
+    def __init__(
+        self,
+        base_url: str = WIKIDATA_API_URL,
+        cache: Optional[WikidataCache] = None,
+        max_workers: int = 8,
+        rate: float = 10.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+    ):
+        """create a client.
+
+        Args:
+            base_url: url of the wikidata api.
+            cache: cache of earlier searches, if any.
+            max_workers: most requests in flight at once.
+            rate: most requests started per second.
+            retries: times a failed request is tried again.
+            backoff: seconds to wait before the first retry; doubled for each one after.
+            timeout: seconds to wait for a response.
+        """
+        self.base_url = base_url
+        self.cache = cache
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        # cache lookups made by pending, for the search_many that follows it
+        self.looked_up = {}
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """close the connection pool."""
+        self.session.close()
+
+    def retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """how long to wait before trying again.
+
+        Args:
+            attempt: number of the attempt that failed, from 0.
+            response: the response that failed, if there was one.
+        Returns:
+            the delay in seconds.
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * 2**attempt
+
+    def fetch(self, term: str) -> Optional[dict]:
+        """search wikidata for a term, bypassing the cache.
+
+        Args:
+            term: text to search for.
+        Returns:
+            the first search result, or None if there is no match.
+        Raises:
+            RequestException: if the search still fails after the last retry.
+        """
+        attempt = 0
+        while True:
+            self.limiter.wait()
+            response = None
+            try:
+                response = self.session.get(
+                    self.base_url, params=search_params(term), timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= self.retries
+                ):
+                    response.raise_for_status()
+                    results = response.json()["search"]
+                    return results[0] if results else None
+            time.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+
+    def search(self, term: str) -> Optional[dict]:
+        """search wikidata for a term, consulting the cache first.
+
+        Args:
+            term: text to search for.
+        Returns:
+            the first search result, or None if there is no match.
+        """
+        return self.search_many([term])[term]
+
+    def pending(self, terms: Iterable[str]) -> list[str]:
+        """the searches that search_many would make for some terms.
+
+        The cache lookups are kept for the next search_many, so that a term
+        is looked up (and counted as a cache hit or miss) only once.
+
+        Args:
+            terms: texts to search for.
+        Returns:
+            the distinct normalized terms that are not in the cache.
+        """
+        keys = dict.fromkeys(normalize_term(t) for t in terms)
+        if self.cache is None:
+            return list(keys)
+        self.looked_up = {key: self.cache.get(key) for key in keys}
+        return [key for key, cached in self.looked_up.items() if cached is None]
+
+    def search_many(
+        self, terms: Iterable[str], progress: Optional[Callable[[str], None]] = None
+    ) -> dict[str, Optional[dict]]:
+        """search wikidata for many terms at once.
+
+        Terms that normalize to the same text are searched for only once, and
+        cached terms not at all.
+
+        Args:
+            terms: texts to search for.
+            progress: called with each pending normalized term (see pending)
+                as its search finishes.
+        Returns:
+            the first search result (or None) for each of the terms.
+        """
+        terms = list(terms)
+        results = {}
+        pending = []
+        looked_up, self.looked_up = self.looked_up, {}
+        for key in dict.fromkeys(normalize_term(t) for t in terms):
+            if key in looked_up:
+                cached = looked_up[key]
+            else:
+                cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                results[key] = cached.hit
+            else:
+                pending.append(key)
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {pool.submit(self.fetch, key): key for key in pending}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    results[key] = future.result()
+                    # the cache is only used from this thread
+                    if self.cache is not None:
+                        self.cache.put(key, results[key])
+                    if progress is not None:
+                        progress(key)
+        return {t: results[normalize_term(t)] for t in terms}
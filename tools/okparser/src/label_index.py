@@ -0,0 +1,325 @@
+import array
+import bisect
+import heapq
+import math
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from .cache import normalize_term
+
+# magic, number of labels, of trigram keys, of postings and bytes of text
+HEADER = struct.Struct("<8sIIII")
+MAGIC = b"OKLI1" + (b"LE\0" if sys.byteorder == "little" else b"BE\0")
+WIKIDATA_URL = "//www.wikidata.org/wiki/"
+# separates the fields of a label record in the text section
+FIELD_SEPARATOR = "\x1f"
+
+
+class LabelMatch(NamedTuple):
+    """a candidate wikidata item for a search term."""
+
+    identifier: str
+    label: str
+    description: str
+    score: float
+
+
+def trigrams(text: str) -> set[str]:
+    """the character trigrams of a normalized text, padded at the ends.
+
+    Args:
+        text: normalized text.
+    Returns:
+        the set of trigrams.
+    """
+    padded = "  " + text + " "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_key(trigram: str) -> int:
+    """the 32-bit key under which a trigram is indexed.
+
+    Args:
+        trigram: three characters.
+    Returns:
+        the key.
+    """
+    return zlib.crc32(trigram.encode("utf-8"))
+
+
+def read_label_extract(path: Path) -> Iterable[tuple[str, str, str]]:
+    """read a label extract: one tab separated line per label or alias.
+
+    Each line is ``identifier<TAB>label`` with an optional third column
+    holding the description; blank lines and lines starting with # are skipped.
+
+    Args:
+        path: the extract file.
+    Yields:
+        (identifier, label, description) for each line.
+    """
+    with open(path, encoding="utf-8") as extract:
+        for line in extract:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            description = fields[2] if len(fields) > 2 else ""
+            yield fields[0], fields[1], description
+
+
+def build_label_index(extract_path: Path, index_path: Path) -> int:
+    """build the on-disk trigram index of a label extract.
+
+    The extract is read in a single pass: label text goes straight to a
+    temporary file and the numbers go into compact arrays, so memory holds
+    the postings but none of the labels.
+
+    Args:
+        extract_path: the label extract (see read_label_extract).
+        index_path: where to write the index.
+    Returns:
+        the number of labels indexed.
+    """
+    offsets = array.array("I", [0])
+    counts = array.array("I")
+    # trigram key -> numbers of the labels holding it, in increasing order
+    postings = {}
+    # trigram -> its key, since the same trigrams come up again and again
+    keys_of = {}
+    seen = set()
+    with tempfile.TemporaryFile() as text:
+        for identifier, label, description in read_label_extract(extract_path):
+            normalized = normalize_term(label)
+            if not normalized or hash((identifier, normalized)) in seen:
+                continue
+            seen.add(hash((identifier, normalized)))
+            number = len(counts)
+            grams = trigrams(normalized)
+            for gram in grams:
+                key = keys_of.get(gram)
+                if key is None:
+                    key = keys_of[gram] = trigram_key(gram)
+                numbers = postings.get(key)
+                if numbers is None:
+                    numbers = postings[key] = array.array("I")
+                numbers.append(number)
+            counts.append(len(grams))
+            fields = (identifier, label.strip(), description.strip())
+            record = FIELD_SEPARATOR.join(
+                f.replace(FIELD_SEPARATOR, " ") for f in fields
+            )
+            offsets.append(offsets[-1] + text.write(record.encode("utf-8")))
+        keys = array.array("I", sorted(postings))
+        starts = array.array("I", [0])
+        for key in keys:
+            starts.append(starts[-1] + len(postings[key]))
+        with open(index_path, "wb") as index:
+            index.write(
+                HEADER.pack(MAGIC, len(counts), len(keys), starts[-1], offsets[-1])
+            )
+            for numbers in (offsets, counts, keys, starts):
+                numbers.tofile(index)
+            for key in keys:
+                postings[key].tofile(index)
+            text.seek(0)
+            shutil.copyfileobj(text, index)
+    return len(counts)
+
+
+class LabelIndex:
+    """an on-disk trigram index of wikidata labels, opened by memory mapping.
+
+    Candidates for a term are the labels sharing trigrams with it, ranked by
+    the Dice coefficient of the two sets of trigrams. It can stand in for a
+    WikidataClient, so manifests can be enriched without network access.
+    """
+
+    def __init__(self, path: Path, min_score: float = 0.5, max_postings: int = 10000):
+        """open an index made by build_label_index.
+
+        Args:
+            path: the index file.
+            min_score: lowest score search returns by default.
+            max_postings: longest posting list search reads in full, if it can
+                avoid it (see search).
+        Raises:
+            ValueError: if the file is not an index for this machine's byte order.
+        """
+        self.min_score = min_score
+        self.max_postings = max_postings
+        with open(path, "rb") as index:
+            self.map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, labels, keys, postings, text = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a label index for this machine")
+        self.view = memoryview(self.map)
+        position = HEADER.size
+        sections = []
+        for count in (labels + 1, labels, keys, keys + 1, postings):
+            end = position + 4 * count
+            sections.append(self.view[position:end].cast("I"))
+            position = end
+        self.offsets, self.counts, self.keys, self.starts, self.postings = sections
+        self.text = self.view[position : position + text]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def close(self) -> None:
+        """release the memory map."""
+        for view in (self.offsets, self.counts, self.keys, self.starts, self.postings):
+            view.release()
+        self.text.release()
+        self.view.release()
+        self.map.close()
+
+    def record(self, number: int) -> tuple[str, str, str]:
+        """the (identifier, label, description) of a label.
+
+        Args:
+            number: index of the label.
+        Returns:
+            its fields.
+        """
+        start, end = self.offsets[number], self.offsets[number + 1]
+        return tuple(bytes(self.text[start:end]).decode("utf-8").split(FIELD_SEPARATOR))
+
+    def search(
+        self, term: str, limit: int = 5, min_score: Optional[float] = None
+    ) -> list[LabelMatch]:
+        """rank the labels most like a term.
+
+        Only labels that can score at least min_score are considered. A label
+        of c trigrams sharing o of the q trigrams of the term scores
+        2o / (q + c) <= 2o / (q + o), so it needs o >= min_score * q /
+        (2 - min_score), and is in one of the q - o + 1 shortest posting lists
+        of the term. Candidates are taken from those lists, leaving out lists
+        longer than max_postings (common trigrams such as " th") unless no
+        shorter one is left, so labels sharing only common trigrams with the
+        term can be missed. The other lists are only probed, by binary search,
+        and candidates are scored most shared trigrams first, stopping once no
+        remaining candidate can beat the matches found.
+
+        Args:
+            term: text to search for.
+            limit: most candidates to return.
+            min_score: lowest score to return (the index's min_score if None).
+        Returns:
+            the candidates, best first.
+        """
+        if min_score is None:
+            min_score = self.min_score
+        grams = trigrams(normalize_term(term))
+        q = len(grams)
+        spans = []
+        for gram in grams:
+            key = trigram_key(gram)
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                spans.append((self.starts[i], self.starts[i + 1]))
+        if not spans:
+            return []
+        spans.sort(key=lambda span: span[1] - span[0])
+        overlap = max(1, math.ceil(min_score * q / (2 - min_score) - 1e-9))
+        short = max(1, len(spans) - overlap + 1)
+        # lists of common trigrams are probed rather than read in full
+        gathered = spans[:1] + [
+            (start, end)
+            for start, end in spans[1:short]
+            if end - start <= self.max_postings
+        ]
+        probed = [span for span in spans[1:] if span not in gathered]
+        shared = Counter()
+        for start, end in gathered:
+            shared.update(self.postings[start:end])
+        best = []
+        # candidates sharing the most trigrams so far first; one sharing n of
+        # them scores at most 2(n + p) / (q + n + p), with p lists left to probe
+        p = len(probed)
+        for number, n in shared.most_common():
+            floor = min_score
+            if len(best) == limit:
+                floor = max(floor, best[0][0])
+            if 2 * (n + p) < floor * (q + n + p):
+                break
+            c = self.counts[number]
+            # the fewest trigrams it must share to be kept
+            needed = floor * (q + c) / 2
+            if n + p < needed:
+                continue
+            for k, (start, end) in enumerate(probed):
+                if n + p - k < needed:
+                    break
+                i = bisect.bisect_left(self.postings, number, start, end)
+                if i < end and self.postings[i] == number:
+                    n += 1
+            score = 2 * n / (q + c)
+            if score < floor or (score == floor and len(best) == limit):
+                continue
+            if len(best) < limit:
+                heapq.heappush(best, (score, -number))
+            else:
+                heapq.heappushpop(best, (score, -number))
+        matches = []
+        for score, number in sorted(best, reverse=True):
+            identifier, label, description = self.record(-number)
+            matches.append(LabelMatch(identifier, label, description, score))
+        return matches
+
+    def pending(self, terms: Iterable[str]) -> list[str]:
+        """the searches that search_many would make, as WikidataClient.pending.
+
+        Args:
+            terms: texts to search for.
+        Returns:
+            the distinct normalized terms.
+        """
+        return list(dict.fromkeys(normalize_term(t) for t in terms))
+
+    def search_many(
+        self, terms: Iterable[str], progress: Optional[Callable[[str], None]] = None
+    ) -> dict[str, Optional[dict]]:
+        """find the best match of each term, as WikidataClient.search_many does.
+
+        Args:
+            terms: texts to search for.
+            progress: called with each normalized term as its search finishes.
+        Returns:
+            a search result like wikidata's for each term, or None if its
+            best match scores less than min_score.
+        """
+        terms = list(terms)
+        results = {}
+        for term in terms:
+            key = normalize_term(term)
+            if key not in results:
+                best = self.search(key, 1)
+                if best:
+                    match = best[0]
+                    results[key] = {
+                        "id": match.identifier,
+                        "url": WIKIDATA_URL + match.identifier,
+                        "label": match.label,
+                        "description": match.description,
+                        "score": match.score,
+                    }
+                else:
+                    results[key] = None
+                if progress is not None:
+                    progress(key)
+        return {term: results[normalize_term(term)] for term in terms}
@@ -1,11 +1,32 @@
 from pathlib import Path
+from typing import Optional
 
 import typer
 import yaml
 
 from tools.okparser.src import utils
+from tools.okparser.src.cache import WikidataCache
+from tools.okparser.src.client import WikidataClient
 
 __REQUIRED_FIELDS__ = frozenset({"bom", "tool-list"})
+# key under which a refined file records the hash of its source
+SOURCE_HASH_KEY = "okparser-source-hash"
+
+
+def search_terms(yaml_content: dict) -> list[str]:
+    """the terms parsing a manifest will search wikidata for.
+
+    Args:
+        yaml_content: the manifest.
+    Returns:
+        the alternatives of its bom and tool-list items that have no atoms yet.
+    """
+    items = []
+    if yaml_content.get("bom-atoms") is None:
+        items += yaml_content.get("bom", "").split(",")
+    if yaml_content.get("tool-list-atoms") is None:
+        items += yaml_content.get("tool-list", "").split(",")
+    return [term for terms in utils.split_items(items) for term in terms]
 
 
 class Okh:
@@ -16,25 +37,44 @@ class Okh:
     # extracted yaml content
     yaml_content: dict
 
-    def __init__(self, source_path: Path):
+    def __init__(
+        self,
+        source_path: Path,
+        cache: Optional[WikidataCache] = None,
+        client: Optional[WikidataClient] = None,
+    ):
         """Initialize class and generate okh
 
         Args:
             source_path:  path to file to source file.
+            cache: cache of wikidata searches, if any.
+            client: what to search wikidata with (a WikidataClient or a
+                LabelIndex); a WikidataClient is made if not given.
         """
-        self.generate_okh(source_path)
+        self.cache = cache
+        if client is not None:
+            self.generate_okh(source_path, client)
+        else:
+            with WikidataClient(cache=cache) as client:
+                self.generate_okh(source_path, client)
 
     @staticmethod
-    def open(source_path: Path):
+    def open(
+        source_path: Path,
+        cache: Optional[WikidataCache] = None,
+        client: Optional[WikidataClient] = None,
+    ):
         """open the source file and generate okh.
 
         Args:
             source_path: path to file to process.
+            cache: cache of wikidata searches, if any.
+            client: what to search wikidata with, if not a new WikidataClient.
 
         Returns:
             okh instance.
         """
-        return Okh(source_path)
+        return Okh(source_path, cache, client)
 
     def bom_atoms_exists(self):
         """check if bom atoms exists."""
@@ -45,11 +85,14 @@ class Okh:
         """check if tool list atoms exists."""
         return self.yaml_content.get("tool-list-atoms") is not None
 
-    def generate_okh(self, source_path) -> None:
+    def generate_okh(
+        self, source_path, client: Optional[WikidataClient] = None
+    ) -> None:
         """Parse a yaml file and obtain wikidata for boms and tool-lists
 
         Args:
             source_path: file to process
+            client: wikidata client to search with, if any.
 
         """
         self.yaml_content = utils.read_yaml_file(source_path)
@@ -58,23 +101,26 @@ class Okh:
             typer.Exit()
         if not self.bom_atoms_exists():
             bom_items = self.yaml_content.get("bom", "").split(",")
-            self.bom_atoms = utils.get_wiki_data(bom_items)
+            self.bom_atoms = utils.get_wiki_data(bom_items, self.cache, client)
 
         if not self.tool_list_atoms_exist():
             tool_list = self.yaml_content.get("tool-list", "").split(",")
-            self.tool_list_atoms = utils.get_wiki_data(tool_list)
+            self.tool_list_atoms = utils.get_wiki_data(tool_list, self.cache, client)
 
-    def save(self, destination_path: Path) -> None:
+    def save(self, destination_path: Path, source_hash: Optional[str] = None) -> None:
         """save newly generated yaml contents into a file.
 
         Args:
             destination_path: where to save file.
+            source_hash: hash of the source file, recorded in the new one.
         """
         yaml_content = (
             self.yaml_content
             | {"bom-atoms": self.bom_atoms}
             | {"tool-list-atoms": self.tool_list_atoms}
         )
+        if source_hash is not None:
+            yaml_content[SOURCE_HASH_KEY] = source_hash
         if yaml_content:
             with open(
                 destination_path,
@@ -1,28 +1,18 @@
 import re
 from pathlib import Path
+from typing import Optional
 
-import requests
 import typer
 import yaml
 from rich.console import Console
 
+from .cache import WikidataCache
+from .client import WikidataClient
+
 # Console for pretty printing.
 console = Console()
 
 
-def get_url(item: str) -> str:
-    """construct wikidata api endpoint.
-
-    Returns:
-        The wikidata api url.
-    """
-    url = (
-        f"https://www.wikidata.org/w/api.php?action=wbsearchentities&format=json&language=en&type=item&continue=0"
-        f"&search={'+'.join(item.split())} "
-    )
-    return url
-
-
 def generate_file_name(file_name: str) -> str:
     """generate file name of new yaml file to be created.
 
@@ -53,29 +43,56 @@ def read_yaml_file(path: Path) -> dict:
             console.print_exception()
 
 
-def get_wiki_data(items: list[str]) -> list[dict[str, str]]:
+def split_items(items: list[str]) -> list[list[str]]:
+    """split each item into the alternatives to search for.
+
+    Args:
+        items: list of items(bom items, tools) to be searched.
+    Returns:
+        the alternatives of each item, split on the 'or' keyword.
+    """
+    return [item.split("or") for item in items]
+
+
+def get_wiki_data(
+    items: list[str],
+    cache: Optional[WikidataCache] = None,
+    client: Optional[WikidataClient] = None,
+) -> list[dict[str, str]]:
     """search the wikidata api for items.
 
+    All of the searches are made together, concurrently, by the client.
+
     Args:
         items: list of items(bom items, tools) to be searched.
+        cache: cache of earlier searches, used if no client is given.
+        client: wikidata client; one is made (and closed) if not given.
     Returns:
         A list of search descriptions for each item.
     """
+    # look for 'or' keyword in text and search each item
+    sub_items = split_items(items)
+    terms = [sub_item for subs in sub_items for sub_item in subs]
+    own_client = client is None
+    if own_client:
+        client = WikidataClient(cache=cache)
+    try:
+        length = len(client.pending(terms))
+        with typer.progressbar(length=length, color=True) as progress:
+            hits = client.search_many(terms, lambda term: progress.update(1))
+    finally:
+        if own_client:
+            client.close()
     item_list = []
-    with typer.progressbar(items, color=True) as progress:
-        for item in progress:
-            item_dict = {"identifier": "", "description": item.strip(), "link": ""}
-            # look for 'or' keyword in text and search each item
-            sub_items = item.split("or")
-            for sub_item in sub_items:
-                response = requests.get(get_url(sub_item)).json()
-                if response["search"]:
-                    # get the first result from the search results for now
-                    item_dict["identifier"] = response["search"][0]["id"]
-                    item_dict["link"] = re.sub(
-                        "//www.", "https://", response["search"][0]["url"]
-                    )
-                    break
-                console.print(f"\t[red]couldn't find wikidata for {sub_item}")
-            item_list.append(item_dict)
+    for item, subs in zip(items, sub_items):
+        item_dict = {"identifier": "", "description": item.strip(), "link": ""}
+        for sub_item in subs:
+            hit = hits[sub_item]
+            if hit is not None:
+                # get the first result from the search results for now
+                item_dict["identifier"] = hit["id"]
+                item_dict["link"] = re.sub("//www.", "https://", hit["url"])
+                break
+            console.print(f"\t[red]couldn't find wikidata for {sub_item}")
+        item_list.append(item_dict)
     return item_list
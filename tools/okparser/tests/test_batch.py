@@ -0,0 +1,92 @@
+from typer.testing import CliRunner
+
+from tools.okparser.src import batch
+from tools.okparser.src.batch import find_sources, source_hash
+from tools.okparser.src.cache import WikidataCache, normalize_term
+from tools.okparser.src.cli import cli
+from tools.okparser.src.parser import SOURCE_HASH_KEY
+from tools.okparser.src.utils import read_yaml_file
+
+manifest = """
+title: {title}
+bom: cotton fabric, elastic
+tool-list: needle
+"""
+
+
+def test_batch_parses_in_parallel_and_skips_unchanged(tmp_path):
+    sources = tmp_path / "library"
+    (sources / "masks").mkdir(parents=True)
+    first = sources / "mask.yml"
+    second = sources / "masks" / "okh_gown.yaml"
+    first.write_text(manifest.format(title="mask"))
+    second.write_text(manifest.format(title="gown"))
+    (sources / "okh_mask_refined.yml").write_text("title: old output\n")
+    assert find_sources([str(sources)]) == [first, second]
+
+    # every term is cached, so nothing is searched for online
+    cache_path = tmp_path / "wikidata.sqlite3"
+    with WikidataCache(cache_path) as cache:
+        cache.put("cotton fabric", {"id": "Q1", "url": "//www.wikidata.org/wiki/Q1"})
+        cache.put("elastic", None)
+        cache.put("needle", {"id": "Q2", "url": "//www.wikidata.org/wiki/Q2"})
+
+    out = tmp_path / "out"
+    args = ["batch", str(sources), "--destination", str(out), "--workers", "2"]
+    args += ["--cache-path", str(cache_path)]
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert "2 parsed, 0 skipped, 0 failed" in result.output
+    refined = read_yaml_file(out / "okh_mask_refined.yml")
+    assert refined[SOURCE_HASH_KEY] == source_hash(first)
+    assert refined["bom-atoms"][0]["identifier"] == "Q1"
+    assert (out / "okh_gown_refined.yaml").exists()
+
+    result = CliRunner().invoke(cli, args)
+    assert "0 parsed, 2 skipped, 0 failed" in result.output
+
+    second.write_text(manifest.format(title="gown, revised"))
+    result = CliRunner().invoke(cli, args)
+    assert "1 parsed, 1 skipped, 0 failed" in result.output
+    assert read_yaml_file(out / "okh_gown_refined.yaml")["title"] == "gown, revised"
+
+
+def test_batch_searches_once_for_all_workers(tmp_path, monkeypatch):
+    for title in ["mask", "gown", "cap"]:
+        (tmp_path / f"{title}.yml").write_text(manifest.format(title=title))
+    searches = []
+
+    def search_all(terms, cache_path, label_index_path):
+        terms = list(terms)
+        searches.append(terms)
+        return {"cotton fabric": {"id": "Q1", "url": "//www.x/Q1"}} | {
+            t: None for t in ["elastic", "needle"]
+        }
+
+    monkeypatch.setattr(batch, "search_all", search_all)
+    out = tmp_path / "out"
+    out.mkdir()
+    results = list(batch.refine_files(find_sources([str(tmp_path)]), out, None, 2))
+    assert [r.status for r in results] == ["parsed"] * 3
+    assert len(searches) == 1 and len(searches[0]) == 9
+    refined = read_yaml_file(out / "okh_cap_refined.yml")
+    assert refined["bom-atoms"][0]["identifier"] == "Q1"
+
+
+def test_batch_fails_sources_with_the_same_refined_file(tmp_path, monkeypatch):
+    library = tmp_path / "library"
+    names = ["a/okh_gown.yml", "b/okh_gown.yml", "mask.yml", "okh_mask.yml", "cap.yml"]
+    for name in names:
+        (library / name).parent.mkdir(parents=True, exist_ok=True)
+        (library / name).write_text(manifest.format(title=name))
+    monkeypatch.setattr(
+        batch,
+        "search_all",
+        lambda terms, *paths: {normalize_term(t): None for t in terms},
+    )
+    out = tmp_path / "out"
+    out.mkdir()
+    results = batch.refine_files(find_sources([str(library)]), out, None, 1)
+    statuses = {r.source.relative_to(library).as_posix(): r.status for r in results}
+    assert statuses == {name: "failed" for name in names[:4]} | {"cap.yml": "parsed"}
+    assert [p.name for p in out.iterdir()] == ["okh_cap_refined.yml"]
@@ -0,0 +1,33 @@
+from tools.okparser.src.cache import CachedLookup, WikidataCache
+
+hit = {"id": "Q49013", "url": "//www.wikidata.org/wiki/Q49013"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hits_misses_and_expiry(tmp_path):
+    clock = Clock()
+    path = tmp_path / "cache" / "wikidata.sqlite3"
+    with WikidataCache(path, ttl=100, negative_ttl=10, clock=clock) as cache:
+        assert cache.get("Sewing machine") is None
+        cache.put("Sewing machine", hit)
+        cache.put("flux capacitor", None)
+        assert cache.get("  sewing   MACHINE ") == CachedLookup(hit)
+        assert cache.get("flux capacitor") == CachedLookup(None)
+        clock.now += 50
+        assert cache.get("flux capacitor") is None
+        assert cache.get("sewing machine") == CachedLookup(hit)
+        assert (cache.hits, cache.misses) == (3, 2)
+        assert cache.purge_expired() == 1
+
+    # entries outlive the process that made them
+    with WikidataCache(path, ttl=100, negative_ttl=10, clock=clock) as cache:
+        assert cache.get("sewing machine") == CachedLookup(hit)
+        clock.now += 50
+        assert cache.get("sewing machine") is None
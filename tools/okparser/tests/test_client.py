@@ -0,0 +1,134 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from tools.okparser.src.cache import WikidataCache
+from tools.okparser.src.client import RateLimiter, WikidataClient
+from tools.okparser.src.utils import get_wiki_data
+
+hits = {
+    "sewing machine": {"id": "Q49013", "url": "//www.wikidata.org/wiki/Q49013"},
+    "fabric ties": {"id": "Q1", "url": "//www.wikidata.org/wiki/Q1"},
+    "coffee tin ties": {"id": "Q2", "url": "//www.wikidata.org/wiki/Q2"},
+}
+
+
+class StubWikidata(ThreadingHTTPServer):
+    """a local stand in for the wikidata search api.
+
+    It counts the searches for each term, and answers the first
+    ``failures[term]`` of them with a 503.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.searches = Counter()
+        self.failures = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/w/api.php"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        term = parse_qs(urlparse(self.path).query)["search"][0]
+        with self.server.lock:
+            self.server.searches[term] += 1
+            fail = self.server.failures[term] > 0
+            self.server.failures[term] -= 1
+        if fail:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        hit = hits.get(term)
+        body = json.dumps({"search": [hit] if hit else []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubWikidata()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_search_many_deduplicates_and_retries(stub):
+    stub.failures["sewing machine"] = 2
+    with WikidataClient(stub.url, rate=1000, backoff=0) as client:
+        found = client.search_many(["Sewing machine", "sewing  machine", "Pliers"])
+    assert found == {
+        "Sewing machine": hits["sewing machine"],
+        "sewing  machine": hits["sewing machine"],
+        "Pliers": None,
+    }
+    assert stub.searches == Counter({"sewing machine": 3, "pliers": 1})
+
+
+def test_search_gives_up_after_retries(stub):
+    stub.failures["sewing machine"] = 5
+    with WikidataClient(stub.url, rate=1000, retries=2, backoff=0) as client:
+        with pytest.raises(requests.HTTPError):
+            client.search("sewing machine")
+    assert stub.searches["sewing machine"] == 3
+
+
+def test_get_wiki_data_searches_each_term_once(stub, tmp_path):
+    items = ["Sewing machine", " fabric ties or coffee tin ties", "pliers"]
+    with WikidataCache(tmp_path / "wikidata.sqlite3") as cache:
+        with WikidataClient(stub.url, cache=cache, rate=1000) as client:
+            assert client.pending(items + ["pliers "]) == [
+                "sewing machine",
+                "fabric ties or coffee tin ties",
+                "pliers",
+            ]
+            first = get_wiki_data(items, client=client)
+            # a warm cache leaves nothing to search for, or to show progress on
+            assert client.pending(["Pliers", "fabric ties"]) == []
+            second = get_wiki_data(items, client=client)
+        # terms looked up by pending are not looked up again by search_many
+        assert (cache.hits, cache.misses) == (6, 7)
+    assert first == second
+    assert first[0] == {
+        "identifier": "Q49013",
+        "description": "Sewing machine",
+        "link": "https://wikidata.org/wiki/Q49013",
+    }
+    assert first[1]["identifier"] == "Q1"
+    assert first[2]["identifier"] == ""
+    assert stub.searches == Counter(
+        {"sewing machine": 1, "fabric ties": 1, "coffee tin ties": 1, "pliers": 1}
+    )
+
+
+def test_rate_limiter_spaces_requests():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+
+    limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        limiter.wait()
+    assert waits == [0.25, 0.5]
+    now[0] = 10.0
+    limiter.wait()
+    assert waits == [0.25, 0.5]
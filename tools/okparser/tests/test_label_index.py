@@ -0,0 +1,70 @@
+import pytest
+from typer.testing import CliRunner
+
+from tools.okparser.src.cli import cli
+from tools.okparser.src.label_index import LabelIndex, build_label_index
+from tools.okparser.src.utils import get_wiki_data, read_yaml_file
+
+extract = """# identifier, label or alias, description
+Q49013\tsewing machine\tmachine used to stitch fabric
+Q49013\tsewing-machine
+Q40847\tscissors\thand-operated cutting instrument
+Q40847\tshears
+Q1\tcable tie\ttype of fastener
+Q1\tzip tie
+Q2\ttin can\tcontainer made of thin metal
+Q3\tcoffee\tbrewed drink
+"""
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    source = tmp_path / "labels.tsv"
+    source.write_text(extract)
+    path = tmp_path / "labels.idx"
+    assert build_label_index(source, path) == 8
+    return path
+
+
+def test_search_ranks_candidates(index_path):
+    with LabelIndex(index_path) as index:
+        assert len(index) == 8
+        matches = index.search("Sewing Machines", limit=2)
+        assert [m.identifier for m in matches] == ["Q49013", "Q49013"]
+        assert matches[0].label == "sewing machine"
+        assert matches[0].description == "machine used to stitch fabric"
+        assert matches[0].score > matches[1].score
+        assert index.search("shears")[0].score == 1.0
+        assert all(m.score < 0.2 for m in index.search("xylophone"))
+
+
+def test_search_many_stands_in_for_the_client(index_path):
+    with LabelIndex(index_path) as index:
+        items = ["Sewing machine", " zip ties or coffee tin ties", "xylophone"]
+        atoms = get_wiki_data(items, client=index)
+    assert atoms[0] == {
+        "identifier": "Q49013",
+        "description": "Sewing machine",
+        "link": "https://wikidata.org/wiki/Q49013",
+    }
+    assert atoms[1]["identifier"] == "Q1"
+    assert atoms[2]["identifier"] == ""
+
+
+def test_cli_builds_and_uses_an_index(tmp_path):
+    source = tmp_path / "labels.tsv"
+    source.write_text(extract)
+    path = tmp_path / "labels.idx"
+    result = CliRunner().invoke(cli, ["index", str(source), str(path)])
+    assert "indexed 8 labels" in result.output
+
+    manifest = tmp_path / "mask.yml"
+    manifest.write_text(
+        "title: mask\nbom: cable ties\ntool-list: scissors, sewing machine\n"
+    )
+    args = ["parse", str(manifest), "--destination", str(tmp_path), "--no-cache"]
+    result = CliRunner().invoke(cli, args + ["--label-index", str(path)])
+    assert result.exit_code == 0, result.output
+    refined = read_yaml_file(tmp_path / "okh_mask_refined.yml")
+    assert [a["identifier"] for a in refined["bom-atoms"]] == ["Q1"]
+    assert [a["identifier"] for a in refined["tool-list-atoms"]] == ["Q40847", "Q49013"]
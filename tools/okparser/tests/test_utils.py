@@ -1,14 +1,6 @@
 import pytest
 
-from tools.okparser.src.utils import get_url, generate_file_name
-
-
-def test_get_url():
-    assert (
-        get_url("sewing machine")
-        == "https://www.wikidata.org/w/api.php?action=wbsearchentities&format=json"
-        "&language=en&type=item&continue=0&search=sewing+machine "
-    )
+from tools.okparser.src.utils import generate_file_name
 
 
 @pytest.mark.parametrize(